@@ -0,0 +1,450 @@
+"""
+Архив действий Legal CRM
+Старые действия и действия закрытых дел переносятся из activities в годовые
+файлы SQLite (archive/activities_2023.db). Списки подключают архив через
+ATTACH только для диапазона дат ?from=&to=, который его затрагивает; основная
+база остается небольшой, а архивные файлы почти не меняются и выгружаются на
+Яндекс.Диск один раз
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from flask import Blueprint, jsonify
+
+from archive_files import archive_dir, archive_path
+from list_queries import ACTIVITY_COLUMNS, ARCHIVE_PARENTS_VERSION, CLOSED_STATUSES, ENTITIES
+from row_codec import iso_timestamp, to_epoch
+from sql_profiler import admin_required
+
+logger = logging.getLogger(__name__)
+
+# Действия старше стольких дней переносятся в архив (0 - архив выключен)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+
+# Действия дел в закрытых статусах, не менявшихся столько дней (0 - не переносить)
+ARCHIVE_CLOSED_AFTER_DAYS = int(os.environ.get('ARCHIVE_CLOSED_AFTER_DAYS', 180))
+
+# Строк в одной транзакции переноса
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+
+# Пауза между пачками: запросы успевают взять блокировку записи
+ARCHIVE_PAUSE_SECONDS = float(os.environ.get('ARCHIVE_PAUSE_SECONDS', 0.05))
+
+# Как часто воркер переносит новые старые строки, часы
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 24))
+
+# Таблицы, у которых есть архив (list_queries.ENTITIES[...].archive_where)
+ARCHIVED_TABLES = ('activities',)
+
+ARCHIVE_SCHEMA_PREFIX = 'archive_'
+
+# Схема архивного файла: те же колонки без внешних ключей (клиенты и дела - в основной базе)
+ARCHIVE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {schema}.activities (
+        id INTEGER PRIMARY KEY,
+        case_id INTEGER,
+        client_id INTEGER,
+        activity_type TEXT NOT NULL,
+        description TEXT,
+        datetime INTEGER
+    )
+"""
+ARCHIVE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_datetime ON activities (datetime)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_client_datetime ON activities (client_id, datetime)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_case_datetime ON activities (case_id, datetime)',
+)
+
+# Следующая пачка строк одного года для переноса (по id после последней перенесенной)
+CANDIDATES_SQL = f"""
+    SELECT id FROM main.activities
+    WHERE id > ? AND datetime >= ? AND datetime < ?
+      AND (datetime < ? OR case_id IN (
+          SELECT id FROM main.cases
+          WHERE status IN ({', '.join('?' for _ in CLOSED_STATUSES)}) AND updated_at < ?))
+    ORDER BY id
+    LIMIT ?
+"""
+
+# Строки архива, видимые в списках (удаленные клиенты и дела их скрывают)
+VISIBLE_WHERE = ENTITIES['activities'].archive_where.format(a='x')
+
+archive_bp = Blueprint('archive', __name__)
+
+
+def _year_bounds(year: int) -> Tuple[int, int]:
+    return to_epoch(f'{year}-01-01'), to_epoch(f'{year + 1}-01-01')
+
+
+def _visibility_key(conn) -> str:
+    """Поколение и версия счетчика ARCHIVE_PARENTS_VERSION: ключ посчитанных visible_rows"""
+    row = conn.execute("SELECT generation, version FROM table_versions WHERE table_name = ?",
+                       (ARCHIVE_PARENTS_VERSION,)).fetchone()
+    return f'{row[0]}:{row[1]}' if row else ''
+
+
+def _requested_years(args: Mapping[str, str]) -> Optional[Tuple[int, int]]:
+    """Годы диапазона ?from=&to= (None - диапазона нет или даты разберет build_list_query)"""
+    if not args.get('from') and not args.get('to'):
+        return None
+    try:
+        first = datetime.strptime(args['from'], '%Y-%m-%d').year if args.get('from') else 0
+        last = datetime.strptime(args['to'], '%Y-%m-%d').year if args.get('to') else 9999
+    except ValueError:
+        return None
+    return first, last
+
+
+class ActivityArchiver:
+    """
+    Перенос действий в годовые архивные файлы
+
+    Строка копируется в файл своего года (INSERT OR REPLACE по id) и удаляется
+    из activities в той же транзакции; SQLite фиксирует обе базы атомарно.
+    Повторный или параллельный (другой воркер) перенос той же пачки безвреден.
+    Учет файлов - таблица activity_archives основной базы: число строк и
+    ревизия, которую сравнивает с выгруженной синхронизация.
+    """
+
+    def __init__(self):
+        self.database = None
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Запускает поток (заново после fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='activity-archiver', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Внеочередной запуск (после восстановления базы из копии)"""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.archive()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Ошибка архивации действий: {e}")
+            self._wakeup.wait(ARCHIVE_INTERVAL_HOURS * 3600)
+            self._wakeup.clear()
+
+    def attach(self, conn, years) -> Tuple[str, ...]:
+        """
+        Подключает архивы годов к соединению пула (вне транзакции)
+
+        Подключенные архивы остаются на соединении для следующих запросов;
+        лишние отключаются, только если не хватает лимита ATTACH.
+
+        Returns:
+            tuple: Имена схем архивов, файлы которых есть на диске
+
+        Raises:
+            ValueError: Годов больше, чем SQLite подключает к одному соединению
+        """
+        needed = {f'{ARCHIVE_SCHEMA_PREFIX}{year}': year for year in years}
+        capacity = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(needed) > capacity:
+            raise ValueError(f'Диапазон дат захватывает {len(needed)} архивных лет, за один запрос '
+                             f'доступно не больше {capacity}: сузьте from/to')
+        attached = [row[1] for row in conn.execute("PRAGMA database_list").fetchall()
+                    if row[1].startswith(ARCHIVE_SCHEMA_PREFIX)]
+        spare = capacity - len(set(attached) | set(needed))
+        for schema in attached:
+            if spare >= 0:
+                break
+            if schema not in needed:
+                conn.execute(f"DETACH DATABASE {schema}")
+                spare += 1
+
+        schemas = []
+        for schema, year in sorted(needed.items()):
+            if schema not in attached:
+                path = archive_path(self.database.db_name, year)
+                if not os.path.exists(path):
+                    # ATTACH создал бы пустой файл; архив еще не скачан после восстановления
+                    logger.warning(f"⚠️ Нет архивного файла {path}")
+                    continue
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            schemas.append(schema)
+        return tuple(schemas)
+
+    def reconcile(self, conn) -> List[int]:
+        """
+        Учитывает архивные файлы, которых нет в activity_archives
+
+        Так бывает после восстановления основной базы из копии, сделанной до
+        появления файла: без строки учета архив не подключался бы к спискам.
+        Ревизия не выгружена - файл уйдет на Диск при следующей синхронизации.
+
+        Returns:
+            list: Годы добавленных файлов
+        """
+        directory = archive_dir(self.database.db_name)
+        if not os.path.isdir(directory):
+            return []
+        known = {row[0] for row in conn.execute("SELECT year FROM activity_archives").fetchall()}
+        added = []
+        for name in sorted(os.listdir(directory)):
+            year = name[len('activities_'):-len('.db')]
+            if not (name.startswith('activities_') and name.endswith('.db') and year.isdigit()):
+                continue
+            if int(year) in known:
+                continue
+            source = sqlite3.connect(os.path.join(directory, name))
+            try:
+                rows = source.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Архивный файл {name} не прочитан: {e}")
+                continue
+            finally:
+                source.close()
+            conn.execute("INSERT OR IGNORE INTO activity_archives (year, rows, revision) VALUES (?, ?, 1)",
+                         (int(year), rows))
+            added.append(int(year))
+        conn.commit()
+        if added:
+            logger.info(f"🗄️ Учтены архивные файлы: {', '.join(map(str, added))}")
+        return added
+
+    def count_visible(self, conn, years: List[Tuple[int, int]], key: str):
+        """
+        Пересчитывает visible_rows архивов (годы с ревизиями) для ключа key
+
+        Архивы подключаются пачками в пределах лимита ATTACH соединения.
+        Результат не сохраняется, если за время подсчета файл изменился
+        (перенос сдвинул бы счетчик уже после подсчета); файла, которого нет
+        на диске, в списках нет - он считается пустым до скачивания.
+        """
+        capacity = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        for start in range(0, len(years), capacity):
+            chunk = dict(years[start:start + capacity])
+            attached = self.attach(conn, list(chunk))
+            for year, revision in chunk.items():
+                schema = f'{ARCHIVE_SCHEMA_PREFIX}{year}'
+                if schema in attached:
+                    rows = conn.execute(f"SELECT COUNT(*) FROM {schema}.activities x WHERE {VISIBLE_WHERE}").fetchone()[0]
+                    stored_key = key
+                else:
+                    rows, stored_key = 0, None
+                conn.execute("""
+                    UPDATE activity_archives SET visible_rows = ?, visible_key = ?
+                    WHERE year = ? AND revision = ?
+                """, (rows, stored_key, year, revision))
+                conn.commit()
+
+    def _prepare(self, conn, year: int) -> str:
+        """Подключает (и при необходимости создает) архив года для записи"""
+        os.makedirs(archive_dir(self.database.db_name), exist_ok=True)
+        schema = f'{ARCHIVE_SCHEMA_PREFIX}{year}'
+        attached = [row[1] for row in conn.execute("PRAGMA database_list").fetchall()
+                    if row[1].startswith(ARCHIVE_SCHEMA_PREFIX)]
+        if schema not in attached:
+            # Соединению из пула списки могли подключить архивы до лимита ATTACH
+            for other in attached:
+                conn.execute(f"DETACH DATABASE {other}")
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (archive_path(self.database.db_name, year),))
+        conn.execute(ARCHIVE_TABLE_SQL.format(schema=schema))
+        for index in ARCHIVE_INDEXES:
+            conn.execute(index.format(schema=schema))
+        conn.commit()
+        return schema
+
+    def archive(self, now: Optional[int] = None) -> Dict[int, int]:
+        """
+        Переносит в архив действия старше ARCHIVE_AFTER_DAYS и действия
+        закрытых дел, не менявшихся ARCHIVE_CLOSED_AFTER_DAYS
+
+        Returns:
+            dict: Год -> перенесено строк
+        """
+        now = int(time.time()) if now is None else now
+        cutoff = now - ARCHIVE_AFTER_DAYS * 86400
+        # Без переноса закрытых дел условие по ним не выполняется никогда
+        closed_cutoff = now - ARCHIVE_CLOSED_AFTER_DAYS * 86400 if ARCHIVE_CLOSED_AFTER_DAYS > 0 else None
+
+        with self._run_lock:
+            conn = self.database.get_connection()
+            try:
+                self.reconcile(conn)
+                if ARCHIVE_AFTER_DAYS <= 0:
+                    return {}
+                years = [row[0] for row in conn.execute(f"""
+                    SELECT DISTINCT CAST(strftime('%Y', datetime, 'unixepoch') AS INTEGER)
+                    FROM activities
+                    WHERE datetime < ? OR case_id IN (
+                        SELECT id FROM cases
+                        WHERE status IN ({', '.join('?' for _ in CLOSED_STATUSES)}) AND updated_at < ?)
+                """, (cutoff, *CLOSED_STATUSES, closed_cutoff)).fetchall() if row[0] is not None]
+                conn.commit()
+                moved = {}
+                for year in sorted(years):
+                    moved[year] = self._archive_year(conn, year, cutoff, closed_cutoff)
+            finally:
+                conn.close()
+
+        total = sum(moved.values())
+        if total:
+            logger.info(f"🗄️ В архив перенесено {total} действий: "
+                        + ', '.join(f'{year} - {count}' for year, count in moved.items() if count))
+        return moved
+
+    def _archive_year(self, conn, year: int, cutoff: int, closed_cutoff: Optional[int]) -> int:
+        schema = self._prepare(conn, year)
+        year_from, year_to = _year_bounds(year)
+        columns = ', '.join(ACTIVITY_COLUMNS)
+        moved, last_id = 0, 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row[0] for row in conn.execute(CANDIDATES_SQL, (
+                last_id, year_from, year_to, cutoff, *CLOSED_STATUSES, closed_cutoff, ARCHIVE_BATCH_SIZE
+            )).fetchall()]
+            if not ids:
+                conn.rollback()
+                break
+            placeholders = ', '.join('?' for _ in ids)
+            visible_sql = f"SELECT COUNT(*) FROM {schema}.activities x WHERE x.id IN ({placeholders}) AND {VISIBLE_WHERE}"
+            # Строки, уже лежащие в архиве (вернулись восстановлением из копии), заменяются
+            existing = conn.execute(f"SELECT COUNT(*) FROM {schema}.activities WHERE id IN ({placeholders})",
+                                    ids).fetchone()[0]
+            visible_before = conn.execute(visible_sql, ids).fetchone()[0]
+            conn.execute(f"INSERT OR REPLACE INTO {schema}.activities ({columns}) "
+                         f"SELECT {columns} FROM main.activities WHERE id IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM main.activities WHERE id IN ({placeholders})", ids)
+            visible = conn.execute(visible_sql, ids).fetchone()[0] - visible_before
+            # Счетчик видимых строк сдвигается на перенесенные; у нового файла он сразу точный
+            conn.execute("""
+                INSERT INTO activity_archives (year, rows, revision, visible_rows, visible_key)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (year) DO UPDATE SET rows = rows + excluded.rows, revision = revision + 1,
+                                                 visible_rows = visible_rows + excluded.visible_rows
+            """, (year, len(ids) - existing, visible, _visibility_key(conn)))
+            conn.commit()
+            moved += len(ids)
+            last_id = ids[-1]
+            if len(ids) < ARCHIVE_BATCH_SIZE:
+                break
+            time.sleep(ARCHIVE_PAUSE_SECONDS)
+        return moved
+
+
+archiver = ActivityArchiver()
+
+
+def attach_archives(conn, entity: str, args: Mapping[str, str]) -> Tuple[str, ...]:
+    """
+    Архивы, которые нужно объединить со списком сущности
+
+    Архив подключается, только если в запросе есть диапазон ?from=/?to= и он
+    пересекает годы, у которых есть архивный файл.
+
+    Returns:
+        tuple: Схемы для build_list_query(archives=...)
+
+    Raises:
+        ValueError: Диапазон захватывает слишком много архивных лет
+    """
+    if entity not in ARCHIVED_TABLES or archiver.database is None:
+        return ()
+    years = _requested_years(args)
+    if years is None:
+        return ()
+    archived = [row[0] for row in conn.execute(
+        "SELECT year FROM activity_archives WHERE year BETWEEN ? AND ? ORDER BY year", years).fetchall()]
+    if not archived:
+        return ()
+    return archiver.attach(conn, archived)
+
+
+def archive_status(conn) -> List[Dict]:
+    """Архивные файлы: год, строк, ревизия и выгруженная ревизия"""
+    return [{
+        'year': row[0],
+        'rows': row[1],
+        'revision': row[2],
+        'synced_revision': row[3],
+        'synced_at': iso_timestamp(row[4]),
+    } for row in conn.execute("""
+        SELECT year, rows, revision, synced_revision, synced_at FROM activity_archives ORDER BY year
+    """).fetchall()]
+
+
+def archived_rows(conn) -> int:
+    """
+    Строк в архивах, видимых в списках (для общей статистики)
+
+    Читает visible_rows из activity_archives. Файлы пересчитываются, только
+    если с подсчета удаляли, восстанавливали или вычищали клиентов и дела
+    (ключ ARCHIVE_PARENTS_VERSION), или файл учтен без подсчета.
+    """
+    key = _visibility_key(conn)
+    stale = conn.execute("""
+        SELECT year, revision FROM activity_archives
+        WHERE visible_key IS NOT ? OR visible_rows IS NULL ORDER BY year
+    """, (key,)).fetchall()
+    if stale and archiver.database is not None:
+        archiver.count_visible(conn, stale, key)
+    return conn.execute("SELECT COALESCE(SUM(visible_rows), 0) FROM activity_archives").fetchone()[0]
+
+
+@archive_bp.route('/api/admin/archive', methods=['GET'])
+@admin_required
+def get_archive():
+    """Архивные файлы и настройки архивации"""
+    try:
+        with archiver.database.get_connection() as conn:
+            files = archive_status(conn)
+        return jsonify({
+            'success': True,
+            'after_days': ARCHIVE_AFTER_DAYS,
+            'closed_after_days': ARCHIVE_CLOSED_AFTER_DAYS,
+            'directory': archive_dir(archiver.database.db_name),
+            'files': files
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@archive_bp.route('/api/admin/archive', methods=['POST'])
+@admin_required
+def run_archive():
+    """Перенос в архив без ожидания планового запуска"""
+    try:
+        moved = archiver.archive()
+        return jsonify({'success': True, 'moved': {str(year): count for year, count in moved.items()},
+                        'total': sum(moved.values())})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_activity_archive(app, database):
+    """
+    Подключает архив действий к приложению
+
+    Таблица activity_archives создается в WebDatabase.init_database. Поток
+    переносит строки сразу после запуска и затем раз в ARCHIVE_INTERVAL_HOURS;
+    с ARCHIVE_AFTER_DAYS=0 он только учитывает уже существующие файлы.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    archiver.database = database
+    app.register_blueprint(archive_bp)
+    archiver.ensure_started()
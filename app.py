@@ -8,10 +8,20 @@ from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, UserMixin, current_user
 import sqlite3
 import os
-from datetime import datetime
+import re
+import queue
+import threading
+import time
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
 import json
 import uuid
 
+from list_queries import (ARCHIVE_PARENTS_VERSION, ENTITIES, LOOKUPS, TIMELINE_DEFAULT_LIMIT, TIMELINE_MAX_LIMIT,
+                          build_list_query, build_timeline_query, encode_cursor, parse_lookups)
+from row_codec import EPOCH_COLUMNS, EPOCH_NOW_SQL, codec_for, iso_timestamp
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)  # Разрешаем CORS для фронтенда
 
@@ -20,6 +30,21 @@ DATABASE_NAME = os.environ.get('DATABASE_NAME', 'legal_crm.db')
 STATIC_FOLDER = 'static'
 TEMPLATES_FOLDER = 'templates'
 
+# Размер пула соединений с базой данных на один воркер
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# Таблицы, изменения которых отслеживаются счетчиками версий (ETag, кэши)
+VERSIONED_TABLES = ('clients', 'cases', 'activities', 'services', 'payments')
+
+# Таблицы с номером версии строки (оптимистичная блокировка)
+ROW_VERSIONED_TABLES = ('clients', 'cases', 'services', 'payments')
+
+# Максимальный размер страницы списков (?limit=)
+LIST_MAX_LIMIT = 1000
+
+# PRAGMA user_version после однократной очистки строк без родителя
+ORPHAN_CLEANUP_VERSION = 1
+
 # Настройки для облачного развертывания
 DEBUG_MODE = os.environ.get('DEBUG', 'False').lower() == 'true'
 PORT = int(os.environ.get('PORT', 5000))
@@ -28,6 +53,10 @@ PORT = int(os.environ.get('PORT', 5000))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-secret-key-for-legal-crm')
 app.config['DEBUG'] = DEBUG_MODE
 
+# Компактный JSON без экранирования кириллицы: \uXXXX занимает 6 байт вместо 2
+app.json.ensure_ascii = False
+app.json.compact = True
+
 # Настройка Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -45,7 +74,7 @@ class User(UserMixin):
 def load_user(user_id):
     """Загрузка пользователя по ID"""
     try:
-        with WebDatabase().get_connection() as conn:
+        with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id, username, password FROM users WHERE id = ?", (user_id,))
             user_data = cursor.fetchone()
@@ -55,22 +84,349 @@ def load_user(user_id):
         print(f"Ошибка загрузки пользователя: {e}")
     return None
 
+class ObservedCursor:
+    """
+    Курсор sqlite3, сообщающий о времени выполнения запросов
+    
+    Каждый execute/executemany и fetch* передается в хуки
+    WebDatabase как hook(sql, seconds, fetch). Остальные атрибуты
+    делегируются исходному курсору.
+    """
+    
+    __slots__ = ('_cursor', '_hooks', '_sql')
+    
+    def __init__(self, cursor, hooks):
+        self._cursor = cursor
+        self._hooks = hooks
+        self._sql = None
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+    
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(256)
+            if not rows:
+                return
+            yield from rows
+    
+    def _report(self, sql, started, fetch):
+        elapsed = time.perf_counter() - started
+        for hook in self._hooks:
+            hook(sql, elapsed, fetch)
+    
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, parameters)
+        finally:
+            self._report(sql, started, False)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(sql, seq_of_parameters)
+        finally:
+            self._report(sql, started, False)
+        return self
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchone()
+        finally:
+            self._report(self._sql, started, True)
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            if size is None:
+                return self._cursor.fetchmany()
+            return self._cursor.fetchmany(size)
+        finally:
+            self._report(self._sql, started, True)
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchall()
+        finally:
+            self._report(self._sql, started, True)
+
+class PooledConnection:
+    """
+    Соединение из пула WebDatabase
+    
+    Ведет себя как sqlite3.Connection. Блок with фиксирует транзакцию
+    (или откатывает при ошибке) и возвращает соединение в пул.
+    """
+    
+    def __init__(self, database, conn):
+        self._database = database
+        self._conn = conn
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def cursor(self, tuples=False):
+        """
+        Курсор соединения; при подключенных хуках - с замером времени
+        
+        tuples=True - строки кортежами без sqlite3.Row (для row_codec)
+        """
+        cursor = self._conn.cursor()
+        if tuples:
+            cursor.row_factory = None
+        hooks = self._database.statement_hooks
+        if hooks:
+            return ObservedCursor(cursor, hooks)
+        return cursor
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+        return False
+    
+    def close(self):
+        """Возвращает соединение в пул"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._database._release(conn)
+
 class WebDatabase:
-    def __init__(self, db_name=DATABASE_NAME):
+    def __init__(self, db_name=DATABASE_NAME, pool_size=DB_POOL_SIZE):
         self.db_name = db_name
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pool_pid = os.getpid()
+        self._pool_lock = threading.Lock()
+        # Хуки hook(sql, seconds, fetch), вызываемые для каждого запроса (метрики, профилирование)
+        self.statement_hooks = []
         self.init_database()
     
-    def get_connection(self):
-        """Получение соединения с базой данных"""
-        conn = sqlite3.connect(self.db_name)
+    def _connect(self):
+        """Открывает новое соединение с базой данных"""
+        conn = sqlite3.connect(self.db_name, timeout=10, check_same_thread=False)
         conn.row_factory = sqlite3.Row  # Для доступа к данным по имени колонки
+        # Внешние ключи SQLite включаются для каждого соединения отдельно: без этого
+        # ON DELETE CASCADE/SET NULL не выполняются
+        conn.execute("PRAGMA foreign_keys = ON")
         return conn
     
+    def _check_fork(self):
+        """После fork (gunicorn --preload) соединения родителя не используем"""
+        if self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = queue.LifoQueue(maxsize=self.pool_size)
+                    self._pool_pid = os.getpid()
+    
+    def _release(self, conn):
+        """Возвращает соединение в пул или закрывает его, если пул полон"""
+        if self._pool_pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+    
+    def get_connection(self):
+        """Получение соединения с базой данных из пула"""
+        self._check_fork()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(self, conn)
+    
+    def close_all(self):
+        """Закрывает все простаивающие соединения пула"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def backup_to(self, path):
+        """Согласованная копия базы данных в файл (онлайн-бэкап SQLite)"""
+        target = sqlite3.connect(path)
+        try:
+            with self.get_connection() as conn:
+                conn.backup(target)
+        finally:
+            target.close()
+    
+    def restore_from(self, path):
+        """Заменяет содержимое базы данных копией из файла"""
+        source = sqlite3.connect(path)
+        try:
+            with self.get_connection() as conn:
+                source.backup(conn._conn)
+        finally:
+            source.close()
+        self.init_database()
+        self.rotate_table_versions()
+    
+    def rotate_table_versions(self):
+        """
+        Новое поколение счетчиков версий после замены данных целиком
+        
+        Счетчики пришли из копии и могли уйти назад - меняем поколение, чтобы
+        ETag'и и кэши, основанные на старых версиях, больше не совпадали.
+        """
+        with self.get_connection() as conn:
+            conn.execute("""
+                UPDATE table_versions
+                SET version = version + 1, generation = lower(hex(randomblob(4))), updated_at = CURRENT_TIMESTAMP
+            """)
+            # Браузеры перечитывают все данные
+            conn.execute("INSERT INTO change_events (table_name, op) VALUES ('*', 'reload')")
+    
+    def get_table_versions(self, tables):
+        """
+        Версии таблиц для валидаторов кэша
+        
+        Returns:
+            list: Кортежи (table_name, generation, version, updated_at) в порядке tables
+        """
+        placeholders = ', '.join('?' for _ in tables)
+        with self.get_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT table_name, generation, version, updated_at
+                FROM table_versions WHERE table_name IN ({placeholders})
+            """, tuple(tables)).fetchall()
+        by_name = {row[0]: tuple(row) for row in rows}
+        return [by_name.get(table, (table, '', 0, None)) for table in tables]
+    
+    @staticmethod
+    def _ensure_columns(cursor, table, columns):
+        """Добавляет недостающие колонки в существующую таблицу"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns:
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    
+    def _migrate_epoch_columns(self, cursor):
+        """
+        Перевод меток времени горячих таблиц из текста CURRENT_TIMESTAMP в INTEGER (секунды UTC)
+        
+        DEFAULT колонки не меняется через ALTER TABLE, поэтому таблица
+        пересоздается (порядок из документации SQLite "Making Other Kinds Of
+        Table Schema Changes"): копия с новым объявлением, перенос строк,
+        замена. Индексы и триггеры создает init_database после миграции.
+        
+        Returns:
+            list: Перестроенные таблицы
+        """
+        pending = []
+        for table, columns in EPOCH_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            types = {row[1]: row[2].upper() for row in cursor.fetchall()}
+            if any(types.get(column) not in (None, 'INTEGER') for column in columns):
+                pending.append(table)
+        if not pending:
+            return []
+        
+        # Внешние ключи отключаются вне транзакции, иначе DROP TABLE удалит строки каскадом
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for table in pending:
+                epoch_columns = EPOCH_COLUMNS[table]
+                create_sql = cursor.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+                create_sql = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {table}_epoch', create_sql)
+                for column in epoch_columns:
+                    create_sql = re.sub(rf'\b{column}\s+TIMESTAMP\s+DEFAULT\s+CURRENT_TIMESTAMP',
+                                        f'{column} INTEGER DEFAULT ({EPOCH_NOW_SQL})', create_sql, flags=re.I)
+                cursor.execute(f"DROP TABLE IF EXISTS {table}_epoch")
+                cursor.execute(create_sql)
+                
+                columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+                values = [
+                    f"CASE WHEN typeof({column}) = 'text' THEN CAST(strftime('%s', {column}) AS INTEGER) "
+                    f"ELSE {column} END" if column in epoch_columns else column
+                    for column in columns
+                ]
+                cursor.execute(f"INSERT INTO {table}_epoch ({', '.join(columns)}) "
+                               f"SELECT {', '.join(values)} FROM {table}")
+                
+                # Счетчик AUTOINCREMENT: id удаленных строк не должны выдаваться повторно
+                sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+                cursor.execute(f"DROP TABLE {table}")
+                cursor.execute(f"ALTER TABLE {table}_epoch RENAME TO {table}")
+                if sequence is not None:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+            
+            violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                print(f"⚠️ Нарушений внешних ключей после миграции меток времени: {len(violations)}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.execute("PRAGMA foreign_keys = ON")
+        
+        print(f"✅ Метки времени переведены в INTEGER (секунды UTC): {', '.join(pending)}")
+        return pending
+    
+    def _cleanup_orphans(self, cursor):
+        """
+        Однократное удаление строк, оставшихся без родителя
+        
+        Пока внешние ключи включались только в init_database, DELETE клиентов
+        и дел из запросов не выполнял ON DELETE: их дела, действия, услуги и
+        платежи остались в таблицах. Для каждой связи применяется то же
+        правило, что выполнил бы SQLite (CASCADE - удалить, SET NULL - отвязать).
+        """
+        if cursor.execute("PRAGMA user_version").fetchone()[0] >= ORPHAN_CLEANUP_VERSION:
+            return
+        changed = 0
+        # Родители раньше детей: удаление дел-сирот каскадом удаляет и их действия
+        for table in ('cases', 'activities', 'services', 'payments'):
+            for foreign_key in cursor.execute(f"PRAGMA foreign_key_list({table})").fetchall():
+                parent, column, target, on_delete = foreign_key[2], foreign_key[3], foreign_key[4] or 'id', foreign_key[6]
+                orphan = f"{column} IS NOT NULL AND {column} NOT IN (SELECT {target} FROM {parent})"
+                if on_delete == 'CASCADE':
+                    cursor.execute(f"DELETE FROM {table} WHERE {orphan}")
+                elif on_delete == 'SET NULL':
+                    cursor.execute(f"UPDATE {table} SET {column} = NULL WHERE {orphan}")
+                else:
+                    continue
+                changed += cursor.rowcount
+        cursor.execute(f"PRAGMA user_version = {ORPHAN_CLEANUP_VERSION}")
+        if changed:
+            print(f"🧹 Удалены или отвязаны записи без родителя: {changed}")
+    
     def init_database(self):
         """Инициализация базы данных"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            # Метки времени старой схемы (текст) -> секунды UTC
+            migrated = self._migrate_epoch_columns(cursor)
+            
             # Включаем поддержку внешних ключей
             cursor.execute("PRAGMA foreign_keys = ON")
             
@@ -85,7 +441,7 @@ class WebDatabase:
             """)
             
             # Таблица клиентов
-            cursor.execute("""
+            cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS clients (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     full_name TEXT NOT NULL,
@@ -93,13 +449,13 @@ class WebDatabase:
                     email TEXT,
                     address TEXT,
                     notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    updated_at INTEGER DEFAULT ({EPOCH_NOW_SQL})
                 )
             """)
             
             # Таблица дел
-            cursor.execute("""
+            cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS cases (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     title TEXT NOT NULL,
@@ -108,26 +464,84 @@ class WebDatabase:
                     status TEXT DEFAULT 'active',
                     priority TEXT DEFAULT 'medium',
                     due_date DATE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    updated_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
                     FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
                 )
             """)
             
             # Таблица действий
-            cursor.execute("""
+            cursor.execute(f"""
                 CREATE TABLE IF NOT EXISTS activities (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     case_id INTEGER,
                     client_id INTEGER,
                     activity_type TEXT NOT NULL,
                     description TEXT,
-                    datetime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    datetime INTEGER DEFAULT ({EPOCH_NOW_SQL}),
                     FOREIGN KEY (case_id) REFERENCES cases (id) ON DELETE CASCADE,
                     FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
                 )
             """)
             
+            # Таблица услуг (работы по клиенту/делу)
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS services (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id INTEGER,
+                    case_id INTEGER,
+                    name TEXT NOT NULL,
+                    description TEXT,
+                    category TEXT,
+                    price REAL NOT NULL DEFAULT 0,
+                    duration_hours REAL,
+                    service_date DATE DEFAULT (date('now')),
+                    created_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    updated_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    version INTEGER NOT NULL DEFAULT 1,
+                    FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE,
+                    FOREIGN KEY (case_id) REFERENCES cases (id) ON DELETE SET NULL
+                )
+            """)
+            
+            # Таблица платежей: income - оплата от клиента, expense - расходы по делу
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id INTEGER,
+                    case_id INTEGER,
+                    service_id INTEGER,
+                    amount REAL NOT NULL,
+                    payment_type TEXT NOT NULL DEFAULT 'income',
+                    payment_method TEXT,
+                    payment_date DATE DEFAULT (date('now')),
+                    status TEXT NOT NULL DEFAULT 'completed',
+                    description TEXT,
+                    created_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    updated_at INTEGER DEFAULT ({EPOCH_NOW_SQL}),
+                    version INTEGER NOT NULL DEFAULT 1,
+                    FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE,
+                    FOREIGN KEY (case_id) REFERENCES cases (id) ON DELETE SET NULL,
+                    FOREIGN KEY (service_id) REFERENCES services (id) ON DELETE SET NULL
+                )
+            """)
+            
+            # Индексы биллинга: покрывающие индексы для сальдо по клиенту и выручки по периодам,
+            # остальные - для выборок по связям
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_services_client_price ON services (client_id, price)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_services_case ON services (case_id)")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_payments_balance
+                ON payments (payment_type, status, client_id, amount)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_payments_period
+                ON payments (status, payment_date, payment_type, amount)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_client_date ON payments (client_id, payment_date)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_case ON payments (case_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_service ON payments (service_id)")
+            
             # Таблица конфигурации синхронизации
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS sync_config (
@@ -143,10 +557,155 @@ class WebDatabase:
                 )
             """)
             
+            # Колонки OAuth синхронизации (oauth_api_endpoints)
+            self._ensure_columns(cursor, 'sync_config', [
+                ('username', 'TEXT'),
+                ('sync_type', 'TEXT'),
+                ('config_data', 'TEXT'),
+                ('is_enabled', 'BOOLEAN DEFAULT 0'),
+            ])
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_config_username_type
+                ON sync_config (username, sync_type)
+            """)
+            
+            # Номер версии строки для оптимистичной блокировки (If-Match)
+            self._ensure_columns(cursor, 'clients', [('version', 'INTEGER NOT NULL DEFAULT 1')])
+            self._ensure_columns(cursor, 'cases', [('version', 'INTEGER NOT NULL DEFAULT 1')])
+            
+            # Пометка удаления (purge_worker): строка скрыта, связанные записи удаляются в фоне.
+            # Частичные индексы содержат только помеченные строки
+            for table in ('clients', 'cases'):
+                self._ensure_columns(cursor, table, [('deleted_at', 'INTEGER')])
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{table}_deleted ON {table} (deleted_at)
+                    WHERE deleted_at IS NOT NULL
+                """)
+            
+            # Индексы связей: встраивание ?include= и выборки по клиенту/делу
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_cases_client_created ON cases (client_id, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_client_datetime ON activities (client_id, datetime)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_case_datetime ON activities (case_id, datetime)")
+            
+            # Сроки по делам: календарь и ближайшие дедлайны - диапазон по due_date
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_cases_due_status ON cases (due_date, status)")
+            
+            # Счетчики версий таблиц: триггеры увеличивают их при любом изменении,
+            # generation меняется при восстановлении базы из копии
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    table_name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    generation TEXT NOT NULL DEFAULT (lower(hex(randomblob(4)))),
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            for table in VERSIONED_TABLES:
+                cursor.execute("INSERT OR IGNORE INTO table_versions (table_name) VALUES (?)", (table,))
+                for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                    cursor.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{operation.lower()}
+                        AFTER {operation} ON {table}
+                        BEGIN
+                            UPDATE table_versions
+                            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                            WHERE table_name = '{table}';
+                        END
+                    """)
+            
+            # Журнал изменений строк для ленты /api/events (общий для всех воркеров)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS change_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    row_id INTEGER,
+                    op TEXT NOT NULL,
+                    version INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            for table in VERSIONED_TABLES:
+                for operation, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                    version = f'{row}.version' if table in ROW_VERSIONED_TABLES else 'NULL'
+                    cursor.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_event_{operation.lower()}
+                        AFTER {operation} ON {table}
+                        BEGIN
+                            INSERT INTO change_events (table_name, row_id, op, version)
+                            VALUES ('{table}', {row}.id, '{operation.lower()}', {version});
+                        END
+                    """)
+            
+            # Ключи поиска дублей клиентов (client_duplicates): нормализованные телефон,
+            # email и ФИО, блоки похожих ФИО и последнее примененное событие журнала
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS client_match_keys (
+                    client_id INTEGER PRIMARY KEY,
+                    phone TEXT,
+                    email TEXT,
+                    name_key TEXT NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_client_match_phone ON client_match_keys (phone)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_client_match_email ON client_match_keys (email)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_client_match_name ON client_match_keys (name_key)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS client_match_blocks (
+                    block INTEGER NOT NULL,
+                    client_id INTEGER NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_client_match_blocks ON client_match_blocks (block, client_id)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS client_match_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    generation TEXT NOT NULL,
+                    last_event_id INTEGER NOT NULL
+                )
+            """)
+            
+            # Учет годовых файлов архива действий (activity_archive): строк в файле,
+            # ревизия и ревизия, выгруженная на Яндекс.Диск
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS activity_archives (
+                    year INTEGER PRIMARY KEY,
+                    rows INTEGER NOT NULL DEFAULT 0,
+                    revision INTEGER NOT NULL DEFAULT 1,
+                    synced_revision INTEGER,
+                    synced_at INTEGER,
+                    visible_rows INTEGER,
+                    visible_key TEXT
+                )
+            """)
+            # Видимые в списках строки файла (archive_where) и ключ счетчика ARCHIVE_PARENTS_VERSION,
+            # при котором они посчитаны: статистика не сканирует архив после каждой записи
+            self._ensure_columns(cursor, 'activity_archives', [('visible_rows', 'INTEGER'), ('visible_key', 'TEXT')])
+            cursor.execute("INSERT OR IGNORE INTO table_versions (table_name) VALUES (?)", (ARCHIVE_PARENTS_VERSION,))
+            for table in ('clients', 'cases'):
+                for name, event in (('update', 'UPDATE OF deleted_at'), ('delete', 'DELETE')):
+                    condition = 'WHEN OLD.deleted_at IS NOT NEW.deleted_at' if name == 'update' else ''
+                    cursor.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_archive_parents_{name}
+                        AFTER {event} ON {table} {condition}
+                        BEGIN
+                            UPDATE table_versions
+                            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                            WHERE table_name = '{ARCHIVE_PARENTS_VERSION}';
+                        END
+                    """)
+            
+            # Сироты, оставшиеся от удалений без внешних ключей (после триггеров:
+            # браузеры получат события удаления)
+            self._cleanup_orphans(cursor)
+            
             conn.commit()
             
-            # Создаем демо-пользователя если его нет
-            self.create_demo_user()
+        if migrated:
+            # Значения в кэшах и локальных копиях браузеров - в старом формате
+            self.rotate_table_versions()
+        
+        # Создаем демо-пользователя если его нет
+        self.create_demo_user()
     
     def create_demo_user(self):
         """Создание демо-пользователя"""
@@ -175,6 +734,307 @@ class WebDatabase:
 # Создаем экземпляр базы данных
 db = WebDatabase()
 
+# OAuth авторизация Яндекс.Диска
+from oauth_api_endpoints import init_oauth_api
+init_oauth_api(app, db)
+
+# Метрики запросов (/metrics)
+from request_metrics import init_metrics
+init_metrics(app, db)
+
+# Профилировщик SQL (SQL_PROFILER=true или /api/admin/sql-profile)
+from sql_profiler import init_sql_profiler
+init_sql_profiler(app, db)
+
+# Сжатие ответов gzip/brotli
+from response_compression import init_compression
+init_compression(app)
+
+# Кэш клиентов, дел, услуг и платежей по id
+from entity_cache import entity_cache, init_entity_cache
+init_entity_cache(app, db)
+
+# Лента изменений /api/events (SSE)
+from event_feed import init_event_feed, publish as publish_event
+init_event_feed(app, db)
+
+# Дельта-синхронизация /api/changes для локальной копии в браузере
+from delta_sync import init_delta_sync
+init_delta_sync(app, db)
+
+# Экспорт списков в CSV/XLSX /api/export/<entity>
+from report_export import init_report_export
+init_report_export(app, db)
+
+# Массовый импорт CSV /api/import/<entity> (и python bulk_import.py)
+from bulk_import import init_bulk_import
+init_bulk_import(app, db)
+
+# Календарь сроков /api/calendar и ICS лента
+from calendar_feed import init_calendar_feed
+init_calendar_feed(app, db)
+
+# Подсказки клиентов по имени /api/clients/suggest
+from client_suggest import init_client_suggest
+init_client_suggest(app, db)
+
+# Поиск дублей клиентов /api/clients/duplicates и проверка при создании
+from client_duplicates import find_matches as find_client_matches, init_client_duplicates
+init_client_duplicates(app, db)
+
+# Удаление клиентов и дел с большой историей в фоне
+from purge_worker import AFFECTED_TABLES, delete_entity, init_purge_worker
+init_purge_worker(app, db)
+
+# Архив старых действий в годовых файлах (archive/activities_YYYY.db)
+from activity_archive import archived_rows, attach_archives, archiver, init_activity_archive
+init_activity_archive(app, db)
+
+# ==================== CONDITIONAL GET ====================
+
+def _is_success_response(response):
+    """
+    Ответ API с success: true
+    
+    Тело разбирается целиком: jsonify сортирует ключи, и у части ответов после
+    "success" идут другие (totals, total_outstanding), так что по хвосту тела
+    успех не определить. Разбор нужен только при промахе кэша, вместе с view.
+    """
+    if response.status_code != 200 or response.is_streamed or response.mimetype != 'application/json':
+        return False
+    try:
+        body = json.loads(response.get_data())
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get('success') is True
+
+def included_tables(entity):
+    """Таблицы связей, встроенных в список через ?include= (неизвестные связи пропускаются)"""
+    relations = ENTITIES[entity].relations
+    names = [name.strip() for name in request.args.get('include', '').split(',')]
+    return tuple(ENTITIES[relations[name].entity].table for name in names if name in relations)
+
+def conditional_get(*tables, entity=None):
+    """
+    ETag/Last-Modified по версиям таблиц и ответ 304 без выполнения запроса
+    
+    Версии читаются до выполнения view: если данные изменятся между чтением
+    версии и запросом, клиент получит более старый ETag и просто скачает
+    данные еще раз при следующем обращении.
+    
+    Args:
+        *tables: Таблицы, от которых зависит ответ
+        entity: Сущность списка (list_queries.ENTITIES): к таблицам добавляются
+            таблицы связей из ?include=
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            depends = tables
+            if entity is not None:
+                depends += tuple(table for table in included_tables(entity) if table not in tables)
+            try:
+                versions = db.get_table_versions(depends)
+            except sqlite3.Error:
+                return view(*args, **kwargs)
+            
+            validator = ';'.join(f'{name}:{generation}:{version}' for name, generation, version, _ in versions)
+            validator += '|' + request.full_path
+            etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()[:20]
+            
+            modified = [updated_at for _, _, _, updated_at in versions if updated_at]
+            last_modified = None
+            if modified:
+                last_modified = datetime.strptime(str(max(modified)), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            
+            # If-None-Match приоритетнее If-Modified-Since (RFC 9110)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+            
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if not _is_success_response(response):
+                    return response
+            
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Браузер хранит ответ, но перепроверяет его при каждом запросе
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        # По метке benchmarks.etag_check находит маршруты, которые должны отдавать ETag
+        wrapper.conditional_tables = tables
+        return wrapper
+    return decorator
+
+# ==================== LIST RESPONSES ====================
+
+def list_response(key, cursor, timestamp_columns=(), json_columns=(), page_limit=None):
+    """
+    Ответ со списком строк результата запроса
+    
+    По умолчанию строки отдаются объектами. С ?shape=columns имена колонок
+    передаются один раз, а строки - массивами значений:
+    {"clients": {"columns": ["id", "full_name", ...], "rows": [[1, "Иванов"], ...]}}
+    
+    Args:
+        key: Ключ списка в ответе ('clients', 'cases', ...)
+        cursor: Выполненный курсор со строками-кортежами (conn.cursor(tuples=True))
+        timestamp_columns: Колонки с секундами UTC, отдаются строкой ISO 8601
+        json_columns: Колонки с JSON (встроенные связи ?include=)
+        page_limit: Размер страницы; курсор запрошен с одной лишней строкой,
+            по которой видно, есть ли следующая страница
+    """
+    codec = codec_for(cursor, timestamp_columns, json_columns)
+    rows = cursor.fetchall()
+    
+    page = {}
+    if page_limit is not None:
+        has_more = len(rows) > page_limit
+        rows = rows[:page_limit]
+        page['next_before_id'] = rows[-1][codec.columns.index('id')] if has_more else None
+    
+    if request.args.get('shape') == 'columns':
+        return jsonify({'success': True, key: {'columns': codec.columns, 'rows': codec.lists(rows)}, **page})
+    return jsonify({'success': True, key: codec.dicts(rows), **page})
+
+def entity_list(entity):
+    """
+    Список сущности с учетом ?fields= и ?include=
+    
+    ?fields=id,full_name - только перечисленные поля (выбираются в SQL)
+    ?include=cases - связанные записи встраиваются тем же запросом
+    ?limit=100&before_id=... - страница по id (next_before_id из предыдущего ответа)
+    ?client_id=3&from=2024-01-01 - фильтры сущности (list_queries.ENTITIES[...].filters);
+    действия за архивные годы объединяются с архивом только при заданных from/to
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, LIST_MAX_LIMIT))
+    
+    with db.get_connection() as conn:
+        try:
+            # Диапазон ?from=&to=, захватывающий архивные годы, читается и из архива
+            archives = attach_archives(conn, entity, request.args)
+            sql, params, timestamp_fields, json_fields = build_list_query(
+                entity, request.args.get('fields'), request.args.get('include'),
+                limit=limit + 1 if limit is not None else None, before_id=request.args.get('before_id', type=int),
+                filters=request.args, archives=archives)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        cursor = conn.cursor(tuples=True)
+        cursor.execute(sql, params)
+        return list_response(entity, cursor, timestamp_columns=timestamp_fields, json_columns=json_fields,
+                             page_limit=limit)
+
+# ==================== OPTIMISTIC CONCURRENCY ====================
+
+# Колонки, которые можно менять через PUT/PATCH
+CLIENT_EDITABLE = ('full_name', 'phone', 'email', 'address', 'notes')
+CASE_EDITABLE = ('title', 'description', 'client_id', 'status', 'priority', 'due_date')
+SERVICE_EDITABLE = ('name', 'description', 'category', 'price', 'duration_hours', 'service_date',
+                    'client_id', 'case_id')
+PAYMENT_EDITABLE = ('amount', 'payment_type', 'payment_method', 'payment_date', 'status', 'description',
+                    'client_id', 'case_id', 'service_id')
+
+def expected_version(data):
+    """
+    Версия, которую видел клиент: заголовок If-Match ("3" или W/"3") или поле version
+    
+    Returns:
+        tuple: (версия или None, источник 'header'/'body'/None)
+    
+    Raises:
+        ValueError: Версия не является числом
+    """
+    header = request.headers.get('If-Match', '').strip()
+    if header and header != '*':
+        tag = header.split(',')[0].strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        return int(tag.strip('"')), 'header'
+    if data.get('version') is not None:
+        return int(data['version']), 'body'
+    return None, None
+
+def entity_response(payload, entity, status=200):
+    """Ответ с сущностью и ее версией в ETag"""
+    response = jsonify(payload)
+    response.status_code = status
+    if entity.get('version') is not None:
+        response.set_etag(str(entity['version']))
+    return response
+
+def update_entity(table, key, entity_id, data, editable, required, messages, present=None):
+    """
+    Частичное обновление строки с проверкой версии
+    
+    Пишутся только переданные колонки из editable. Если клиент прислал версию
+    (If-Match или version), UPDATE выполняется только при совпадении; иначе
+    ответ 412 (заголовок) или 409 (поле) с текущим состоянием записи.
+    
+    Args:
+        table: Таблица с колонкой version (ROW_VERSIONED_TABLES)
+        key: Ключ сущности в ответе
+        entity_id: id записи
+        data: Тело запроса
+        editable: Колонки, доступные для изменения
+        required: Колонки, которые нельзя сделать пустыми {колонка: сообщение}
+        messages: (сообщение об успехе, сообщение "не найдено")
+        present: Дополняет сущность для ответа (например, client_name)
+    """
+    success_message, not_found = messages
+    try:
+        version, source = expected_version(data)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Некорректная версия'}), 400
+    
+    columns = [column for column in editable if column in data]
+    if not columns:
+        return jsonify({'success': False, 'error': 'Нет полей для обновления'})
+    for column, message in required.items():
+        if column in data and not data[column]:
+            return jsonify({'success': False, 'error': message})
+    
+    assignments = ', '.join(f'{column} = ?' for column in columns)
+    sql = f"UPDATE {table} SET {assignments}, version = version + 1, updated_at = {EPOCH_NOW_SQL} WHERE id = ?"
+    params = [data[column] for column in columns] + [entity_id]
+    if version is not None:
+        sql += " AND version = ?"
+        params.append(version)
+    
+    with db.get_connection() as conn:
+        cursor = conn.execute(sql, params)
+        updated = cursor.rowcount
+    entity_cache.invalidate(table, entity_id)
+    
+    current = entity_cache.get(table, entity_id)
+    if current is None:
+        return jsonify({'success': False, 'error': not_found})
+    if not updated:
+        # Запись изменил кто-то другой: отдаем текущее состояние для слияния
+        return entity_response({
+            'success': False,
+            'conflict': True,
+            'error': 'Запись изменена другим пользователем',
+            key: current
+        }, current, status=412 if source == 'header' else 409)
+    
+    entity = present(dict(current)) if present else current
+    return entity_response({'success': True, 'message': success_message, key: entity}, current)
+
+def with_client_name(case):
+    """Имя клиента дела из кэша клиентов вместо JOIN"""
+    client = entity_cache.get('clients', case['client_id']) if case.get('client_id') else None
+    case['client_name'] = client['full_name'] if client else None
+    return case
+
 # ==================== ROUTES ====================
 
 @app.route('/')
@@ -255,23 +1115,11 @@ def api_logout():
 
 @app.route('/api/clients', methods=['GET'])
 @login_required
+@conditional_get('clients', entity='clients')
 def get_clients():
     """Получение всех клиентов"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM clients ORDER BY created_at DESC")
-            clients = [dict(row) for row in cursor.fetchall()]
-            
-            # Преобразуем datetime объекты в строки для JSON
-            for client in clients:
-                if 'created_at' in client:
-                    client['created_at'] = str(client['created_at'])
-                if 'updated_at' in client:
-                    client['updated_at'] = str(client['updated_at'])
-                    
-            return jsonify({'success': True, 'clients': clients})
-            
+        return entity_list('clients')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -286,6 +1134,13 @@ def create_client():
         if not data.get('full_name'):
             return jsonify({'success': False, 'error': 'ФИО обязательно для заполнения'})
         
+        # Похожие клиенты: создаем только после подтверждения (?force=1)
+        if request.args.get('force') not in ('1', 'true'):
+            duplicates = find_client_matches(data['full_name'], data.get('phone'), data.get('email'))
+            if duplicates:
+                return jsonify({'success': False, 'duplicate': True,
+                                'error': 'Похожий клиент уже есть в базе', 'duplicates': duplicates})
+        
         with db.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
@@ -301,89 +1156,128 @@ def create_client():
             
             conn.commit()
             client_id = cursor.lastrowid
-            
-        return jsonify({'success': True, 'message': 'Клиент успешно создан', 'client_id': client_id})
+        
+        client = entity_cache.get('clients', client_id)
+        return entity_response({'success': True, 'message': 'Клиент успешно создан',
+                                'client_id': client_id, 'client': client}, client)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/clients/<int:client_id>', methods=['PUT'])
+@app.route('/api/clients/<int:client_id>', methods=['GET'])
+@login_required
+def get_client(client_id):
+    """Получение клиента по id"""
+    try:
+        client = entity_cache.get('clients', client_id)
+        if client is None:
+            return jsonify({'success': False, 'error': 'Клиент не найден'})
+        return entity_response({'success': True, 'client': client}, client)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/clients/<int:client_id>', methods=['PUT', 'PATCH'])
 @login_required
 def update_client(client_id):
-    """Обновление клиента"""
+    """Обновление клиента: меняются только переданные поля, версия проверяется по If-Match"""
     try:
-        data = request.json
-        
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE clients 
-                SET full_name = ?, phone = ?, email = ?, address = ?, notes = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (
-                data.get('full_name', ''),
-                data.get('phone', ''),
-                data.get('email', ''),
-                data.get('address', ''),
-                data.get('notes', ''),
-                client_id
-            ))
-            
-            if cursor.rowcount == 0:
-                return jsonify({'success': False, 'error': 'Клиент не найден'})
-            
-            conn.commit()
-            
-        return jsonify({'success': True, 'message': 'Клиент успешно обновлен'})
-        
+        return update_entity(
+            'clients', 'client', client_id, request.json or {}, CLIENT_EDITABLE,
+            {'full_name': 'ФИО обязательно для заполнения'},
+            ('Клиент успешно обновлен', 'Клиент не найден'))
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/clients/<int:client_id>', methods=['DELETE'])
 @login_required
 def delete_client(client_id):
-    """Удаление клиента"""
+    """Удаление клиента; дела, действия, услуги и платежи клиента удаляются каскадом"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM clients WHERE id = ?", (client_id,))
-            
-            if cursor.rowcount == 0:
-                return jsonify({'success': False, 'error': 'Клиент не найден'})
-            
-            conn.commit()
-            
+        result = delete_entity('clients', client_id)
+        if result is None:
+            return jsonify({'success': False, 'error': 'Клиент не найден'})
+        
+        for table in AFFECTED_TABLES['clients']:
+            entity_cache.invalidate(table)
+        
+        if result == 'scheduled':
+            return jsonify({'success': True, 'purging': True,
+                            'message': 'Клиент удален, связанные записи удаляются в фоне'})
         return jsonify({'success': True, 'message': 'Клиент успешно удален'})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/clients/<int:client_id>/timeline', methods=['GET'])
+@login_required
+@conditional_get('clients', 'cases', 'activities')
+def get_client_timeline(client_id):
+    """
+    Лента клиента: дела и активности по времени, новые сверху
+    
+    ?limit= - размер страницы (до 200), ?cursor= - next_cursor предыдущей страницы
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', TIMELINE_DEFAULT_LIMIT)), TIMELINE_MAX_LIMIT))
+        # Одна лишняя строка показывает, есть ли следующая страница
+        sql, params = build_timeline_query(client_id, limit + 1, request.args.get('cursor'))
+        
+        client = entity_cache.get('clients', client_id)
+        if client is None:
+            return jsonify({'success': False, 'error': 'Клиент не найден'})
+        
+        with db.get_connection() as conn:
+            cursor = conn.cursor(tuples=True).execute(sql, params)
+            codec = codec_for(cursor, ('ts',))
+            rows = cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = dict(zip(codec.columns, rows[-1]))
+            # В курсоре - секунды, как в колонках, по которым идет сравнение
+            next_cursor = encode_cursor(last['ts'], last['kind'], last['id'])
+        events = codec.dicts(rows)
+        
+        return jsonify({
+            'success': True,
+            'client': {'id': client['id'], 'full_name': client['full_name']},
+            'events': events,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/lookups', methods=['GET'])
+@login_required
+@conditional_get(*VERSIONED_TABLES)
+def get_lookups():
+    """
+    Справочники для выпадающих списков одним запросом
+    
+    ?entities=clients,cases - только id и подпись каждой записи
+    """
+    try:
+        names = parse_lookups(request.args.get('entities'))
+        result = {'success': True}
+        with db.get_connection() as conn:
+            for name in names:
+                cursor = conn.execute(LOOKUPS[name])
+                columns = [column[0] for column in cursor.description]
+                result[name] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # ==================== CASES API ====================
 
 @app.route('/api/cases', methods=['GET'])
 @login_required
+@conditional_get('cases', 'clients', entity='cases')
 def get_cases():
     """Получение всех дел"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT c.*, cl.full_name as client_name 
-                FROM cases c 
-                LEFT JOIN clients cl ON c.client_id = cl.id
-                ORDER BY c.created_at DESC
-            """)
-            cases = [dict(row) for row in cursor.fetchall()]
-            
-            # Преобразуем datetime объекты в строки для JSON
-            for case in cases:
-                if 'created_at' in case:
-                    case['created_at'] = str(case['created_at'])
-                if 'updated_at' in case:
-                    case['updated_at'] = str(case['updated_at'])
-                    
-            return jsonify({'success': True, 'cases': cases})
-            
+        return entity_list('cases')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -414,59 +1308,53 @@ def create_case():
             
             conn.commit()
             case_id = cursor.lastrowid
-            
-        return jsonify({'success': True, 'message': 'Дело успешно создано', 'case_id': case_id})
         
+        case = entity_cache.get('cases', case_id)
+        return entity_response({'success': True, 'message': 'Дело успешно создано',
+                                'case_id': case_id, 'case': with_client_name(dict(case))}, case)
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/cases/<int:case_id>', methods=['GET'])
+@login_required
+def get_case(case_id):
+    """Получение дела по id"""
+    try:
+        case = entity_cache.get('cases', case_id)
+        if case is None:
+            return jsonify({'success': False, 'error': 'Дело не найдено'})
+        return entity_response({'success': True, 'case': with_client_name(case)}, case)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/cases/<int:case_id>', methods=['PUT'])
+@app.route('/api/cases/<int:case_id>', methods=['PUT', 'PATCH'])
 @login_required
 def update_case(case_id):
-    """Обновление дела"""
+    """Обновление дела: меняются только переданные поля, версия проверяется по If-Match"""
     try:
-        data = request.json
-        
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE cases 
-                SET title = ?, description = ?, client_id = ?, status = ?, priority = ?, due_date = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (
-                data.get('title', ''),
-                data.get('description', ''),
-                data.get('client_id'),
-                data.get('status', 'active'),
-                data.get('priority', 'medium'),
-                data.get('due_date'),
-                case_id
-            ))
-            
-            if cursor.rowcount == 0:
-                return jsonify({'success': False, 'error': 'Дело не найдено'})
-            
-            conn.commit()
-            
-        return jsonify({'success': True, 'message': 'Дело успешно обновлено'})
-        
+        return update_entity(
+            'cases', 'case', case_id, request.json or {}, CASE_EDITABLE,
+            {'title': 'Название дела обязательно для заполнения'},
+            ('Дело успешно обновлено', 'Дело не найдено'), present=with_client_name)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/cases/<int:case_id>', methods=['DELETE'])
 @login_required
 def delete_case(case_id):
-    """Удаление дела"""
+    """Удаление дела; действия удаляются каскадом, услуги и платежи отвязываются"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM cases WHERE id = ?", (case_id,))
-            
-            if cursor.rowcount == 0:
-                return jsonify({'success': False, 'error': 'Дело не найдено'})
-            
-            conn.commit()
-            
+        result = delete_entity('cases', case_id)
+        if result is None:
+            return jsonify({'success': False, 'error': 'Дело не найдено'})
+        
+        for table in AFFECTED_TABLES['cases']:
+            entity_cache.invalidate(table)
+        
+        if result == 'scheduled':
+            return jsonify({'success': True, 'purging': True,
+                            'message': 'Дело удалено, связанные записи удаляются в фоне'})
         return jsonify({'success': True, 'message': 'Дело успешно удалено'})
         
     except Exception as e:
@@ -476,27 +1364,11 @@ def delete_case(case_id):
 
 @app.route('/api/activities', methods=['GET'])
 @login_required
+@conditional_get('activities', 'cases', 'clients', entity='activities')
 def get_activities():
     """Получение всех активностей"""
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT a.*, c.title as case_title, cl.full_name as client_name 
-                FROM activities a 
-                LEFT JOIN cases c ON a.case_id = c.id
-                LEFT JOIN clients cl ON a.client_id = cl.id
-                ORDER BY a.datetime DESC
-            """)
-            activities = [dict(row) for row in cursor.fetchall()]
-            
-            # Преобразуем datetime объекты в строки для JSON
-            for activity in activities:
-                if 'datetime' in activity:
-                    activity['datetime'] = str(activity['datetime'])
-                    
-            return jsonify({'success': True, 'activities': activities})
-            
+        return entity_list('activities')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -531,10 +1403,368 @@ def create_activity():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# ==================== SERVICES API ====================
+
+# Поля, в которых пустая строка из формы означает "не задано"
+BILLING_NULLABLE = ('client_id', 'case_id', 'service_id', 'duration_hours', 'service_date', 'payment_date')
+PAYMENT_TYPES = ('income', 'expense')
+
+def clean_billing_data(data, numeric):
+    """
+    Нормализация тела запроса услуги/платежа
+    
+    Args:
+        data: Тело запроса
+        numeric: {колонка: минимальное значение} для числовых полей
+    
+    Raises:
+        ValueError: Если число некорректно или меньше минимума
+    """
+    data = dict(data)
+    for column in BILLING_NULLABLE:
+        if data.get(column) == '':
+            data[column] = None
+    for column, minimum in numeric.items():
+        if data.get(column) is None:
+            continue
+        try:
+            data[column] = float(data[column])
+        except (TypeError, ValueError):
+            raise ValueError(f'Некорректное значение поля {column}')
+        if data[column] < minimum:
+            raise ValueError(f'Значение поля {column} не может быть меньше {minimum:g}')
+    return data
+
+@app.route('/api/services', methods=['GET'])
+@login_required
+@conditional_get('services', 'clients', 'cases', entity='services')
+def get_services():
+    """Получение услуг (?limit=&before_id= - постранично)"""
+    try:
+        return entity_list('services')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/services', methods=['POST'])
+@login_required
+def create_service():
+    """Создание услуги"""
+    try:
+        data = clean_billing_data(request.json or {}, {'price': 0, 'duration_hours': 0})
+        
+        if not data.get('name'):
+            return jsonify({'success': False, 'error': 'Название услуги обязательно для заполнения'})
+        
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO services (name, description, category, price, duration_hours, service_date,
+                                      client_id, case_id)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, date('now')), ?, ?)
+            """, (
+                data['name'],
+                data.get('description', ''),
+                data.get('category'),
+                data.get('price') or 0,
+                data.get('duration_hours'),
+                data.get('service_date'),
+                data.get('client_id'),
+                data.get('case_id')
+            ))
+            
+            conn.commit()
+            service_id = cursor.lastrowid
+        
+        service = entity_cache.get('services', service_id)
+        return entity_response({'success': True, 'message': 'Услуга успешно создана',
+                                'service_id': service_id, 'service': service}, service)
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/services/<int:service_id>', methods=['GET'])
+@login_required
+def get_service(service_id):
+    """Получение услуги по id"""
+    try:
+        service = entity_cache.get('services', service_id)
+        if service is None:
+            return jsonify({'success': False, 'error': 'Услуга не найдена'})
+        return entity_response({'success': True, 'service': service}, service)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/services/<int:service_id>', methods=['PUT', 'PATCH'])
+@login_required
+def update_service(service_id):
+    """Обновление услуги: меняются только переданные поля, версия проверяется по If-Match"""
+    try:
+        data = clean_billing_data(request.json or {}, {'price': 0, 'duration_hours': 0})
+        return update_entity(
+            'services', 'service', service_id, data, SERVICE_EDITABLE,
+            {'name': 'Название услуги обязательно для заполнения'},
+            ('Услуга успешно обновлена', 'Услуга не найдена'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/services/<int:service_id>', methods=['DELETE'])
+@login_required
+def delete_service(service_id):
+    """Удаление услуги"""
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM services WHERE id = ?", (service_id,))
+            
+            if cursor.rowcount == 0:
+                return jsonify({'success': False, 'error': 'Услуга не найдена'})
+            
+            conn.commit()
+            entity_cache.invalidate('services', service_id)
+            
+        return jsonify({'success': True, 'message': 'Услуга успешно удалена'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# ==================== PAYMENTS API ====================
+
+def validate_payment(data, partial=False):
+    """Сообщение об ошибке в платеже или None"""
+    if not partial and data.get('amount') is None:
+        return 'Сумма платежа обязательна для заполнения'
+    if 'amount' in data and not data['amount']:
+        return 'Сумма платежа должна быть больше нуля'
+    if 'payment_type' in data and data['payment_type'] not in PAYMENT_TYPES:
+        return 'Тип платежа должен быть income или expense'
+    return None
+
+@app.route('/api/payments', methods=['GET'])
+@login_required
+@conditional_get('payments', 'clients', 'cases', 'services', entity='payments')
+def get_payments():
+    """Получение платежей (?limit=&before_id= - постранично)"""
+    try:
+        return entity_list('payments')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/payments', methods=['POST'])
+@login_required
+def create_payment():
+    """Создание платежа"""
+    try:
+        data = clean_billing_data(request.json or {}, {'amount': 0})
+        data.setdefault('payment_type', 'income')
+        
+        error = validate_payment(data)
+        if error:
+            return jsonify({'success': False, 'error': error})
+        
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO payments (amount, payment_type, payment_method, payment_date, status, description,
+                                      client_id, case_id, service_id)
+                VALUES (?, ?, ?, COALESCE(?, date('now')), ?, ?, ?, ?, ?)
+            """, (
+                data['amount'],
+                data['payment_type'],
+                data.get('payment_method'),
+                data.get('payment_date'),
+                data.get('status') or 'completed',
+                data.get('description', ''),
+                data.get('client_id'),
+                data.get('case_id'),
+                data.get('service_id')
+            ))
+            
+            conn.commit()
+            payment_id = cursor.lastrowid
+        
+        payment = entity_cache.get('payments', payment_id)
+        return entity_response({'success': True, 'message': 'Платеж успешно создан',
+                                'payment_id': payment_id, 'payment': payment}, payment)
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/payments/<int:payment_id>', methods=['GET'])
+@login_required
+def get_payment(payment_id):
+    """Получение платежа по id"""
+    try:
+        payment = entity_cache.get('payments', payment_id)
+        if payment is None:
+            return jsonify({'success': False, 'error': 'Платеж не найден'})
+        return entity_response({'success': True, 'payment': payment}, payment)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/payments/<int:payment_id>', methods=['PUT', 'PATCH'])
+@login_required
+def update_payment(payment_id):
+    """Обновление платежа: меняются только переданные поля, версия проверяется по If-Match"""
+    try:
+        data = clean_billing_data(request.json or {}, {'amount': 0})
+        error = validate_payment(data, partial=True)
+        if error:
+            return jsonify({'success': False, 'error': error})
+        return update_entity(
+            'payments', 'payment', payment_id, data, PAYMENT_EDITABLE,
+            {'status': 'Статус платежа обязателен для заполнения'},
+            ('Платеж успешно обновлен', 'Платеж не найден'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/payments/<int:payment_id>', methods=['DELETE'])
+@login_required
+def delete_payment(payment_id):
+    """Удаление платежа"""
+    try:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
+            
+            if cursor.rowcount == 0:
+                return jsonify({'success': False, 'error': 'Платеж не найден'})
+            
+            conn.commit()
+            entity_cache.invalidate('payments', payment_id)
+            
+        return jsonify({'success': True, 'message': 'Платеж успешно удален'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# ==================== BILLING API ====================
+
+# Группировка выручки: период -> формат strftime
+REVENUE_PERIODS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-W%W',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+def parse_date_arg(name):
+    """Дата YYYY-MM-DD из query string или None; ValueError при неверном формате"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        raise ValueError(f'Параметр {name} должен быть датой в формате YYYY-MM-DD')
+
+@app.route('/api/billing/balances', methods=['GET'])
+@login_required
+@conditional_get('services', 'payments', 'clients')
+def get_balances():
+    """
+    Задолженность по клиентам: стоимость услуг минус проведенные входящие платежи
+    
+    ?client_id=5 - один клиент; ?outstanding=1 - только с положительным долгом
+    """
+    try:
+        # Клиенты, помеченные на удаление (purge_worker), в расчетах не показываются
+        conditions = ['cl.deleted_at IS NULL', '(b.billed IS NOT NULL OR p.paid IS NOT NULL)']
+        params = []
+        client_id = request.args.get('client_id', type=int)
+        if client_id is not None:
+            conditions.append('cl.id = ?')
+            params.append(client_id)
+        if request.args.get('outstanding') in ('1', 'true'):
+            conditions.append('COALESCE(b.billed, 0) - COALESCE(p.paid, 0) > 0')
+        
+        with db.get_connection() as conn:
+            # Суммы считаются по индексам idx_services_client_price и
+            # idx_payments_balance без чтения строк таблиц
+            cursor = conn.execute(f"""
+                SELECT cl.id AS client_id, cl.full_name AS client_name,
+                       COALESCE(b.billed, 0) AS billed,
+                       COALESCE(p.paid, 0) AS paid,
+                       COALESCE(b.billed, 0) - COALESCE(p.paid, 0) AS balance
+                FROM clients cl
+                LEFT JOIN (
+                    SELECT client_id, SUM(price) AS billed FROM services GROUP BY client_id
+                ) b ON b.client_id = cl.id
+                LEFT JOIN (
+                    SELECT client_id, SUM(amount) AS paid FROM payments
+                    WHERE payment_type = 'income' AND status = 'completed'
+                    GROUP BY client_id
+                ) p ON p.client_id = cl.id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY balance DESC, cl.id
+            """, params)
+            balances = [dict(row) for row in cursor.fetchall()]
+        
+        return jsonify({
+            'success': True,
+            'balances': balances,
+            'total_outstanding': sum(row['balance'] for row in balances if row['balance'] > 0)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/billing/revenue', methods=['GET'])
+@login_required
+@conditional_get('payments')
+def get_revenue():
+    """
+    Проведенные доходы и расходы по периодам
+    
+    ?period=day|week|month|year (по умолчанию month), ?from=&to= - даты включительно
+    """
+    try:
+        period = request.args.get('period', 'month')
+        if period not in REVENUE_PERIODS:
+            return jsonify({'success': False, 'error': f'Неизвестный период: {period}'})
+        try:
+            date_from, date_to = parse_date_arg('from'), parse_date_arg('to')
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        
+        conditions = ["status = 'completed'"]
+        params = [REVENUE_PERIODS[period]]
+        if date_from:
+            conditions.append('payment_date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('payment_date <= ?')
+            params.append(date_to)
+        
+        with db.get_connection() as conn:
+            # Диапазон дат и суммы читаются из покрывающего индекса idx_payments_period
+            cursor = conn.execute(f"""
+                SELECT strftime(?, payment_date) AS period,
+                       SUM(CASE WHEN payment_type = 'income' THEN amount ELSE 0 END) AS income,
+                       SUM(CASE WHEN payment_type = 'expense' THEN amount ELSE 0 END) AS expense,
+                       COUNT(*) AS payments
+                FROM payments
+                WHERE {' AND '.join(conditions)}
+                GROUP BY 1
+                ORDER BY 1
+            """, params)
+            periods = [dict(row) for row in cursor.fetchall()]
+        
+        for row in periods:
+            row['net'] = row['income'] - row['expense']
+        totals = {
+            'income': sum(row['income'] for row in periods),
+            'expense': sum(row['expense'] for row in periods),
+            'payments': sum(row['payments'] for row in periods),
+        }
+        totals['net'] = totals['income'] - totals['expense']
+        return jsonify({'success': True, 'period': period, 'revenue': periods, 'totals': totals})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # ==================== STATISTICS API ====================
 
 @app.route('/api/stats', methods=['GET'])
 @login_required
+@conditional_get('clients', 'cases', 'activities')
 def get_statistics():
     """Получение статистики"""
     try:
@@ -542,37 +1772,37 @@ def get_statistics():
             cursor = conn.cursor()
             
             # Общая статистика
-            cursor.execute("SELECT COUNT(*) FROM clients")
+            cursor.execute("SELECT COUNT(*) FROM clients WHERE deleted_at IS NULL")
             total_clients = cursor.fetchone()[0]
             
-            cursor.execute("SELECT COUNT(*) FROM cases")
+            cursor.execute("SELECT COUNT(*) FROM cases WHERE deleted_at IS NULL")
             total_cases = cursor.fetchone()[0]
             
-            cursor.execute("SELECT COUNT(*) FROM activities")
-            total_activities = cursor.fetchone()[0]
+            # Действия удаленных клиентов и дел скрыты и в списках, и в архиве
+            visible_activities = ENTITIES['activities'].where.format(a='a')
+            cursor.execute(f"SELECT COUNT(*) FROM activities a WHERE {visible_activities}")
+            total_activities = cursor.fetchone()[0] + archived_rows(conn)
             
             # Активные дела
-            cursor.execute("SELECT COUNT(*) FROM cases WHERE status = 'active'")
+            cursor.execute("SELECT COUNT(*) FROM cases WHERE status = 'active' AND deleted_at IS NULL")
             active_cases = cursor.fetchone()[0]
             
             # Статистика по приоритетам
-            cursor.execute("SELECT priority, COUNT(*) FROM cases GROUP BY priority")
+            cursor.execute("SELECT priority, COUNT(*) FROM cases WHERE deleted_at IS NULL GROUP BY priority")
             priority_stats = dict(cursor.fetchall())
             
             # Последние активности
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT a.activity_type, a.description, a.datetime, c.title as case_title 
                 FROM activities a 
                 LEFT JOIN cases c ON a.case_id = c.id
+                WHERE {visible_activities}
                 ORDER BY a.datetime DESC 
                 LIMIT 10
             """)
             recent_activities = [dict(row) for row in cursor.fetchall()]
-            
-            # Преобразуем datetime объекты в строки
             for activity in recent_activities:
-                if 'datetime' in activity:
-                    activity['datetime'] = str(activity['datetime'])
+                activity['datetime'] = iso_timestamp(activity['datetime'])
             
             stats = {
                 'total_clients': total_clients,
@@ -644,14 +1874,18 @@ def get_sync_status():
             """, (current_user.id,))
             
             result = cursor.fetchone()
-            last_sync = result[0].isoformat() if result and result[0] else None
+            last_sync = str(result[0]) if result and result[0] else None
+            
+            # Состояние circuit breaker'ов Яндекс.Диска в этом воркере
+            from sync.transport import breaker_states
             
             status = {
                 'configured': configured,
                 'needs_sync': False,
                 'last_sync': last_sync,
                 'auto_sync_enabled': bool(result[1]) if result else False,
-                'backup_folder': result[2] if result and result[2] else '/legal_crm/'
+                'backup_folder': result[2] if result and result[2] else '/legal_crm/',
+                'circuit_breakers': breaker_states()
             }
             
             return jsonify({'success': True, **status})
@@ -731,6 +1965,7 @@ def upload_to_yandex():
                     SET last_sync = CURRENT_TIMESTAMP 
                     WHERE user_id = ?
                 """, (current_user.id,))
+            publish_event('sync', 'upload')
             
             return jsonify({
                 'success': True, 
@@ -769,6 +2004,12 @@ def download_from_yandex():
         result = sync_manager.download_from_cloud()
         
         if result.get('success'):
+            # Импорт пересоздает таблицы: возвращаем индексы, триггеры и счетчики версий
+            db.init_database()
+            db.rotate_table_versions()
+            # Строки копии, уже лежащие в архивных файлах, снова уходят в архив
+            archiver.wake()
+            
             # Обновляем время последней синхронизации в БД
             with db.get_connection() as conn:
                 cursor = conn.cursor()
@@ -912,6 +2153,12 @@ def restore_from_backup():
         result = sync_manager.restore_backup(backup_filename)
         
         if result.get('success'):
+            # Импорт пересоздает таблицы: возвращаем индексы, триггеры и счетчики версий
+            db.init_database()
+            db.rotate_table_versions()
+            # Строки копии, уже лежащие в архивных файлах, снова уходят в архив
+            archiver.wake()
+            
             return jsonify({
                 'success': True, 
                 'message': f'Успешно восстановлено из резервной копии: {backup_filename}'
@@ -948,6 +2195,7 @@ def cleanup_old_backups():
         result = sync_manager.cleanup_old_backups(retention_days=30)
         
         if result.get('success'):
+            publish_event('sync', 'cleanup')
             return jsonify({
                 'success': True, 
                 'message': result.get('message', 'Очистка старых резервных копий завершена')
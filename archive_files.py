@@ -0,0 +1,20 @@
+"""
+Расположение архивных файлов действий Legal CRM
+Годовые файлы SQLite (archive/activities_2023.db) рядом с основной базой; без
+зависимостей от веб-слоя - их использует и синхронизация с Яндекс.Диском
+"""
+
+import os
+
+
+def archive_dir(db_path: str) -> str:
+    """Папка архивных файлов: ARCHIVE_DIR или archive/ рядом с базой"""
+    return os.environ.get('ARCHIVE_DIR') or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'archive')
+
+
+def archive_filename(year: int) -> str:
+    return f'activities_{year}.db'
+
+
+def archive_path(db_path: str, year: int) -> str:
+    return os.path.join(archive_dir(db_path), archive_filename(year))
@@ -0,0 +1,10 @@
+"""
+Бенчмарки Legal CRM
+Запуск: python -m benchmarks.<модуль> --help
+"""
+
+import os
+
+# Синтетические действия датированы 2022-2024 годами: фоновый архив (activity_archive)
+# не должен переносить их из базы во время замеров
+os.environ.setdefault('ARCHIVE_AFTER_DAYS', '0')
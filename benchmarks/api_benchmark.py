@@ -0,0 +1,341 @@
+"""
+Бенчмарк CRUD API Legal CRM
+
+Заполняет синтетическую базу и прогоняет все /api/* endpoints, работающие
+с базой (endpoints синхронизации с Яндекс.Диском - в sync_benchmark):
+
+    # Flask test client в одном процессе (без сети)
+    python -m benchmarks.api_benchmark --rows 100000
+
+    # gunicorn с конкурентной нагрузкой
+    python -m benchmarks.api_benchmark --mode gunicorn --rows 100000 --workers 4 --concurrency 16
+
+    # сравнение с предыдущим прогоном (код выхода 1 при регрессии)
+    python -m benchmarks.api_benchmark --baseline benchmarks/results/api_client_....json
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.common import (REPO_ROOT, compare_results, max_rss_mb, print_table,
+                               process_tree_rss_mb, run_metadata, save_results, summarize)
+from benchmarks.seed import seed_database
+
+LOGIN = {'username': 'admin', 'password': '12345'}
+
+
+class Scenario(NamedTuple):
+    """Один endpoint под нагрузкой"""
+    name: str
+    method: str
+    path: Callable[[random.Random, Dict], str]
+    body: Optional[Callable[[random.Random, Dict], Dict]] = None
+    # Имя сущности, экземпляры которой endpoint удаляет: создаются заранее вне замеров
+    consumes: Optional[str] = None
+
+
+def _client_body(rng, state):
+    number = rng.randrange(10 ** 7)
+    return {'full_name': f'Бенчмарков Тест Тестович {number}', 'phone': f'+7 900 {number:07d}',
+            'email': f'bench{number}@example.ru', 'address': 'г. Москва', 'notes': 'нагрузочный тест'}
+
+
+def _case_body(rng, state):
+    return {'title': f'Тестовое дело №{rng.randrange(10 ** 6)}', 'description': 'нагрузочный тест',
+            'client_id': rng.randrange(1, state['clients'] + 1), 'status': 'active',
+            'priority': 'medium', 'due_date': '2030-01-01'}
+
+
+def _activity_body(rng, state):
+    case_id = rng.randrange(1, state['cases'] + 1)
+    return {'case_id': case_id, 'client_id': state['case_clients'].get(case_id),
+            'activity_type': 'Звонок', 'description': 'нагрузочный тест'}
+
+
+def _pop(entity):
+    def path(rng, state):
+        # Заготовка не создалась - запрос к несуществующей записи засчитается ошибкой
+        created = state['created'][entity]
+        return f"/api/{entity}/{created.pop() if created else 0}"
+    return path
+
+
+SCENARIOS = [
+    Scenario('auth_check', 'GET', lambda rng, state: '/api/auth/check'),
+    Scenario('clients_list', 'GET', lambda rng, state: '/api/clients'),
+    # Тестовые клиенты похожи по ФИО друг на друга: проверка дублей отклонила бы создание
+    Scenario('clients_create', 'POST', lambda rng, state: '/api/clients?force=1', _client_body),
+    Scenario('clients_update', 'PUT', lambda rng, state: f"/api/clients/{rng.randrange(1, state['clients'] + 1)}",
+             _client_body),
+    Scenario('clients_delete', 'DELETE', _pop('clients'), consumes='clients'),
+    Scenario('cases_list', 'GET', lambda rng, state: '/api/cases'),
+    Scenario('cases_create', 'POST', lambda rng, state: '/api/cases', _case_body),
+    Scenario('cases_update', 'PUT', lambda rng, state: f"/api/cases/{rng.randrange(1, state['cases'] + 1)}",
+             _case_body),
+    Scenario('cases_delete', 'DELETE', _pop('cases'), consumes='cases'),
+    Scenario('activities_list', 'GET', lambda rng, state: '/api/activities'),
+    Scenario('activities_create', 'POST', lambda rng, state: '/api/activities', _activity_body),
+    Scenario('stats', 'GET', lambda rng, state: '/api/stats'),
+    Scenario('sync_status', 'GET', lambda rng, state: '/api/sync/status'),
+    Scenario('oauth_sync_status', 'GET', lambda rng, state: '/api/oauth/sync/status'),
+]
+
+CREATE_BODIES = {'clients': _client_body, 'cases': _case_body}
+CREATED_ID_KEYS = {'clients': 'client_id', 'cases': 'case_id'}
+CREATE_PATHS = {'clients': '/api/clients?force=1', 'cases': '/api/cases'}
+
+
+def _dataset_state(db_path: str, counts: Dict[str, int]) -> Dict:
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        case_clients = dict(conn.execute('SELECT id, client_id FROM cases'))
+    finally:
+        conn.close()
+    return {'clients': counts['clients'], 'cases': counts['cases'],
+            'case_clients': case_clients, 'created': {'clients': [], 'cases': []}}
+
+
+def _is_success(status: int, payload) -> bool:
+    if status >= 400:
+        return False
+    if isinstance(payload, dict) and payload.get('success') is False:
+        return False
+    return True
+
+
+def _remember_created(state: Dict, entity: str, status: int, payload) -> bool:
+    """Запоминает id созданной заготовки; ответ с ошибкой выводится и не разбирается"""
+    if not _is_success(status, payload):
+        error = payload.get('error') if isinstance(payload, dict) else status
+        print(f"  ⚠️ Заготовка {entity} не создана: {error}", flush=True)
+        return False
+    state['created'][entity].append(payload[CREATED_ID_KEYS[entity]])
+    return True
+
+
+# ==================== FLASK TEST CLIENT ====================
+
+def run_test_client(db_path: str, counts: Dict[str, int], scenarios: List[Scenario],
+                    iterations: int, warmup: int, seed: int) -> Dict[str, Dict]:
+    """Прогон через Flask test client: задержка самого приложения без сети и WSGI сервера"""
+    os.environ['DATABASE_NAME'] = db_path
+    import app as app_module
+
+    client = app_module.app.test_client()
+    client.post('/api/auth/login', json=LOGIN)
+    state = _dataset_state(db_path, counts)
+    rng = random.Random(seed)
+    results = {}
+
+    for scenario in scenarios:
+        if scenario.consumes:
+            body = CREATE_BODIES[scenario.consumes]
+            for _ in range(iterations + warmup + 1):
+                response = client.post(CREATE_PATHS[scenario.consumes], json=body(rng, state))
+                _remember_created(state, scenario.consumes, response.status_code, response.get_json(silent=True))
+
+        def call():
+            body = scenario.body(rng, state) if scenario.body else None
+            response = client.open(scenario.path(rng, state), method=scenario.method, json=body)
+            ok = _is_success(response.status_code, response.get_json(silent=True))
+            response.close()
+            return ok
+
+        for _ in range(warmup):
+            call()
+
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            request_started = time.perf_counter()
+            ok = call()
+            latencies.append(time.perf_counter() - request_started)
+            errors += not ok
+        wall = time.perf_counter() - started
+
+        # Пиковая память одного запроса - отдельным вызовом, tracemalloc замедляет замеры
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = summarize(latencies, wall, errors)
+        stats['peak_alloc_mb'] = round(peak / 1024 / 1024, 2)
+        stats['memory_mb'] = max_rss_mb()
+        results[scenario.name] = stats
+        print(f"  {scenario.name}: p50={stats['p50_ms']} мс, p95={stats['p95_ms']} мс", flush=True)
+
+    return results
+
+
+# ==================== GUNICORN ====================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn завершился с кодом {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn не запустился вовремя')
+
+
+def run_gunicorn(db_path: str, counts: Dict[str, int], scenarios: List[Scenario], iterations: int,
+                 warmup: int, seed: int, workers: int, threads: int, concurrency: int) -> Dict[str, Dict]:
+    """Прогон через gunicorn: конкурентные HTTP запросы из пула потоков"""
+    import requests
+
+    port = _free_port()
+    env = dict(os.environ, DATABASE_NAME=db_path)
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    results = {}
+
+    try:
+        _wait_for_port(port, process)
+
+        login = requests.Session()
+        login.post(f'{base_url}/api/auth/login', json=LOGIN).raise_for_status()
+        cookies = login.cookies.get_dict()
+
+        local = threading.local()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.cookies.update(cookies)
+            return local.session
+
+        state = _dataset_state(db_path, counts)
+        state_lock = threading.Lock()
+        rng = random.Random(seed)
+
+        def call(scenario):
+            with state_lock:
+                path = scenario.path(rng, state)
+                body = scenario.body(rng, state) if scenario.body else None
+            started = time.perf_counter()
+            try:
+                response = session().request(scenario.method, base_url + path, json=body, timeout=60)
+                payload = response.json() if 'json' in response.headers.get('Content-Type', '') else None
+                ok = _is_success(response.status_code, payload)
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for scenario in scenarios:
+                if scenario.consumes:
+                    body = CREATE_BODIES[scenario.consumes]
+                    for _ in range(iterations + warmup):
+                        response = login.post(base_url + CREATE_PATHS[scenario.consumes], json=body(rng, state))
+                        payload = response.json() if 'json' in response.headers.get('Content-Type', '') else None
+                        _remember_created(state, scenario.consumes, response.status_code, payload)
+
+                list(pool.map(call, [scenario] * warmup))
+
+                started = time.perf_counter()
+                outcomes = list(pool.map(call, [scenario] * iterations))
+                wall = time.perf_counter() - started
+
+                stats = summarize([latency for latency, _ in outcomes], wall,
+                                  sum(1 for _, ok in outcomes if not ok))
+                stats['concurrency'] = concurrency
+                stats['memory_mb'] = process_tree_rss_mb(process.pid)
+                results[scenario.name] = stats
+                print(f"  {scenario.name}: {stats['throughput_rps']} req/s, p95={stats['p95_ms']} мс", flush=True)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк CRUD API Legal CRM')
+    parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--rows', type=int, default=10000, help='Размер синтетической базы (10000 - 1000000)')
+    parser.add_argument('--db', help='Путь к базе (по умолчанию временный файл)')
+    parser.add_argument('--reuse-db', action='store_true', help='Не пересоздавать базу, если файл существует')
+    parser.add_argument('--iterations', type=int, default=200, help='Запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=10, help='Прогревочных запросов на сценарий')
+    parser.add_argument('--only', nargs='*', help='Запустить только перечисленные сценарии')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn: число воркеров')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn: потоков на воркер')
+    parser.add_argument('--concurrency', type=int, default=8, help='gunicorn: одновременных клиентов')
+    parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Допустимый рост задержки (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.only or s.name in args.only]
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='legal_crm_bench_'), 'legal_crm.db')
+
+    print(f"📦 Заполнение базы {db_path}: {args.rows} строк")
+    seed_started = time.perf_counter()
+    if args.reuse_db and os.path.exists(db_path):
+        from benchmarks.seed import split_rows
+        clients, cases, activities = split_rows(args.rows)
+        counts = {'clients': clients, 'cases': cases, 'activities': activities}
+    else:
+        counts = seed_database(db_path, args.rows, args.seed)
+    seed_seconds = round(time.perf_counter() - seed_started, 2)
+
+    print(f"🚀 Режим {args.mode}: {len(scenarios)} сценариев по {args.iterations} запросов")
+    if args.mode == 'client':
+        results = run_test_client(db_path, counts, scenarios, args.iterations, args.warmup, args.seed)
+        extra = {}
+    else:
+        results = run_gunicorn(db_path, counts, scenarios, args.iterations, args.warmup, args.seed,
+                               args.workers, args.threads, args.concurrency)
+        extra = {'workers': args.workers, 'threads': args.threads, 'concurrency': args.concurrency}
+
+    report = {
+        'meta': run_metadata(args.mode, rows=args.rows, dataset=counts, seed=args.seed,
+                             seed_seconds=seed_seconds, iterations=args.iterations,
+                             db_size_mb=round(os.path.getsize(db_path) / 1024 / 1024, 1), **extra),
+        'results': results,
+    }
+    path = save_results(report, args.output, 'api')
+    print()
+    print_table(results)
+    print(f"\n💾 Результаты: {path}")
+
+    if args.baseline:
+        regressions = compare_results(report, args.baseline, args.threshold)
+        if regressions:
+            print("\n⚠️  Регрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == '__main__':
+    main()
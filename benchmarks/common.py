@@ -0,0 +1,145 @@
+"""
+Общие функции бенчмарков: статистика задержек, память, сохранение и сравнение результатов
+"""
+
+import os
+import math
+import sys
+import json
+import platform
+import resource
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+# Метрики, рост которых считается регрессией
+REGRESSION_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Перцентиль по методу ближайшего ранга (значения уже отсортированы)"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], wall_seconds: float, errors: int = 0) -> Dict:
+    """
+    Сводка по задержкам одного сценария
+
+    Args:
+        latencies: Время каждого запроса в секундах
+        wall_seconds: Общее время прогона (для пропускной способности)
+        errors: Число неуспешных запросов
+    """
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        'mean_ms': round(sum(values) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def max_rss_mb() -> float:
+    """Пиковый RSS текущего процесса в МБ"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(usage / divisor, 1)
+
+
+def process_tree_rss_mb(pid: int) -> Optional[float]:
+    """Суммарный RSS процесса и его потомков (Linux /proc), None если недоступно"""
+    total_kb = 0
+    pending = [pid]
+    seen = set()
+    try:
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        if not seen or total_kb == 0:
+            return None
+    return round(total_kb / 1024, 1)
+
+
+def run_metadata(mode: str, **extra) -> Dict:
+    """Описание окружения прогона, чтобы результаты можно было сравнивать"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    meta = {
+        'mode': mode,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    meta.update(extra)
+    return meta
+
+
+def save_results(results: Dict, output: Optional[str], prefix: str) -> str:
+    """Сохраняет результаты в JSON; по умолчанию в benchmarks/results/"""
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(RESULTS_DIR, f'{prefix}_{results["meta"]["mode"]}_{timestamp}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def compare_results(current: Dict, baseline_path: str, threshold: float) -> List[str]:
+    """
+    Сравнивает результаты с базовым прогоном
+
+    Returns:
+        List[str]: Описания регрессий (пусто, если регрессий нет)
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, stats in current.get('results', {}).items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for metric in REGRESSION_METRICS:
+            old, new = base.get(metric), stats.get(metric)
+            if not old or new is None:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append(f'{name}: {metric} {old} -> {new} (+{(new / old - 1) * 100:.0f}%)')
+    return regressions
+
+
+def print_table(results: Dict[str, Dict]):
+    """Краткая таблица результатов в консоль"""
+    print(f"{'сценарий':<32} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ошибки':>7} {'память МБ':>10}")
+    for name, stats in results.items():
+        memory = stats.get('memory_mb')
+        print(f"{name:<32} {stats['throughput_rps']:>9} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+              f"{stats['p99_ms']:>9} {stats['errors']:>7} {memory if memory is not None else '-':>10}")
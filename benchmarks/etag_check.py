@@ -0,0 +1,83 @@
+"""
+Проверка ETag у маршрутов с @conditional_get
+
+Находит в app.url_map все GET маршруты, обернутые conditional_get, и для
+каждого проверяет, что успешный ответ несет ETag, а повтор с If-None-Match
+возвращает 304:
+
+    python -m benchmarks.etag_check --rows 10000
+
+Код выхода 1, если хотя бы один маршрут ETag не отдает.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+from typing import List
+
+from benchmarks.seed import seed_database
+
+LOGIN = {'username': 'admin', 'password': '12345'}
+
+# Значения параметров пути (<int:client_id>): в синтетической базе есть строки с id 1
+PATH_ARGUMENT = '1'
+
+
+def conditional_routes(app) -> List[str]:
+    """Пути GET маршрутов с conditional_get (параметры подставляются)"""
+    paths = []
+    for rule in app.url_map.iter_rules():
+        view = app.view_functions[rule.endpoint]
+        if 'GET' not in rule.methods or not hasattr(view, 'conditional_tables'):
+            continue
+        paths.append(rule.build({argument: PATH_ARGUMENT for argument in rule.arguments}, append_unknown=False)[1])
+    return sorted(paths)
+
+
+def check_etags(client, paths: List[str]) -> List[str]:
+    """Проверяет маршруты; возвращает описания ошибок"""
+    failures = []
+    for path in paths:
+        response = client.get(path)
+        payload = response.get_json(silent=True)
+        etag = response.headers.get('ETag')
+        if response.status_code != 200 or not isinstance(payload, dict) or payload.get('success') is not True:
+            failures.append(f"{path}: ответ {response.status_code} без success: true")
+        elif etag is None:
+            failures.append(f"{path}: нет ETag")
+        else:
+            status = client.get(path, headers={'If-None-Match': etag}).status_code
+            if status != 304:
+                failures.append(f"{path}: повтор с If-None-Match вернул {status}, а не 304")
+                continue
+            print(f"  ✅ {path}: {etag}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка ETag у маршрутов с @conditional_get')
+    parser.add_argument('--rows', type=int, default=10000, help='Размер синтетической базы')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='legal_crm_etag_'), 'legal_crm.db')
+    seed_database(db_path, args.rows, args.seed)
+    os.environ['DATABASE_NAME'] = db_path
+    import app as app_module
+
+    client = app_module.app.test_client()
+    client.post('/api/auth/login', json=LOGIN)
+    paths = conditional_routes(app_module.app)
+    print(f"🔎 Маршрутов с conditional_get: {len(paths)}")
+    failures = check_etags(client, paths)
+    if failures:
+        print("\n❌ Маршруты без ETag:")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+    print("✅ Все маршруты отдают ETag")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,568 @@
+"""
+Локальная замена Яндекс.Диска для бенчмарков и отладки синхронизации
+
+REST API (/v1/disk): resources (листинг, создание папки, удаление),
+resources/upload и resources/download со ссылками href на отдельные
+адреса загрузки/скачивания. WebDAV (/webdav): PROPFIND, PUT, GET, MKCOL, DELETE.
+
+Задержка, пропускная способность и доля ошибок настраиваются:
+
+    python -m benchmarks.fake_yandex_disk --port 8765 --latency 0.05 --bandwidth 2000000 --error-rate 0.05
+
+    YANDEX_DISK_API_URL=http://127.0.0.1:8765/v1/disk \\
+    YANDEX_WEBDAV_URL=http://127.0.0.1:8765/webdav python app.py
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 64 * 1024
+
+# Размер страницы листинга по умолчанию, как у настоящего API
+DEFAULT_LIMIT = 20
+
+
+class FakeYandexDisk:
+    """
+    Фейковый сервер Яндекс.Диска в отдельном потоке
+
+    Файлы хранятся во временной директории, поэтому большие базы
+    не занимают память процесса бенчмарка.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, root: Optional[str] = None,
+                 latency: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None,
+                 error_rate: float = 0.0, error_status: int = 503, retry_after: Optional[float] = None,
+                 seed: int = 0):
+        """
+        Args:
+            latency: Задержка перед каждым ответом, секунды
+            jitter: Случайная добавка к задержке (0..jitter), секунды
+            bandwidth: Ограничение скорости загрузки/скачивания, байт/с (None - без ограничения)
+            error_rate: Доля запросов, на которые сервер отвечает ошибкой
+            error_status: HTTP статус инжектированной ошибки
+            retry_after: Значение заголовка Retry-After для ошибок 429/503
+        """
+        self.root = root or tempfile.mkdtemp(prefix='fake_yandex_disk_')
+        self._owns_root = root is None
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+
+        self.requests = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.injected_errors = 0
+
+        self._rng = random.Random(seed)
+        self._fail_next = []
+        self._links: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        handler = type('FakeYandexDiskHandler', (_Handler,), {'disk': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    # ==================== УПРАВЛЕНИЕ ====================
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.base_url}/v1/disk'
+
+    @property
+    def webdav_url(self) -> str:
+        return f'{self.base_url}/webdav'
+
+    def start(self) -> 'FakeYandexDisk':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-yandex-disk', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def environ(self) -> Dict[str, str]:
+        """Переменные окружения, направляющие клиентов приложения на этот сервер"""
+        return {'YANDEX_DISK_API_URL': self.api_url, 'YANDEX_WEBDAV_URL': self.webdav_url}
+
+    def fail_next(self, count: int = 1, status: Optional[int] = None):
+        """Следующие count запросов завершатся ошибкой (детерминированная инжекция)"""
+        with self._lock:
+            self._fail_next.extend([status or self.error_status] * count)
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.injected_errors = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'injected_errors': self.injected_errors,
+            }
+
+    # ==================== ХРАНИЛИЩЕ ====================
+
+    def local_path(self, disk_path: str) -> str:
+        """Путь Диска ('disk:/a/b', '/a/b', 'a/b') -> файл во временной директории"""
+        if disk_path.startswith('disk:'):
+            disk_path = disk_path[len('disk:'):]
+        parts = [part for part in disk_path.split('/') if part not in ('', '.', '..')]
+        return os.path.join(self.root, *parts)
+
+    def put_file(self, disk_path: str, content: bytes = b'', modified: Optional[datetime] = None):
+        """Кладет файл напрямую (подготовка данных для бенчмарка)"""
+        path = self.local_path(disk_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if modified is not None:
+            timestamp = modified.timestamp()
+            os.utime(path, (timestamp, timestamp))
+
+    def create_link(self, kind: str, disk_path: str) -> str:
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._links[token] = (kind, disk_path)
+        return f'{self.base_url}/{kind}/{token}'
+
+    def resolve_link(self, kind: str, token: str) -> Optional[str]:
+        # Ссылки многоразовые, как у настоящего Диска: повтор после ошибки идет по той же ссылке
+        with self._lock:
+            link = self._links.get(token)
+        if link is None or link[0] != kind:
+            return None
+        return link[1]
+
+    # ==================== ИНЖЕКЦИЯ ====================
+
+    def delay(self):
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def injected_error(self) -> Optional[int]:
+        with self._lock:
+            if self._fail_next:
+                self.injected_errors += 1
+                return self._fail_next.pop(0)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.injected_errors += 1
+                return self.error_status
+        return None
+
+    def throttle(self, started: float, transferred: int):
+        """Выравнивает скорость передачи под bandwidth"""
+        if not self.bandwidth:
+            return
+        expected = transferred / self.bandwidth
+        elapsed = time.perf_counter() - started
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+
+    def count(self, key: str, received: int = 0, sent: int = 0):
+        with self._lock:
+            self.requests[key] += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='seconds')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Обработчик запросов фейкового Диска"""
+
+    protocol_version = 'HTTP/1.1'
+    disk: FakeYandexDisk = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ==================== ОБЩЕЕ ====================
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json(self, status: int, payload: Dict):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def _error(self, status: int, error: str, description: str = ''):
+        self._json(status, {'error': error, 'description': description or error})
+
+    def _read_body(self, target=None) -> int:
+        """Читает тело запроса (Content-Length или chunked), пишет в target при наличии"""
+        started = time.perf_counter()
+        total = 0
+
+        def consume(chunk):
+            nonlocal total
+            total += len(chunk)
+            if target is not None:
+                target.write(chunk)
+            self.disk.throttle(started, total)
+
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                remaining = size
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    consume(chunk)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                consume(chunk)
+        return total
+
+    def _send_file(self, path: str, content_type: str = 'application/octet-stream'):
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        started = time.perf_counter()
+        sent = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                self.disk.throttle(started, sent)
+        return sent
+
+    def _authorized(self) -> bool:
+        if self.headers.get('Authorization'):
+            return True
+        self._read_body()
+        self._error(401, 'UnauthorizedError', 'Не авторизован.')
+        return False
+
+    def _dispatch(self):
+        disk = self.disk
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route = url.path
+
+        disk.delay()
+        status = disk.injected_error()
+        if status is not None:
+            self._read_body()
+            headers = {}
+            if disk.retry_after is not None and status in (429, 503):
+                headers['Retry-After'] = str(disk.retry_after)
+            disk.count(f'{self.command} injected_{status}')
+            self._send(status, b'{"error":"ServiceUnavailable"}', headers=headers)
+            return
+
+        if route.startswith('/upload/') and self.command == 'PUT':
+            return self._upload_href(route[len('/upload/'):])
+        if route.startswith('/download/') and self.command == 'GET':
+            return self._download_href(route[len('/download/'):])
+        if route.startswith('/v1/disk'):
+            if not self._authorized():
+                return
+            return self._rest(route[len('/v1/disk'):], query)
+        if route.startswith('/webdav'):
+            if not self._authorized():
+                return
+            return self._webdav(unquote(route[len('/webdav'):]) or '/')
+
+        self._read_body()
+        self._error(404, 'NotFound')
+
+    do_GET = do_PUT = do_DELETE = do_POST = do_PROPFIND = do_MKCOL = do_HEAD = _dispatch
+
+    # ==================== REST API ====================
+
+    def _resource(self, disk_path: str, local: str) -> Dict:
+        stat = os.stat(local)
+        name = os.path.basename(local.rstrip(os.sep)) or 'disk'
+        path = 'disk:/' + '/'.join(part for part in disk_path.replace('disk:', '').split('/') if part)
+        resource = {
+            'name': name,
+            'path': path,
+            'created': _iso(stat.st_ctime),
+            'modified': _iso(stat.st_mtime),
+            'type': 'dir' if os.path.isdir(local) else 'file',
+        }
+        if resource['type'] == 'file':
+            resource['size'] = stat.st_size
+            resource['mime_type'] = 'application/octet-stream'
+            resource['md5'] = uuid.uuid5(uuid.NAMESPACE_URL, f'{path}:{stat.st_mtime_ns}').hex
+        return resource
+
+    def _rest(self, route: str, query: Dict):
+        disk = self.disk
+        path = query.get('path', '/')
+        local = disk.local_path(path)
+
+        if route in ('', '/') and self.command == 'GET':
+            disk.count('GET /')
+            return self._json(200, {'total_space': 10 * 1024 ** 3, 'used_space': 0, 'system_folders': {}})
+
+        if route == '/resources' and self.command == 'GET':
+            disk.count('GET /resources')
+            if not os.path.exists(local):
+                return self._error(404, 'DiskNotFoundError', 'Не удалось найти запрошенный ресурс.')
+            resource = self._resource(path, local)
+            if resource['type'] == 'dir':
+                limit = int(query.get('limit', DEFAULT_LIMIT))
+                offset = int(query.get('offset', 0))
+                names = sorted(os.listdir(local))
+                base = path.rstrip('/')
+                items = [self._resource(f'{base}/{name}', os.path.join(local, name))
+                         for name in names[offset:offset + limit]]
+                resource['_embedded'] = {'items': items, 'limit': limit, 'offset': offset,
+                                         'total': len(names), 'path': resource['path']}
+            return self._json(200, resource)
+
+        if route == '/resources' and self.command == 'PUT':
+            self._read_body()
+            disk.count('PUT /resources')
+            if os.path.exists(local):
+                return self._error(409, 'DiskPathPointsToExistentDirectoryError', 'Ресурс уже существует.')
+            if not os.path.isdir(os.path.dirname(local)):
+                return self._error(409, 'DiskPathDoesntExistsError', 'Родительская папка не существует.')
+            os.mkdir(local)
+            return self._json(201, {'href': f'{disk.api_url}/resources?path={quote(path)}', 'method': 'GET'})
+
+        if route == '/resources' and self.command == 'DELETE':
+            disk.count('DELETE /resources')
+            if not os.path.exists(local):
+                return self._error(404, 'DiskNotFoundError', 'Не удалось найти запрошенный ресурс.')
+            if os.path.isdir(local):
+                shutil.rmtree(local)
+            else:
+                os.remove(local)
+            return self._send(204)
+
+        if route == '/resources/upload' and self.command == 'GET':
+            disk.count('GET /resources/upload')
+            if os.path.exists(local) and query.get('overwrite', 'false').lower() != 'true':
+                return self._error(409, 'DiskResourceAlreadyExistsError', 'Ресурс уже существует.')
+            if not os.path.isdir(os.path.dirname(local)):
+                return self._error(409, 'DiskPathDoesntExistsError', 'Родительская папка не существует.')
+            return self._json(200, {'href': disk.create_link('upload', path), 'method': 'PUT', 'templated': False})
+
+        if route == '/resources/download' and self.command == 'GET':
+            disk.count('GET /resources/download')
+            if not os.path.isfile(local):
+                return self._error(404, 'DiskNotFoundError', 'Не удалось найти запрошенный ресурс.')
+            return self._json(200, {'href': disk.create_link('download', path), 'method': 'GET', 'templated': False})
+
+        self._read_body()
+        self._error(405, 'MethodNotAllowed')
+
+    def _upload_href(self, token: str):
+        disk = self.disk
+        path = disk.resolve_link('upload', token)
+        if path is None:
+            self._read_body()
+            return self._error(404, 'NotFound', 'Ссылка для загрузки недействительна.')
+        local = disk.local_path(path)
+        partial = f'{local}.{token}.part'
+        with open(partial, 'wb') as f:
+            received = self._read_body(f)
+        os.replace(partial, local)
+        disk.count('PUT upload_href', received=received)
+        self._send(201)
+
+    def _download_href(self, token: str):
+        disk = self.disk
+        path = disk.resolve_link('download', token)
+        local = disk.local_path(path) if path else None
+        if not local or not os.path.isfile(local):
+            return self._error(404, 'NotFound', 'Ссылка для скачивания недействительна.')
+        sent = self._send_file(local)
+        disk.count('GET download_href', sent=sent)
+
+    # ==================== WEBDAV ====================
+
+    def _propstat(self, href: str, local: str) -> str:
+        stat = os.stat(local)
+        is_dir = os.path.isdir(local)
+        modified = format_datetime(datetime.fromtimestamp(stat.st_mtime, timezone.utc), usegmt=True)
+        props = [
+            f'<d:resourcetype>{"<d:collection/>" if is_dir else ""}</d:resourcetype>',
+            f'<d:getlastmodified>{modified}</d:getlastmodified>',
+            f'<d:displayname>{escape(os.path.basename(local.rstrip(os.sep)))}</d:displayname>',
+        ]
+        if not is_dir:
+            props.append(f'<d:getcontentlength>{stat.st_size}</d:getcontentlength>')
+            props.append(f'<d:getetag>"{stat.st_mtime_ns:x}{stat.st_size:x}"</d:getetag>')
+            props.append('<d:getcontenttype>application/octet-stream</d:getcontenttype>')
+        return (f'<d:response><d:href>{escape(quote(href))}</d:href><d:propstat>'
+                f'<d:status>HTTP/1.1 200 OK</d:status><d:prop>{"".join(props)}</d:prop>'
+                f'</d:propstat></d:response>')
+
+    def _propfind(self, disk_path: str, local: str):
+        self._read_body()
+        depth = self.headers.get('Depth', 'infinity').lower()
+        if depth not in ('0', '1', 'infinity'):
+            return self._send(400, b'', 'text/plain')
+
+        # Ответ отдается по частям: листинг может быть большим
+        self.send_response(207)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(text: str):
+            data = text.encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+        write('<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:">')
+        base = '/' + '/'.join(part for part in disk_path.split('/') if part)
+        write(self._propstat(base + ('/' if os.path.isdir(local) and base != '/' else ''), local))
+        if depth != '0' and os.path.isdir(local):
+            for current, dirs, files in os.walk(local):
+                relative = os.path.relpath(current, local)
+                prefix = base.rstrip('/') + ('' if relative == '.' else '/' + relative.replace(os.sep, '/'))
+                for name in sorted(dirs):
+                    write(self._propstat(f'{prefix}/{name}/', os.path.join(current, name)))
+                for name in sorted(files):
+                    write(self._propstat(f'{prefix}/{name}', os.path.join(current, name)))
+                if depth == '1':
+                    break
+        write('</d:multistatus>')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _webdav(self, disk_path: str):
+        disk = self.disk
+        local = disk.local_path(disk_path)
+        command = self.command
+        disk.count(f'{command} webdav')
+
+        if command == 'PROPFIND':
+            if not os.path.exists(local):
+                self._read_body()
+                return self._send(404, b'', 'text/plain')
+            return self._propfind(disk_path, local)
+
+        if command == 'PUT':
+            if not os.path.isdir(os.path.dirname(local)):
+                self._read_body()
+                return self._send(409, b'', 'text/plain')
+            partial = f'{local}.{uuid.uuid4().hex}.part'
+            with open(partial, 'wb') as f:
+                received = self._read_body(f)
+            os.replace(partial, local)
+            disk.count('PUT webdav_bytes', received=received)
+            return self._send(201, b'', 'text/plain')
+
+        if command == 'GET':
+            if not os.path.isfile(local):
+                return self._send(404, b'', 'text/plain')
+            sent = self._send_file(local)
+            disk.count('GET webdav_bytes', sent=sent)
+            return
+
+        if command == 'MKCOL':
+            self._read_body()
+            if os.path.exists(local):
+                return self._send(405, b'', 'text/plain')
+            if not os.path.isdir(os.path.dirname(local)):
+                return self._send(409, b'', 'text/plain')
+            os.mkdir(local)
+            return self._send(201, b'', 'text/plain')
+
+        if command == 'DELETE':
+            if not os.path.exists(local):
+                return self._send(404, b'', 'text/plain')
+            if os.path.isdir(local):
+                shutil.rmtree(local)
+            else:
+                os.remove(local)
+            return self._send(204, b'', 'text/plain')
+
+        self._read_body()
+        self._send(405, b'', 'text/plain')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный фейковый Яндекс.Диск')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--root', help='Каталог хранения файлов (по умолчанию временный)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Случайная добавка к задержке, с')
+    parser.add_argument('--bandwidth', type=float, help='Скорость загрузки/скачивания, байт/с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов с ошибкой (0..1)')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--retry-after', type=float, help='Retry-After для ошибок 429/503, с')
+    args = parser.parse_args()
+
+    disk = FakeYandexDisk(args.host, args.port, args.root, args.latency, args.jitter, args.bandwidth,
+                          args.error_rate, args.error_status, args.retry_after)
+    print(f"🗄️  Фейковый Яндекс.Диск: {disk.base_url} (файлы в {disk.root})")
+    for name, value in disk.environ().items():
+        print(f"   export {name}={value}")
+    try:
+        disk.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        disk.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
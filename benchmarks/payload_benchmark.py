@@ -0,0 +1,99 @@
+"""
+Бенчмарк размера ответов API Legal CRM
+
+Сравнивает объем данных, передаваемых списками и статистикой, при разных
+настройках: JSON с экранированием \\uXXXX (как было), компактный JSON с
+кириллицей как есть, колоночная форма (?shape=columns) и сжатие gzip/brotli:
+
+    python -m benchmarks.payload_benchmark --rows 10000
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from typing import Dict
+
+from benchmarks.common import run_metadata, save_results
+from benchmarks.seed import seed_database
+
+LOGIN = {'username': 'admin', 'password': '12345'}
+ENDPOINTS = ('clients', 'cases', 'activities', 'stats')
+LIST_ENDPOINTS = ('clients', 'cases', 'activities')
+
+
+def _variants():
+    """(имя, ensure_ascii, shape, encoding); первый вариант - базовый"""
+    from response_compression import available_encodings
+
+    variants = [('ascii', True, None, None), ('utf8', False, None, None), ('utf8_columns', False, 'columns', None)]
+    for encoding in available_encodings():
+        variants.append((f'utf8_{encoding}', False, None, encoding))
+        variants.append((f'utf8_columns_{encoding}', False, 'columns', encoding))
+    return variants
+
+
+def measure(db_path: str, repeat: int) -> Dict[str, Dict]:
+    """Размер ответа и время его формирования для каждого endpoint и варианта"""
+    os.environ['DATABASE_NAME'] = db_path
+    import app as app_module
+
+    client = app_module.app.test_client()
+    client.post('/api/auth/login', json=LOGIN)
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        baseline = None
+        for name, ensure_ascii, shape, encoding in _variants():
+            if shape and endpoint not in LIST_ENDPOINTS:
+                continue
+            app_module.app.json.ensure_ascii = ensure_ascii
+            url = f'/api/{endpoint}' + (f'?shape={shape}' if shape else '')
+            headers = {'Accept-Encoding': encoding or 'identity'}
+
+            timings, size = [], 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = client.get(url, headers=headers)
+                timings.append(time.perf_counter() - started)
+                size = len(response.data)
+                assert response.headers.get('Content-Encoding') == encoding or size < 1024, name
+
+            baseline = baseline or size
+            results[f'{endpoint}/{name}'] = {
+                'bytes': size,
+                'ratio': round(size / baseline, 3),
+                'saved_pct': round((1 - size / baseline) * 100, 1),
+                'p50_ms': round(sorted(timings)[len(timings) // 2] * 1000, 2),
+            }
+    app_module.app.json.ensure_ascii = False
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк размера ответов API Legal CRM')
+    parser.add_argument('--rows', type=int, default=10000, help='Размер синтетической базы')
+    parser.add_argument('--repeat', type=int, default=5, help='Запросов на вариант')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/)')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='legal_crm_payload_'), 'legal_crm.db')
+    print(f"📦 Заполнение базы {db_path}: {args.rows} строк")
+    counts = seed_database(db_path, args.rows, args.seed)
+
+    results = measure(db_path, args.repeat)
+    report = {
+        'meta': run_metadata('payload', rows=args.rows, dataset=counts, seed=args.seed, repeat=args.repeat),
+        'results': results,
+    }
+    path = save_results(report, args.output, 'payload')
+
+    print(f"\n{'вариант':<32} {'байт':>12} {'от базового':>12} {'p50 ms':>9}")
+    for name, stats in results.items():
+        print(f"{name:<32} {stats['bytes']:>12} {stats['ratio']:>12} {stats['p50_ms']:>9}")
+    print(f"\n💾 Результаты: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Генератор синтетической базы Legal CRM для бенчмарков
+
+Клиенты, дела и активности с русскими ФИО, телефонами и датами.
+Данные детерминированы значением --seed, поэтому прогоны сравнимы.
+
+    python -m benchmarks.seed --db bench.db --rows 100000
+"""
+
+import os
+import random
+import sqlite3
+import argparse
+import calendar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, Tuple
+
+# Доли строк: на 1 клиента 3 дела и 6 активностей
+CLIENT_SHARE = 0.1
+CASE_SHARE = 0.3
+
+BATCH_SIZE = 10000
+
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров',
+              'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин')
+FIRST_NAMES = ('Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей', 'Максим', 'Евгений', 'Иван',
+               'Михаил', 'Артём', 'Никита', 'Олег', 'Пётр', 'Юрий', 'Владимир', 'Николай')
+FEMALE_FIRST_NAMES = ('Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Татьяна', 'Ирина', 'Светлана',
+                      'Юлия', 'Алёна', 'Ксения', 'Дарья', 'Екатерина', 'Людмила', 'Галина', 'Вера')
+PATRONYMICS = ('Александров', 'Сергеев', 'Дмитриев', 'Андреев', 'Алексеев', 'Иванов', 'Михайлов',
+               'Петров', 'Николаев', 'Владимиров', 'Юрьев', 'Олегов')
+STREETS = ('ул. Ленина', 'пр. Мира', 'ул. Гагарина', 'ул. Советская', 'ул. Садовая', 'наб. Фонтанки',
+           'ул. Пушкина', 'Невский пр.', 'ул. Тверская', 'ул. Лесная')
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Нижний Новгород', 'Самара')
+CASE_TITLES = ('Взыскание задолженности', 'Раздел имущества', 'Трудовой спор', 'Защита прав потребителя',
+               'Наследственное дело', 'Оспаривание сделки', 'Расторжение брака', 'Банкротство физлица',
+               'Земельный спор', 'Возмещение ущерба после ДТП', 'Регистрация ООО', 'Арбитражный спор')
+CASE_STATUSES = ('active', 'active', 'active', 'pending', 'completed', 'closed')
+PRIORITIES = ('low', 'medium', 'medium', 'high')
+ACTIVITY_TYPES = ('Звонок', 'Встреча', 'Консультация', 'Подготовка документов', 'Судебное заседание',
+                  'Переписка', 'Подача иска')
+
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+
+
+def split_rows(rows: int) -> Tuple[int, int, int]:
+    """Делит общее число строк на клиентов, дела и активности"""
+    clients = max(1, int(rows * CLIENT_SHARE))
+    cases = max(1, int(rows * CASE_SHARE))
+    activities = max(0, rows - clients - cases)
+    return clients, cases, activities
+
+
+def _full_name(rng: random.Random) -> Tuple[str, str]:
+    last = rng.choice(LAST_NAMES)
+    patronymic = rng.choice(PATRONYMICS)
+    if rng.random() < 0.5:
+        first = rng.choice(FEMALE_FIRST_NAMES)
+        last = last[:-1] + 'а' if last.endswith('в') else last + 'а'
+        patronymic += 'на'
+    else:
+        first = rng.choice(FIRST_NAMES)
+        patronymic += 'ич'
+    return f'{last} {first} {patronymic}', f'{first}.{last}'.lower().translate(TRANSLIT)
+
+
+def _timestamp(rng: random.Random, start: datetime, span_days: int) -> int:
+    """Метка времени как в приложении: секунды UTC"""
+    moment = start + timedelta(seconds=rng.randrange(span_days * 86400))
+    return calendar.timegm(moment.timetuple())
+
+
+def _client_rows(rng: random.Random, count: int, start: datetime) -> Iterator[tuple]:
+    for index in range(count):
+        name, login = _full_name(rng)
+        created = _timestamp(rng, start, 3 * 365)
+        yield (
+            name,
+            f'+7 9{rng.randrange(10, 100)} {rng.randrange(100, 1000)}-{rng.randrange(10, 100)}-{rng.randrange(10, 100)}',
+            f'{login}{index}@example.ru',
+            f'г. {rng.choice(CITIES)}, {rng.choice(STREETS)}, д. {rng.randrange(1, 150)}, кв. {rng.randrange(1, 300)}',
+            rng.choice(('', '', 'Постоянный клиент', 'Рекомендация', 'Просил перезвонить вечером')),
+            created,
+            created,
+        )
+
+
+def _case_rows(rng: random.Random, count: int, clients: int, start: datetime) -> Iterator[tuple]:
+    for _ in range(count):
+        created = _timestamp(rng, start, 3 * 365)
+        due = (datetime.fromtimestamp(created, timezone.utc) + timedelta(days=rng.randrange(7, 365))).date()
+        yield (
+            f'{rng.choice(CASE_TITLES)} №{rng.randrange(1000, 99999)}',
+            'Описание дела: обстоятельства, документы, позиция клиента',
+            rng.randrange(1, clients + 1),
+            rng.choice(CASE_STATUSES),
+            rng.choice(PRIORITIES),
+            due.isoformat(),
+            created,
+            created,
+        )
+
+
+def _activity_rows(rng: random.Random, count: int, cases: int, case_clients: Dict[int, int],
+                   start: datetime) -> Iterator[tuple]:
+    for _ in range(count):
+        case_id = rng.randrange(1, cases + 1)
+        yield (
+            case_id,
+            case_clients[case_id],
+            rng.choice(ACTIVITY_TYPES),
+            'Комментарий юриста по ходу дела',
+            _timestamp(rng, start, 3 * 365),
+        )
+
+
+def _insert_batches(conn, sql: str, rows: Iterator[tuple]):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def seed_database(db_path: str, rows: int, seed: int = 42, reset: bool = True) -> Dict[str, int]:
+    """
+    Заполняет базу синтетическими данными
+
+    Схема создается через WebDatabase, поэтому совпадает с приложением.
+
+    Args:
+        db_path: Путь к файлу базы
+        rows: Общее число строк (клиенты + дела + активности)
+        seed: Зерно генератора
+        reset: Удалить существующий файл перед заполнением
+
+    Returns:
+        Dict[str, int]: Число созданных клиентов, дел и активностей
+    """
+    if reset:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    os.environ['DATABASE_NAME'] = db_path
+    from app import WebDatabase
+    WebDatabase(db_path).close_all()
+
+    clients, cases, activities = split_rows(rows)
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA journal_mode = MEMORY')
+        with conn:
+            _insert_batches(conn, """
+                INSERT INTO clients (full_name, phone, email, address, notes, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, _client_rows(rng, clients, start))
+            _insert_batches(conn, """
+                INSERT INTO cases (title, description, client_id, status, priority, due_date, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, _case_rows(rng, cases, clients, start))
+            case_clients = dict(conn.execute('SELECT id, client_id FROM cases'))
+            _insert_batches(conn, """
+                INSERT INTO activities (case_id, client_id, activity_type, description, datetime)
+                VALUES (?, ?, ?, ?, ?)
+            """, _activity_rows(rng, activities, cases, case_clients, start))
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    return {'clients': clients, 'cases': cases, 'activities': activities}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетическая база Legal CRM для бенчмарков')
+    parser.add_argument('--db', default='bench_legal_crm.db', help='Путь к файлу базы')
+    parser.add_argument('--rows', type=int, default=10000, help='Общее число строк (10000 - 1000000)')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    counts = seed_database(args.db, args.rows, args.seed)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"✅ База {args.db} заполнена за {elapsed:.1f} с: "
+          f"{counts['clients']} клиентов, {counts['cases']} дел, {counts['activities']} активностей")
+
+
+if __name__ == '__main__':
+    main()
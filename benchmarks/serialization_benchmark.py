@@ -0,0 +1,153 @@
+"""
+Бенчмарк сериализации списков Legal CRM
+
+Сравнивает путь строк от SQLite до JSON до и после перехода на метки времени
+INTEGER и row_codec:
+
+- before: метки времени текстом CURRENT_TIMESTAMP, sqlite3.Row, копирование
+  строк в списки, str() для дат в цикле, dict(zip(...)) на каждую строку;
+- after: секунды UTC, строки-кортежи и заранее собранный кодировщик колонок.
+
+Обе базы содержат одни и те же данные (копия переводится в старый формат):
+
+    python -m benchmarks.serialization_benchmark --rows 100000
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from typing import Dict, List, Tuple
+
+from benchmarks.common import run_metadata, save_results
+from benchmarks.seed import seed_database
+
+ENTITIES = ('clients', 'cases', 'activities')
+
+
+def to_legacy(db_path: str, legacy_path: str):
+    """Копия базы с метками времени текстом 'YYYY-MM-DD HH:MM:SS', как до миграции"""
+    from row_codec import EPOCH_COLUMNS
+
+    shutil.copyfile(db_path, legacy_path)
+    conn = sqlite3.connect(legacy_path)
+    try:
+        with conn:
+            for table, columns in EPOCH_COLUMNS.items():
+                assignments = ', '.join(f"{column} = datetime({column}, 'unixepoch')" for column in columns)
+                conn.execute(f"UPDATE {table} SET {assignments}")
+    finally:
+        conn.close()
+
+
+def _dumps(payload) -> str:
+    # Как jsonify в приложении: компактно, кириллица как есть, ключи отсортированы
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+
+def legacy_serialize(conn, sql: str, params: List, text_columns) -> Tuple[float, float, float]:
+    """Прежний list_response: sqlite3.Row -> list -> str() для дат -> dict(zip(...))"""
+    started = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    rows = cursor.fetchall()
+    fetched = time.perf_counter()
+    columns = [column[0] for column in cursor.description]
+    text_indexes = [index for index, column in enumerate(columns) if column in text_columns]
+    rows = [list(row) for row in rows]
+    for row in rows:
+        for index in text_indexes:
+            row[index] = str(row[index])
+    items = [dict(zip(columns, row)) for row in rows]
+    converted = time.perf_counter()
+    _dumps({'success': True, 'rows': items})
+    return fetched - started, converted - fetched, time.perf_counter() - converted
+
+
+def codec_serialize(conn, sql: str, params: List, timestamp_columns) -> Tuple[float, float, float]:
+    """Текущий list_response: кортежи и кодировщик row_codec"""
+    from row_codec import codec_for
+
+    started = time.perf_counter()
+    cursor = conn.execute(sql, params)
+    rows = cursor.fetchall()
+    fetched = time.perf_counter()
+    items = codec_for(cursor, timestamp_columns).dicts(rows)
+    converted = time.perf_counter()
+    _dumps({'success': True, 'rows': items})
+    return fetched - started, converted - fetched, time.perf_counter() - converted
+
+
+def _best(function, repeat: int) -> Dict[str, float]:
+    """Лучшее время каждого этапа (выборка, преобразование строк, JSON) и всего пути"""
+    runs = [function() for _ in range(repeat)]
+    best = {stage: min(run[index] for run in runs) for index, stage in enumerate(('fetch', 'convert', 'json'))}
+    best['total'] = min(sum(run) for run in runs)
+    return best
+
+
+def measure(db_path: str, legacy_path: str, repeat: int) -> Dict[str, Dict]:
+    """Строк в секунду (лучший из repeat прогонов) для каждого списка в обоих вариантах"""
+    from list_queries import build_list_query
+
+    legacy = sqlite3.connect(legacy_path)
+    legacy.row_factory = sqlite3.Row
+    current = sqlite3.connect(db_path)
+
+    results = {}
+    try:
+        for entity in ENTITIES:
+            sql, params, timestamp_fields, _ = build_list_query(entity)
+            count = current.execute(f"SELECT COUNT(*) FROM {entity}").fetchone()[0]
+            before = _best(lambda: legacy_serialize(legacy, sql, params, timestamp_fields), repeat)
+            after = _best(lambda: codec_serialize(current, sql, params, timestamp_fields), repeat)
+            results[entity] = {'rows': count}
+            for stage in ('fetch', 'convert', 'json', 'total'):
+                results[entity][stage] = {
+                    'before_ms': round(before[stage] * 1000, 1),
+                    'after_ms': round(after[stage] * 1000, 1),
+                    'before_rows_per_s': round(count / before[stage]),
+                    'after_rows_per_s': round(count / after[stage]),
+                    'speedup': round(before[stage] / after[stage], 2),
+                }
+    finally:
+        legacy.close()
+        current.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк сериализации списков Legal CRM')
+    parser.add_argument('--rows', type=int, default=100000, help='Размер синтетической базы')
+    parser.add_argument('--repeat', type=int, default=5, help='Прогонов на вариант (берется лучший)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='legal_crm_serialization_')
+    db_path = os.path.join(workdir, 'legal_crm.db')
+    legacy_path = os.path.join(workdir, 'legal_crm_legacy.db')
+    print(f"📦 Заполнение базы {db_path}: {args.rows} строк")
+    counts = seed_database(db_path, args.rows, args.seed)
+    to_legacy(db_path, legacy_path)
+
+    results = measure(db_path, legacy_path, args.repeat)
+    report = {
+        'meta': run_metadata('serialization', rows=args.rows, dataset=counts, seed=args.seed, repeat=args.repeat),
+        'results': results,
+    }
+    path = save_results(report, args.output, 'serialization')
+
+    print(f"\n{'список':<12} {'этап':<8} {'до, строк/с':>13} {'после, строк/с':>15} {'ускорение':>10}")
+    for name, stats in results.items():
+        for stage in ('fetch', 'convert', 'json', 'total'):
+            values = stats[stage]
+            print(f"{name:<12} {stage:<8} {values['before_rows_per_s']:>13} "
+                  f"{values['after_rows_per_s']:>15} {values['speedup']:>10}")
+    print(f"\n💾 Результаты: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Бенчмарк синхронизации с Яндекс.Диском на локальном фейковом сервере
+
+Замеряет операции DatabaseSyncManager (upload_to_cloud, download_from_cloud,
+restore_backup, cleanup_old_backups) и OAuth WebDAV пути (снимок базы +
+загрузка, скачивание + восстановление) на базах разного размера:
+
+    python -m benchmarks.sync_benchmark --rows 10000 100000 --repeat 5
+    python -m benchmarks.sync_benchmark --rows 100000 --latency 0.05 --bandwidth 5000000 --error-rate 0.05
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from benchmarks.common import (compare_results, max_rss_mb, print_table, run_metadata,
+                               save_results, summarize)
+from benchmarks.fake_yandex_disk import FakeYandexDisk
+from benchmarks.seed import seed_database
+
+REMOTE_PATH = '/legal_crm/'
+OPERATIONS = ('upload_to_cloud', 'download_from_cloud', 'restore_backup', 'cleanup_old_backups',
+              'webdav_upload_snapshot', 'webdav_download_restore')
+
+
+def _ok(result) -> bool:
+    if isinstance(result, dict):
+        return bool(result.get('success'))
+    return bool(result)
+
+
+def _measure(operation: Callable, prepare: Callable, repeat: int, disk: FakeYandexDisk,
+             trace_memory: bool) -> Dict:
+    """Выполняет операцию repeat раз; prepare() вызывается перед каждым повтором вне замера"""
+    latencies, errors = [], 0
+    disk.reset_stats()
+    wall = 0.0
+    for _ in range(repeat):
+        prepare()
+        started = time.perf_counter()
+        ok = _ok(operation())
+        elapsed = time.perf_counter() - started
+        wall += elapsed
+        latencies.append(elapsed)
+        errors += not ok
+
+    server = disk.stats()
+    stats = summarize(latencies, wall, errors)
+    stats['server_requests_per_op'] = round(sum(server['requests'].values()) / repeat, 1)
+    stats['uploaded_mb_per_op'] = round(server['bytes_received'] / repeat / 1024 / 1024, 2)
+    stats['downloaded_mb_per_op'] = round(server['bytes_sent'] / repeat / 1024 / 1024, 2)
+    stats['injected_errors'] = server['injected_errors']
+
+    if trace_memory:
+        prepare()
+        tracemalloc.start()
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats['peak_alloc_mb'] = round(peak / 1024 / 1024, 2)
+    stats['memory_mb'] = max_rss_mb()
+    return stats
+
+
+def run_size(rows: int, args, disk: FakeYandexDisk, workdir: str) -> Dict[str, Dict]:
+    """Все операции на базе одного размера"""
+    from sync.yandex_webdav import YandexDiskWebDAV, DatabaseSyncManager
+    from sync.yandex_oauth_client import YandexDiskOAuthWebDAV
+
+    db_path = os.path.join(workdir, f'legal_crm_{rows}.db')
+    seed_database(db_path, rows, args.seed)
+    db_size_mb = round(os.path.getsize(db_path) / 1024 / 1024, 2)
+
+    from app import WebDatabase
+    database = WebDatabase(db_path)
+
+    yandex_disk = YandexDiskWebDAV('bench@yandex.ru', 'app-password')
+    manager = DatabaseSyncManager(db_path, yandex_disk, REMOTE_PATH)
+    webdav = YandexDiskOAuthWebDAV('bench-oauth-token')
+
+    def reseed():
+        database.close_all()
+        seed_database(db_path, rows, args.seed)
+
+    def ensure_remote_copy():
+        if not os.path.exists(disk.local_path(f'{REMOTE_PATH}legal_crm_database.json')):
+            manager.upload_to_cloud()
+
+    def seed_old_backups():
+        # Половина копий старше срока хранения, половина свежие
+        for name in os.listdir(disk.local_path(REMOTE_PATH)):
+            if name.startswith('legal_crm_backup_'):
+                os.remove(os.path.join(disk.local_path(REMOTE_PATH), name))
+        now = datetime.now()
+        for index in range(args.backups):
+            age = timedelta(days=60 + index) if index % 2 == 0 else timedelta(days=index % 30)
+            disk.put_file(f'{REMOTE_PATH}legal_crm_backup_{index:04d}.json', b'{}', now - age)
+
+    snapshot_path = os.path.join(workdir, 'snapshot.db')
+    download_path = os.path.join(workdir, 'downloaded.db')
+
+    def webdav_upload():
+        database.backup_to(snapshot_path)
+        try:
+            return webdav.upload_file(snapshot_path, f'{REMOTE_PATH}legal_crm_backup_snapshot.db')
+        finally:
+            os.remove(snapshot_path)
+
+    def webdav_download():
+        if not webdav.download_file(f'{REMOTE_PATH}legal_crm_backup_snapshot.db', download_path):
+            return False
+        database.restore_from(download_path)
+        os.remove(download_path)
+        return True
+
+    def ensure_snapshot():
+        if not os.path.exists(disk.local_path(f'{REMOTE_PATH}legal_crm_backup_snapshot.db')):
+            webdav_upload()
+
+    scenarios = {
+        'upload_to_cloud': (manager.upload_to_cloud, lambda: None),
+        # Импорт JSON перезаписывает базу, поэтому перед каждым повтором она пересоздается
+        'download_from_cloud': (manager.download_from_cloud, lambda: (reseed(), ensure_remote_copy())),
+        'restore_backup': (lambda: manager.restore_backup('legal_crm_database.json'),
+                           lambda: (reseed(), ensure_remote_copy())),
+        'cleanup_old_backups': (lambda: manager.cleanup_old_backups(retention_days=30), seed_old_backups),
+        'webdav_upload_snapshot': (webdav_upload, lambda: None),
+        'webdav_download_restore': (webdav_download, ensure_snapshot),
+    }
+
+    results = {}
+    for name in args.operations:
+        operation, prepare = scenarios[name]
+        stats = _measure(operation, prepare, args.repeat, disk, args.memory)
+        stats['rows'] = rows
+        stats['db_size_mb'] = db_size_mb
+        results[f'{rows}/{name}'] = stats
+        print(f"  {rows}/{name}: p50={stats['p50_ms']} мс, ошибок {stats['errors']}/{args.repeat}", flush=True)
+
+    database.close_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк синхронизации на фейковом Яндекс.Диске')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000], help='Размеры баз (строк)')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов каждой операции')
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument('--backups', type=int, default=50, help='Число копий для cleanup_old_backups')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка сервера, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Случайная добавка к задержке, с')
+    parser.add_argument('--bandwidth', type=float, help='Скорость передачи, байт/с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+    parser.add_argument('--retry-after', type=float, help='Retry-After для инжектированных ошибок, с')
+    parser.add_argument('--memory', action='store_true', help='Замерить пиковые аллокации (tracemalloc)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Допустимый рост задержки (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    logging.getLogger('sync').setLevel(logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix='legal_crm_sync_bench_')
+
+    disk = FakeYandexDisk(latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+                          error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed)
+    with disk:
+        os.environ.update(disk.environ())
+        disk.put_file(f'{REMOTE_PATH}.keep')
+        print(f"🗄️  Фейковый Яндекс.Диск: {disk.base_url}")
+
+        results: Dict[str, Dict] = {}
+        for rows in args.rows:
+            print(f"📦 База {rows} строк")
+            results.update(run_size(rows, args, disk, workdir))
+
+    report = {
+        'meta': run_metadata('fake_disk', rows=args.rows, repeat=args.repeat, seed=args.seed,
+                             server={'latency': args.latency, 'jitter': args.jitter,
+                                     'bandwidth': args.bandwidth, 'error_rate': args.error_rate,
+                                     'retry_after': args.retry_after}),
+        'results': results,
+    }
+    path = save_results(report, args.output, 'sync')
+    print()
+    print_table(results)
+    print(f"\n💾 Результаты: {path}")
+
+    if args.baseline:
+        regressions = compare_results(report, args.baseline, args.threshold)
+        if regressions:
+            print("\n⚠️  Регрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""
+Массовый импорт Legal CRM из CSV
+Файл читается построчно, строки проверяются и вставляются пачками executemany
+внутри точек сохранения; ошибки собираются в отчет с номерами строк.
+Тело запроса сначала целиком принимается во временный файл: блокировка записи
+SQLite держится только пока разбирается локальный файл, а не пока идет загрузка.
+
+Из командной строки:
+
+    python bulk_import.py clients clients.csv --errors errors.csv
+    python bulk_import.py cases cases.csv --dry-run
+"""
+
+import io
+import os
+import csv
+import shutil
+import sqlite3
+import logging
+import argparse
+import itertools
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from normalization import normalize_email, normalize_name, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном executemany
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+# Ошибок в ответе API; остальные только считаются
+IMPORT_MAX_ERRORS = 1000
+
+# Тело запроса до такого размера принимается в память, больше - во временный файл на диске
+IMPORT_SPOOL_MEMORY = int(os.environ.get('IMPORT_SPOOL_MEMORY', 8 * 1024 * 1024))
+
+CASE_PRIORITIES = ('low', 'medium', 'high')
+
+# Колонки, которые пишутся в таблицу, в порядке INSERT
+IMPORT_COLUMNS = {
+    'clients': ('full_name', 'phone', 'email', 'address', 'notes'),
+    'cases': ('title', 'description', 'client_id', 'status', 'priority', 'due_date'),
+}
+
+# Дополнительные колонки файла, которые не пишутся напрямую
+IMPORT_EXTRA_COLUMNS = {
+    'clients': (),
+    'cases': ('client_name',),
+}
+
+import_bp = Blueprint('bulk_import', __name__)
+
+_db = None
+
+
+class RowError(Exception):
+    """Строка файла не прошла проверку"""
+
+
+class DuplicateRow(RowError):
+    """Строка повторяет существующего клиента или строку выше"""
+
+
+class ImportReport:
+    """Итог импорта и ошибки по строкам"""
+
+    def __init__(self, max_errors: Optional[int] = IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.total = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        self.ignored_columns: List[str] = []
+
+    def error(self, line: int, message: str, duplicate: bool = False):
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.failed += 1
+        if self.max_errors is None or len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message, 'duplicate': duplicate})
+
+    def to_dict(self) -> Dict:
+        return {
+            'total': self.total,
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': len(self.errors) < self.duplicates + self.failed,
+            'ignored_columns': self.ignored_columns,
+        }
+
+
+def _header_aliases(entity: str) -> Dict[str, str]:
+    """Заголовок файла -> колонка: имена колонок и подписи из экспорта"""
+    from report_export import EXPORT_HEADERS
+
+    columns = IMPORT_COLUMNS[entity] + IMPORT_EXTRA_COLUMNS[entity]
+    aliases = {column: column for column in columns}
+    for column, label in EXPORT_HEADERS.items():
+        if column in columns:
+            aliases.setdefault(label.lower(), column)
+    return aliases
+
+
+def read_csv(stream) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Строки CSV с номерами строк файла; разделитель (';', ',' или tab) определяется по заголовку
+
+    Args:
+        stream: Текстовый поток
+    """
+    first = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first, delimiters=';,\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(itertools.chain([first], stream), dialect)
+    for row in reader:
+        if any(value.strip() for value in row):
+            yield reader.line_num, row
+
+
+def _parse_date(value: str) -> str:
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            pass
+    raise RowError(f'Некорректная дата: {value}')
+
+
+class Importer:
+    """
+    Импорт одной таблицы в транзакции соединения
+
+    Справочники для проверки (телефоны и email клиентов, имена клиентов для
+    client_name) строятся один раз в начале и пополняются строками файла.
+    """
+
+    def __init__(self, conn, entity: str, report: ImportReport):
+        self.conn = conn
+        self.entity = entity
+        self.report = report
+        self.columns = IMPORT_COLUMNS[entity]
+        self.batch: List[Tuple[int, Tuple]] = []
+        self.sql = (f"INSERT INTO {entity} ({', '.join(self.columns)}) "
+                    f"VALUES ({', '.join('?' for _ in self.columns)})")
+        self._load_lookups()
+
+    def _load_lookups(self):
+        self.phones: Dict[str, str] = {}
+        self.emails: Dict[str, str] = {}
+        self.client_names: Dict[str, Optional[int]] = {}
+        self.client_ids = set()
+
+        for client_id, full_name, phone, email in self.conn.execute(
+                "SELECT id, full_name, phone, email FROM clients WHERE deleted_at IS NULL"):
+            where = f'клиент id {client_id}'
+            if normalize_phone(phone):
+                self.phones.setdefault(normalize_phone(phone), where)
+            if normalize_email(email):
+                self.emails.setdefault(normalize_email(email), where)
+            self.client_ids.add(client_id)
+            name = normalize_name(full_name)
+            # Однофамильцы с одинаковым ФИО - неоднозначная ссылка
+            self.client_names[name] = None if name in self.client_names else client_id
+
+    # ==================== ПРОВЕРКА СТРОК ====================
+
+    def validate(self, line: int, record: Dict[str, str]) -> Tuple:
+        if self.entity == 'clients':
+            return self._validate_client(line, record)
+        return self._validate_case(record)
+
+    def _validate_client(self, line: int, record: Dict[str, str]) -> Tuple:
+        if not record.get('full_name'):
+            raise RowError('ФИО клиента обязательно для заполнения')
+        phone = normalize_phone(record.get('phone'))
+        email = normalize_email(record.get('email'))
+        if phone and not 10 <= len(phone) <= 15:
+            raise RowError(f"Некорректный телефон: {record['phone']}")
+        if email and '@' not in email:
+            raise RowError(f"Некорректный email: {record['email']}")
+
+        duplicate = (phone and self.phones.get(phone)) or (email and self.emails.get(email))
+        if duplicate:
+            raise DuplicateRow(f'Дубликат: совпадает телефон или email ({duplicate})')
+        if phone:
+            self.phones[phone] = f'строка {line}'
+        if email:
+            self.emails[email] = f'строка {line}'
+        return tuple(record.get(column) or '' for column in self.columns)
+
+    def _validate_case(self, record: Dict[str, str]) -> Tuple:
+        if not record.get('title'):
+            raise RowError('Название дела обязательно для заполнения')
+
+        client_id = None
+        if record.get('client_id'):
+            try:
+                client_id = int(record['client_id'])
+            except ValueError:
+                raise RowError(f"Некорректный client_id: {record['client_id']}")
+            if client_id not in self.client_ids:
+                raise RowError(f'Клиент id {client_id} не найден')
+        elif record.get('client_name'):
+            name = normalize_name(record['client_name'])
+            if name not in self.client_names:
+                raise RowError(f"Клиент не найден: {record['client_name']}")
+            client_id = self.client_names[name]
+            if client_id is None:
+                raise RowError(f"Несколько клиентов с ФИО {record['client_name']}, укажите client_id")
+
+        priority = (record.get('priority') or 'medium').lower()
+        if priority not in CASE_PRIORITIES:
+            raise RowError(f"Приоритет должен быть одним из: {', '.join(CASE_PRIORITIES)}")
+        due_date = _parse_date(record['due_date']) if record.get('due_date') else None
+
+        return (record['title'], record.get('description') or '', client_id,
+                record.get('status') or 'active', priority, due_date)
+
+    # ==================== ВСТАВКА ====================
+
+    def add(self, line: int, row: Tuple):
+        self.batch.append((line, row))
+        if len(self.batch) >= IMPORT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Пачка одной командой; если база ее отвергла - построчно, чтобы найти виноватые строки"""
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+
+        self.conn.execute("SAVEPOINT import_batch")
+        try:
+            self.conn.executemany(self.sql, [row for _, row in batch])
+            self.conn.execute("RELEASE import_batch")
+            self.report.imported += len(batch)
+            return
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK TO import_batch")
+            self.conn.execute("RELEASE import_batch")
+
+        for line, row in batch:
+            self.conn.execute("SAVEPOINT import_row")
+            try:
+                self.conn.execute(self.sql, row)
+                self.conn.execute("RELEASE import_row")
+                self.report.imported += 1
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK TO import_row")
+                self.conn.execute("RELEASE import_row")
+                self.report.error(line, f'Ошибка базы данных: {e}')
+
+
+def spool(stream):
+    """
+    Принимает поток целиком до начала импорта
+
+    Медленная загрузка text/csv иначе шла бы внутри транзакции импорта и
+    держала блокировку записи для остальных запросов.
+
+    Returns:
+        SpooledTemporaryFile: Копия потока, готовая к чтению с начала
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY)
+    shutil.copyfileobj(stream, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def run_import(database, entity: str, stream, dry_run: bool = False,
+               max_errors: Optional[int] = IMPORT_MAX_ERRORS) -> Dict:
+    """
+    Импорт CSV в таблицу
+
+    Args:
+        database: Экземпляр WebDatabase
+        entity: 'clients' или 'cases'
+        stream: Бинарный поток с CSV (UTF-8, допускается BOM); читается внутри
+            транзакции, поэтому должен быть локальным (файл или spool())
+        dry_run: Только проверить: транзакция откатывается
+        max_errors: Сколько ошибок сохранять в отчете (None - все)
+
+    Returns:
+        dict: Отчет ImportReport.to_dict()
+    """
+    if entity not in IMPORT_COLUMNS:
+        raise ValueError(f"Импорт поддерживается для: {', '.join(IMPORT_COLUMNS)}")
+
+    report = ImportReport(max_errors)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    rows = read_csv(text)
+    try:
+        _, header = next(rows)
+    except StopIteration:
+        raise ValueError('Файл пуст')
+
+    aliases = _header_aliases(entity)
+    mapping = [aliases.get(name.strip().lower()) for name in header]
+    report.ignored_columns = [name for name, column in zip(header, mapping) if column is None]
+    if not any(mapping):
+        raise ValueError(f"Не найдено ни одной известной колонки. Ожидаются: {', '.join(aliases)}")
+
+    with database.get_connection() as conn:
+        conn.execute("BEGIN")
+        importer = Importer(conn, entity, report)
+        for line, values in rows:
+            report.total += 1
+            record = {column: value.strip() for column, value in zip(mapping, values) if column}
+            try:
+                importer.add(line, importer.validate(line, record))
+            except RowError as e:
+                report.error(line, str(e), duplicate=isinstance(e, DuplicateRow))
+        importer.flush()
+        if dry_run:
+            conn.rollback()
+
+    result = report.to_dict()
+    result['dry_run'] = dry_run
+    logger.info(f"📥 Импорт {entity}: {report.imported} из {report.total}, "
+                f"дублей {report.duplicates}, ошибок {report.failed}" + (' (проверка)' if dry_run else ''))
+    return result
+
+
+@import_bp.route('/api/import/<entity>', methods=['POST'])
+@login_required
+def import_entity(entity):
+    """
+    Импорт CSV: файл в поле file (multipart) или телом запроса text/csv
+
+    ?dry_run=1 - только проверка без записи
+    """
+    try:
+        # multipart werkzeug уже принял целиком; тело text/csv принимаем сами
+        upload = request.files.get('file')
+        stream = upload.stream if upload else spool(request.stream)
+        dry_run = request.args.get('dry_run') in ('1', 'true')
+        try:
+            return jsonify({'success': True, **run_import(_db, entity, stream, dry_run=dry_run)})
+        finally:
+            if not upload:
+                stream.close()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    except Exception as e:
+        logger.error(f"❌ Ошибка импорта {entity}: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_bulk_import(app, database):
+    """
+    Подключает /api/import/<entity> к приложению
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    app.register_blueprint(import_bp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Импорт клиентов и дел Legal CRM из CSV')
+    parser.add_argument('entity', choices=sorted(IMPORT_COLUMNS), help='Таблица')
+    parser.add_argument('path', help='CSV файл (UTF-8)')
+    parser.add_argument('--dry-run', action='store_true', help='Только проверить файл')
+    parser.add_argument('--errors', help='Записать ошибки в CSV файл')
+    parser.add_argument('--database', help='Файл базы (по умолчанию DATABASE_NAME)')
+    args = parser.parse_args()
+
+    if args.database:
+        os.environ['DATABASE_NAME'] = args.database
+    from app import db
+
+    with open(args.path, 'rb') as stream:
+        result = run_import(db, args.entity, stream, dry_run=args.dry_run, max_errors=None)
+
+    print(f"📥 Строк: {result['total']}, импортировано: {result['imported']}, "
+          f"дублей: {result['duplicates']}, ошибок: {result['failed']}"
+          + (' (проверка, ничего не записано)' if args.dry_run else ''))
+    if result['ignored_columns']:
+        print(f"⚠️ Пропущены колонки: {', '.join(result['ignored_columns'])}")
+    if args.errors:
+        with open(args.errors, 'w', newline='', encoding='utf-8-sig') as report_file:
+            writer = csv.writer(report_file, delimiter=';')
+            writer.writerow(['Строка', 'Ошибка', 'Дубликат'])
+            for error in result['errors']:
+                writer.writerow([error['line'], error['error'], 'да' if error['duplicate'] else ''])
+        print(f"💾 Ошибки: {args.errors}")
+    else:
+        for error in result['errors'][:20]:
+            print(f"  строка {error['line']}: {error['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Календарь сроков Legal CRM
+Сроки по делам (cases.due_date) за период, ближайшие дедлайны и ICS лента
+для подписки из Google Calendar / Outlook
+"""
+
+import os
+import hmac
+import hashlib
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from flask import Blueprint, Response, jsonify, request
+from flask_login import current_user, login_required
+
+from list_queries import CLOSED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Токен для подписки на ICS из календарных программ (они не передают cookie сессии)
+CALENDAR_FEED_TOKEN = os.environ.get('CALENDAR_FEED_TOKEN')
+
+UPCOMING_DEFAULT_DAYS = 7
+CALENDAR_MAX_DAYS = 366
+
+# Приоритет дела -> PRIORITY в iCalendar (1 - высший)
+ICS_PRIORITIES = {'high': 1, 'medium': 5, 'low': 9}
+
+# Диапазон по due_date читается из индекса idx_cases_due_status в порядке дат;
+# статус проверяется по тому же индексу, клиент - по первичному ключу
+DEADLINES_SQL = f"""
+    SELECT c.id, c.title, c.status, c.priority, c.due_date, c.client_id, cl.full_name AS client_name
+    FROM cases c
+    LEFT JOIN clients cl ON cl.id = c.client_id
+    WHERE c.due_date >= ? AND c.due_date <= ? AND c.deleted_at IS NULL
+      AND c.status NOT IN ({', '.join(f"'{status}'" for status in CLOSED_STATUSES)})
+    ORDER BY c.due_date, c.id
+"""
+
+calendar_bp = Blueprint('calendar', __name__)
+
+_db = None
+
+
+def _parse_date(name: str, default: date) -> date:
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Параметр {name} должен быть датой в формате YYYY-MM-DD')
+
+
+def deadlines(date_from: date, date_to: date) -> List[Dict]:
+    """Открытые дела со сроком в диапазоне (включительно)"""
+    with _db.get_connection() as conn:
+        cursor = conn.execute(DEADLINES_SQL, (date_from.isoformat(), date_to.isoformat()))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def _etag(*parts) -> str:
+    versions = _db.get_table_versions(('cases', 'clients'))
+    raw = repr((versions, parts)).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _conditional(payload: Dict, etag: str):
+    """JSON ответ с ETag; 304, если у клиента та же версия"""
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+@calendar_bp.route('/api/calendar', methods=['GET'])
+@login_required
+def get_calendar():
+    """
+    Сроки по делам за период: ?from=2024-05-01&to=2024-05-31 (по умолчанию текущий месяц)
+    """
+    try:
+        today = date.today()
+        month_start = today.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        try:
+            date_from = _parse_date('from', month_start)
+            date_to = _parse_date('to', next_month - timedelta(days=1))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        if date_to < date_from:
+            return jsonify({'success': False, 'error': 'Дата to раньше даты from'})
+        if (date_to - date_from).days >= CALENDAR_MAX_DAYS:
+            return jsonify({'success': False, 'error': f'Период не может быть больше {CALENDAR_MAX_DAYS} дней'})
+
+        etag = _etag('calendar', date_from, date_to)
+        if request.if_none_match.contains_weak(etag):
+            return _conditional({}, etag)
+        return _conditional({
+            'success': True,
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'deadlines': deadlines(date_from, date_to),
+        }, etag)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@calendar_bp.route('/api/calendar/upcoming', methods=['GET'])
+@login_required
+def get_upcoming():
+    """
+    Ближайшие сроки: ?days=7 - с сегодняшнего дня; ?overdue=1 - плюс число просроченных
+    """
+    try:
+        days = max(1, min(request.args.get('days', UPCOMING_DEFAULT_DAYS, type=int), CALENDAR_MAX_DAYS))
+        with_overdue = request.args.get('overdue') in ('1', 'true')
+        today = date.today()
+        date_to = today + timedelta(days=days - 1)
+
+        # Сегодняшняя дата входит в ETag: список меняется и без записей в базу
+        etag = _etag('upcoming', today, days, with_overdue)
+        if request.if_none_match.contains_weak(etag):
+            return _conditional({}, etag)
+
+        payload = {
+            'success': True,
+            'from': today.isoformat(),
+            'to': date_to.isoformat(),
+            'deadlines': deadlines(today, date_to),
+        }
+        if with_overdue:
+            with _db.get_connection() as conn:
+                # Пустые сроки ('') меньше любой даты - отсекаем нижней границей
+                payload['overdue'] = conn.execute(f"""
+                    SELECT COUNT(*) FROM cases
+                    WHERE due_date > '' AND due_date < ? AND deleted_at IS NULL
+                      AND status NOT IN ({', '.join('?' for _ in CLOSED_STATUSES)})
+                """, (today.isoformat(), *CLOSED_STATUSES)).fetchone()[0]
+        return _conditional(payload, etag)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+# ==================== ICS ====================
+
+def _ics_escape(text: Optional[str]) -> str:
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _ics_fold(line: str) -> str:
+    """Перенос строк длиннее 75 байт (RFC 5545, 3.1), не разрывая символы UTF-8"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts, current, size = [], [], 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > (75 if not parts else 74):
+            parts.append(''.join(current))
+            current, size = [], 0
+        current.append(char)
+        size += char_size
+    parts.append(''.join(current))
+    return '\r\n '.join(parts)
+
+
+def _ics_timestamp(value: Optional[int]) -> str:
+    # updated_at - секунды UTC
+    if not isinstance(value, int):
+        value = time.time()
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(value))
+
+
+def build_ics(rows) -> bytes:
+    """iCalendar с событием на весь день для каждого срока"""
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Legal CRM//Deadlines//RU',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Legal CRM - сроки по делам',
+    ]
+    for row in rows:
+        try:
+            due = datetime.strptime(row['due_date'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            continue
+        summary = row['title'] + (f" ({row['client_name']})" if row['client_name'] else '')
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:case-{row['id']}@legal-crm",
+            f"DTSTAMP:{_ics_timestamp(row['updated_at'])}",
+            f"SEQUENCE:{row['version'] or 0}",
+            f"DTSTART;VALUE=DATE:{due.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(due + timedelta(days=1)).strftime('%Y%m%d')}",
+            f"SUMMARY:{_ics_escape(summary)}",
+            f"DESCRIPTION:{_ics_escape(row['description'])}",
+            f"PRIORITY:{ICS_PRIORITIES.get(row['priority'], 0)}",
+            'TRANSP:TRANSPARENT',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ('\r\n'.join(_ics_fold(line) for line in lines) + '\r\n').encode('utf-8')
+
+
+class IcsCache:
+    """
+    Готовая ICS лента воркера
+
+    Пересобирается, только когда изменились версии таблиц cases/clients, так
+    что частые опросы календарных программ не нагружают базу.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._body = b''
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[bytes, str]:
+        """(тело ленты, ETag)"""
+        key = _etag('ics')
+        with self._lock:
+            if key != self._key:
+                with _db.get_connection() as conn:
+                    rows = conn.execute(f"""
+                        SELECT c.id, c.title, c.description, c.priority, c.due_date, c.updated_at, c.version,
+                               cl.full_name AS client_name
+                        FROM cases c
+                        LEFT JOIN clients cl ON cl.id = c.client_id
+                        WHERE c.due_date > '' AND c.deleted_at IS NULL
+                          AND c.status NOT IN ({', '.join('?' for _ in CLOSED_STATUSES)})
+                        ORDER BY c.due_date, c.id
+                    """, CLOSED_STATUSES).fetchall()
+                self._body = build_ics(rows)
+                self._key = key
+                logger.info(f"📅 ICS лента пересобрана: {len(rows)} сроков")
+            return self._body, self._key
+
+
+ics_cache = IcsCache()
+
+
+def _feed_allowed() -> bool:
+    if current_user.is_authenticated:
+        return True
+    token = request.args.get('token')
+    return bool(CALENDAR_FEED_TOKEN and token and hmac.compare_digest(token, CALENDAR_FEED_TOKEN))
+
+
+@calendar_bp.route('/api/calendar.ics', methods=['GET'])
+def get_calendar_ics():
+    """ICS лента открытых сроков; без сессии - по ?token=CALENDAR_FEED_TOKEN"""
+    if not _feed_allowed():
+        return jsonify({'success': False, 'error': 'Требуется авторизация'}), 401
+    try:
+        body, etag = ics_cache.get()
+    except Exception as e:
+        logger.error(f"❌ Ошибка формирования ICS: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+    response = Response(body, mimetype='text/calendar')
+    response.headers['Content-Disposition'] = 'inline; filename="legal_crm_deadlines.ics"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
+
+
+def init_calendar_feed(app, database):
+    """
+    Подключает календарь сроков к приложению
+
+    Индекс idx_cases_due_status создается в WebDatabase.init_database.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    app.register_blueprint(calendar_bp)
@@ -0,0 +1,384 @@
+"""
+Поиск дублей клиентов Legal CRM
+Нормализованные телефон, email и ФИО (латиницей) и блоки похожих ФИО лежат в
+индексированных таблицах client_match_*, поэтому кандидаты в дубли
+находятся по индексам, без сравнения каждого клиента с каждым
+"""
+
+import os
+import zlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from normalization import name_key, normalize_email, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Минимальное сходство похожих ФИО по триграммам (коэффициент Жаккара)
+DUPLICATE_NAME_THRESHOLD = float(os.environ.get('DUPLICATE_NAME_THRESHOLD', 0.7))
+
+DUPLICATES_DEFAULT_LIMIT = 100
+DUPLICATES_MAX_LIMIT = 1000
+
+# Похожих клиентов в ответе проверки при создании
+CHECK_MAX_RESULTS = 10
+
+# Клиентов, пересчитываемых за один проход
+REINDEX_BATCH_SIZE = 5000
+
+# Ограничение числа параметров в IN (...)
+ROWS_CHUNK_SIZE = 500
+
+# Признаки совпадения: (признак, колонка client_match_keys); порядок - от надежных к слабым
+MATCH_COLUMNS = (('phone', 'phone'), ('email', 'email'), ('name', 'name_key'))
+REASONS = tuple(reason for reason, _ in MATCH_COLUMNS) + ('similar_name',)
+
+# Слова короче этого сравниваются в блоках и по двум крайним буквам, а не только по трем
+SHORT_WORD_LENGTH = 6
+
+# Тот же индекс создается в WebDatabase.init_database; при полном пересчете он строится заново
+BLOCKS_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_client_match_blocks ON client_match_blocks (block, client_id)"
+
+duplicates_bp = Blueprint('client_duplicates', __name__)
+
+_db = None
+
+
+def match_keys(full_name: Optional[str], phone: Optional[str], email: Optional[str]) -> Tuple:
+    """(телефон, email, ключ ФИО) для сравнения; короткие телефоны и email без @ не сравниваются"""
+    phone = normalize_phone(phone)
+    email = normalize_email(email)
+    return (phone if phone and len(phone) >= 10 else None,
+            email if email and '@' in email else None,
+            name_key(full_name))
+
+
+def trigrams(key: str) -> Set[str]:
+    """Триграммы ключа ФИО по словам с пробелом по краям: 'ivan' -> {' iv', 'iva', 'van', 'an '}"""
+    grams = set()
+    for word in key.split():
+        padded = f' {word} '
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left: Set[str], right: Set[str]) -> float:
+    """Сходство ФИО: коэффициент Жаккара наборов триграмм"""
+    common = len(left & right)
+    total = len(left) + len(right) - common
+    return common / total if total else 0.0
+
+
+def name_blocks(key: str) -> Set[int]:
+    """
+    Блоки ключа ФИО: остальные слова + начало или конец одного слова
+
+    Два ФИО, которые отличаются одним словом с опечаткой (замена, пропуск,
+    лишняя или переставленная буква, вариант транслитерации), попадают в
+    общий блок: одна правка не задевает либо начало слова, либо его конец. Триграммы для отбора кандидатов не годятся: имена и отчества
+    у многих клиентов общие, и почти любая пара делит частые триграммы.
+    Блоки хранятся 64-битными хэшами (crc32 + adler32), чтобы таблица
+    оставалась компактной; случайные совпадения отсеивает проверка сходства.
+    """
+    words = key.split()
+    blocks = set()
+    for skipped, word in enumerate(words):
+        rest = ' '.join(words[:skipped] + words[skipped + 1:])
+        # Короткие слова - еще и по двум буквам: правка в середине задевает и начало, и конец из трех
+        for size in ((3, 2) if len(word) < SHORT_WORD_LENGTH else (3,)):
+            for data in (f'{rest}|{word[:size]}'.encode('utf-8'), f'{rest}|~{word[-size:]}'.encode('utf-8')):
+                blocks.add((zlib.crc32(data) << 32 | zlib.adler32(data)) - (1 << 63))
+    return blocks
+
+
+def _chunks(ids: List[int]) -> Iterator[List[int]]:
+    for start in range(0, len(ids), ROWS_CHUNK_SIZE):
+        yield ids[start:start + ROWS_CHUNK_SIZE]
+
+
+# ==================== ИНДЕКС ====================
+
+class MatchIndex:
+    """
+    Синхронизация таблиц client_match_* с таблицей clients
+
+    Ключи пересчитываются по журналу change_events, который триггеры пишут
+    при любой записи в clients (API, импорт, другие воркеры), так что
+    обработчикам записи ничего не нужно знать о поиске дублей. Позиция в
+    журнале хранится в client_match_state, и журнал догоняет тот воркер,
+    который обратился первым.
+    """
+
+    def __init__(self):
+        self.database = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Догоняет изменения clients, если версия таблицы сменилась"""
+        _, generation, version, _ = self.database.get_table_versions(('clients',))[0]
+        if self._version == (generation, version):
+            return
+        with self._lock:
+            with self.database.get_connection() as conn:
+                # IMMEDIATE: воркеры пересчитывают ключи по очереди
+                conn.execute("BEGIN IMMEDIATE")
+                self._catch_up(conn)
+            self._version = (generation, version)
+
+    def _catch_up(self, conn):
+        generation = conn.execute(
+            "SELECT generation FROM table_versions WHERE table_name = 'clients'").fetchone()[0]
+        state = conn.execute("SELECT generation, last_event_id FROM client_match_state WHERE id = 1").fetchone()
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_events'").fetchone()
+        last_assigned = row[0] if row else 0
+
+        if state is None or state[0] != generation or not self._apply_events(conn, state[1], last_assigned):
+            self._rebuild(conn)
+        conn.execute("""
+            INSERT OR REPLACE INTO client_match_state (id, generation, last_event_id) VALUES (1, ?, ?)
+        """, (generation, last_assigned))
+
+    def _apply_events(self, conn, after_id: int, last_assigned: int) -> bool:
+        """Пересчитывает клиентов, измененных после after_id; False - нужен полный пересчет"""
+        # Журнал восстановлен из копии или события после after_id удалены по сроку хранения
+        oldest = conn.execute("SELECT MIN(id) FROM change_events").fetchone()[0]
+        if after_id > last_assigned or after_id < (oldest - 1 if oldest is not None else last_assigned):
+            return False
+        if conn.execute("SELECT 1 FROM change_events WHERE id > ? AND table_name = '*' LIMIT 1",
+                        (after_id,)).fetchone():
+            return False
+
+        ids = [row[0] for row in conn.execute("""
+            SELECT DISTINCT row_id FROM change_events WHERE id > ? AND table_name = 'clients'
+        """, (after_id,))]
+        for chunk in _chunks(ids):
+            self._reindex(conn, chunk)
+        return True
+
+    def _reindex(self, conn, ids: List[int]):
+        placeholders = ', '.join('?' for _ in ids)
+        old = conn.execute(f"SELECT client_id, name_key FROM client_match_keys WHERE client_id IN ({placeholders})",
+                           ids).fetchall()
+        conn.executemany("DELETE FROM client_match_blocks WHERE block = ? AND client_id = ?",
+                         [(block, client_id) for client_id, key in old for block in name_blocks(key)])
+        conn.execute(f"DELETE FROM client_match_keys WHERE client_id IN ({placeholders})", ids)
+        self._insert(conn, conn.execute(
+            f"SELECT id, full_name, phone, email FROM clients WHERE id IN ({placeholders}) AND deleted_at IS NULL",
+            ids).fetchall())
+
+    @staticmethod
+    def _insert(conn, rows):
+        keys, blocks = [], []
+        for client_id, full_name, phone, email in rows:
+            phone, email, key = match_keys(full_name, phone, email)
+            keys.append((client_id, phone, email, key))
+            blocks.extend((block, client_id) for block in name_blocks(key))
+        conn.executemany("INSERT INTO client_match_keys (client_id, phone, email, name_key) VALUES (?, ?, ?, ?)",
+                         keys)
+        conn.executemany("INSERT INTO client_match_blocks (block, client_id) VALUES (?, ?)", blocks)
+
+    def _rebuild(self, conn):
+        # Индекс блоков строится один раз после вставки - в разы быстрее, чем пополнять его построчно
+        conn.execute("DROP INDEX IF EXISTS idx_client_match_blocks")
+        conn.execute("DELETE FROM client_match_blocks")
+        conn.execute("DELETE FROM client_match_keys")
+        cursor = conn.execute("SELECT id, full_name, phone, email FROM clients WHERE deleted_at IS NULL ORDER BY id")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(REINDEX_BATCH_SIZE)
+            if not rows:
+                break
+            self._insert(conn, rows)
+            count += len(rows)
+        conn.execute(BLOCKS_INDEX_SQL)
+        logger.info(f"👥 Ключи поиска дублей пересчитаны: {count} клиентов")
+
+
+match_index = MatchIndex()
+
+
+# ==================== ПОИСК ====================
+
+def _clients(conn, ids: List[int]) -> Dict[int, Dict]:
+    clients = {}
+    for chunk in _chunks(ids):
+        for row in conn.execute(f"""
+            SELECT id, full_name, phone, email FROM clients
+            WHERE id IN ({', '.join('?' for _ in chunk)}) AND deleted_at IS NULL
+        """, chunk):
+            clients[row['id']] = dict(row)
+    return clients
+
+
+def find_matches(full_name: str, phone: Optional[str] = None, email: Optional[str] = None,
+                 exclude_id: Optional[int] = None, threshold: float = DUPLICATE_NAME_THRESHOLD,
+                 limit: int = CHECK_MAX_RESULTS) -> List[Dict]:
+    """
+    Существующие клиенты, похожие на нового
+
+    Returns:
+        list: Клиенты с полями reasons (phone/email/name/similar_name) и
+        similarity, сначала совпавшие по самым надежным признакам
+    """
+    match_index.sync()
+    values = match_keys(full_name, phone, email)
+    reasons: Dict[int, List[str]] = defaultdict(list)
+    scores: Dict[int, float] = {}
+    with _db.get_connection() as conn:
+        for (reason, column), value in zip(MATCH_COLUMNS, values):
+            if value:
+                for (client_id,) in conn.execute(
+                        f"SELECT client_id FROM client_match_keys WHERE {column} = ?", (value,)):
+                    reasons[client_id].append(reason)
+
+        grams = trigrams(values[2])
+        blocks = list(name_blocks(values[2]))
+        if blocks:
+            for client_id, key in conn.execute(f"""
+                SELECT client_id, name_key FROM client_match_keys
+                WHERE client_id IN (
+                    SELECT client_id FROM client_match_blocks WHERE block IN ({', '.join('?' for _ in blocks)})
+                )
+            """, blocks):
+                score = similarity(grams, trigrams(key))
+                if score >= threshold:
+                    scores[client_id] = round(score, 3)
+                    if 'name' not in reasons[client_id]:
+                        reasons[client_id].append('similar_name')
+        reasons.pop(exclude_id, None)
+
+        ranked = sorted(reasons, key=lambda client_id: (
+            min(REASONS.index(reason) for reason in reasons[client_id]),
+            -len(reasons[client_id]), -scores.get(client_id, 0.0), client_id))[:limit]
+        clients = _clients(conn, ranked)
+    return [dict(clients[client_id], reasons=reasons[client_id], similarity=scores.get(client_id))
+            for client_id in ranked if client_id in clients]
+
+
+def duplicate_groups(threshold: float = DUPLICATE_NAME_THRESHOLD) -> List[Dict]:
+    """
+    Группы возможных дублей по всей базе
+
+    Совпадения по телефону, email и ФИО - GROUP BY по индексам
+    client_match_keys, кандидаты в похожие ФИО - общие блоки client_match_blocks.
+    """
+    match_index.sync()
+    groups = []
+    with _db.get_connection() as conn:
+        # Все выборки - из одного снимка базы
+        conn.execute("BEGIN")
+        names: Dict[str, List[int]] = {}
+        for reason, column in MATCH_COLUMNS:
+            for value, ids in conn.execute(f"""
+                SELECT {column}, group_concat(client_id) FROM client_match_keys
+                WHERE {column} IS NOT NULL AND {column} != ''
+                GROUP BY {column}
+            """):
+                client_ids = sorted(int(client_id) for client_id in ids.split(','))
+                if reason == 'name':
+                    names[value] = client_ids
+                if len(client_ids) > 1:
+                    groups.append({'reason': reason, 'value': value, 'client_ids': client_ids})
+
+        key_of = {client_id: key for key, client_ids in names.items() for client_id in client_ids}
+        grams: Dict[str, Set[str]] = {}
+        similar, seen = [], set()
+        for (ids,) in conn.execute("""
+            SELECT group_concat(client_id) FROM client_match_blocks
+            GROUP BY block HAVING COUNT(*) > 1
+        """):
+            keys = sorted({key_of[int(client_id)] for client_id in ids.split(',') if int(client_id) in key_of})
+            for position, left in enumerate(keys):
+                for right in keys[position + 1:]:
+                    if (left, right) in seen:
+                        continue
+                    seen.add((left, right))
+                    for key in (left, right):
+                        if key not in grams:
+                            grams[key] = trigrams(key)
+                    score = similarity(grams[left], grams[right])
+                    if score >= threshold:
+                        similar.append({'reason': 'similar_name', 'value': [left, right],
+                                        'similarity': round(score, 3),
+                                        'client_ids': sorted(names[left] + names[right])})
+        similar.sort(key=lambda group: -group['similarity'])
+    return groups + similar
+
+
+# ==================== API ====================
+
+def _threshold() -> float:
+    threshold = request.args.get('threshold', DUPLICATE_NAME_THRESHOLD, type=float)
+    if not 0 < threshold <= 1:
+        raise ValueError('Параметр threshold должен быть в диапазоне (0, 1]')
+    return threshold
+
+
+@duplicates_bp.route('/api/clients/duplicates', methods=['GET'])
+@login_required
+def get_duplicates():
+    """
+    Возможные дубли клиентов: ?limit=100&threshold=0.7
+
+    Группы отсортированы от надежных признаков к слабым: телефон, email,
+    ФИО целиком, похожее ФИО.
+    """
+    try:
+        try:
+            threshold = _threshold()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        limit = max(1, min(request.args.get('limit', DUPLICATES_DEFAULT_LIMIT, type=int), DUPLICATES_MAX_LIMIT))
+
+        groups = duplicate_groups(threshold)
+        page = groups[:limit]
+        with _db.get_connection() as conn:
+            clients = _clients(conn, sorted({client_id for group in page for client_id in group['client_ids']}))
+        for group in page:
+            group['clients'] = [clients[client_id] for client_id in group.pop('client_ids') if client_id in clients]
+        return jsonify({'success': True, 'total': len(groups), 'groups': page})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@duplicates_bp.route('/api/clients/duplicates/check', methods=['GET'])
+@login_required
+def check_duplicates():
+    """Проверка перед созданием или изменением: ?full_name=&phone=&email=&exclude_id="""
+    try:
+        try:
+            threshold = _threshold()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        matches = find_matches(request.args.get('full_name', ''), request.args.get('phone'),
+                               request.args.get('email'), request.args.get('exclude_id', type=int), threshold)
+        return jsonify({'success': True, 'duplicates': matches})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_client_duplicates(app, database):
+    """
+    Подключает поиск дублей клиентов к приложению
+
+    Таблицы client_match_* создаются в WebDatabase.init_database; ключи
+    существующих клиентов рассчитываются здесь при первом запуске.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    match_index.database = database
+    try:
+        match_index.sync()
+    except Exception as e:
+        logger.error(f"❌ Ошибка расчета ключей поиска дублей: {e}")
+    app.register_blueprint(duplicates_bp)
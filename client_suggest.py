@@ -0,0 +1,171 @@
+"""
+Подсказки клиентов по имени Legal CRM
+Отсортированный массив нормализованных ключей в памяти воркера; поиск по
+префиксу - bisect, обновления - по журналу change_events
+"""
+
+import bisect
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from normalization import normalize_name
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+suggest_bp = Blueprint('client_suggest', __name__)
+
+
+def name_keys(full_name: str) -> List[str]:
+    """
+    Ключи индекса: имя целиком и с каждого следующего слова
+
+    'Иванов Пётр Сергеевич' -> ['иванов петр сергеевич', 'петр сергеевич', 'сергеевич'],
+    так что клиент находится и по фамилии, и по имени.
+    """
+    words = normalize_name(full_name).split(' ')
+    return [' '.join(words[start:]) for start in range(len(words)) if words[start]]
+
+
+class PrefixIndex:
+    """
+    Префиксный индекс имен клиентов
+
+    Пары (ключ, id) лежат в одном отсортированном списке: поиск - bisect
+    и проход вперед, пока ключ начинается с запроса. Изменения применяются по журналу change_events
+    (его пишут триггеры на каждую запись в clients, в том числе в других
+    воркерах), поэтому индекс строится целиком только при первом обращении
+    и после восстановления базы.
+    """
+
+    def __init__(self):
+        self.database = None
+        self._keys: List[Tuple[str, int]] = []
+        self._names: Dict[int, str] = {}
+        self._version = None
+        self._last_event_id = None
+        self._lock = threading.RLock()
+
+    # ==================== ИЗМЕНЕНИЕ ====================
+
+    def _insert(self, client_id: int, full_name: str):
+        self._names[client_id] = full_name
+        for key in name_keys(full_name):
+            bisect.insort(self._keys, (key, client_id))
+
+    def _remove(self, client_id: int):
+        full_name = self._names.pop(client_id, None)
+        if full_name is None:
+            return
+        for key in name_keys(full_name):
+            position = bisect.bisect_left(self._keys, (key, client_id))
+            if position < len(self._keys) and self._keys[position] == (key, client_id):
+                del self._keys[position]
+
+    def _rebuild(self, conn):
+        self._last_event_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+        names = {row[0]: row[1] for row in conn.execute("SELECT id, full_name FROM clients WHERE deleted_at IS NULL")}
+        self._names = names
+        self._keys = sorted((key, client_id) for client_id, full_name in names.items()
+                            for key in name_keys(full_name))
+        logger.info(f"🔤 Индекс подсказок клиентов: {len(names)} клиентов, {len(self._keys)} ключей")
+
+    def _apply_events(self, conn) -> bool:
+        """Применяет изменения clients после последнего события; False - нужен полный пересчет"""
+        oldest = conn.execute("SELECT MIN(id) FROM change_events").fetchone()[0]
+        if oldest is not None and oldest > self._last_event_id + 1:
+            # События удалены по сроку хранения - изменения могли потеряться
+            return False
+        rows = conn.execute("""
+            SELECT id, table_name, row_id, op FROM change_events
+            WHERE id > ? AND table_name IN ('clients', '*')
+            ORDER BY id
+        """, (self._last_event_id,)).fetchall()
+
+        changed = set()
+        for event_id, table, row_id, _ in rows:
+            if table == '*':
+                return False
+            changed.add(row_id)
+            self._last_event_id = event_id
+
+        if changed:
+            ids = sorted(changed)
+            placeholders = ', '.join('?' for _ in ids)
+            current = {row[0]: row[1] for row in conn.execute(
+                f"SELECT id, full_name FROM clients WHERE id IN ({placeholders}) AND deleted_at IS NULL", ids)}
+            for client_id in ids:
+                if self._names.get(client_id) == current.get(client_id):
+                    continue
+                self._remove(client_id)
+                if client_id in current:
+                    self._insert(client_id, current[client_id])
+        return True
+
+    def refresh(self):
+        """Догоняет изменения таблицы clients, если ее версия сменилась"""
+        _, generation, version, _ = self.database.get_table_versions(('clients',))[0]
+        with self._lock:
+            if self._version == (generation, version):
+                return
+            with self.database.get_connection() as conn:
+                if self._version is None or self._version[0] != generation or not self._apply_events(conn):
+                    self._rebuild(conn)
+            self._version = (generation, version)
+
+    # ==================== ПОИСК ====================
+
+    def search(self, query: str, limit: int = SUGGEST_DEFAULT_LIMIT) -> List[Dict]:
+        """Клиенты, у которых имя или одно из слов имени начинается с query"""
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            keys = self._keys
+            position = bisect.bisect_left(keys, (prefix,))
+            while position < len(keys) and len(results) < limit:
+                key, client_id = keys[position]
+                if not key.startswith(prefix):
+                    break
+                if client_id not in seen:
+                    seen.add(client_id)
+                    results.append({'id': client_id, 'full_name': self._names[client_id]})
+                position += 1
+        return results
+
+    def __len__(self):
+        return len(self._names)
+
+
+suggest_index = PrefixIndex()
+
+
+@suggest_bp.route('/api/clients/suggest', methods=['GET'])
+@login_required
+def suggest_clients():
+    """Подсказки для выбора клиента: ?q=иван&limit=10"""
+    try:
+        limit = max(1, min(request.args.get('limit', SUGGEST_DEFAULT_LIMIT, type=int), SUGGEST_MAX_LIMIT))
+        suggest_index.refresh()
+        return jsonify({'success': True, 'clients': suggest_index.search(request.args.get('q', ''), limit)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_client_suggest(app, database):
+    """
+    Подключает /api/clients/suggest к приложению
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    suggest_index.database = database
+    app.register_blueprint(suggest_bp)
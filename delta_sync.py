@@ -0,0 +1,186 @@
+"""
+Дельта-синхронизация Legal CRM
+/api/changes отдает строки, измененные после курсора, и id удаленных строк,
+чтобы браузер держал локальную копию таблиц и не скачивал их целиком
+"""
+
+import os
+import json
+import base64
+import binascii
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from flask import Blueprint, jsonify, request
+from flask_login import current_user
+
+from list_queries import ACTIVITY_VISIBLE
+from row_codec import codec_for
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, которые браузер держит у себя
+SYNC_TABLES = ('clients', 'cases', 'activities')
+
+# Строки, которые браузер не видит: помеченные на удаление (purge_worker) отдаются как удаленные,
+# действия удаленных клиентов и дел - по общему правилу list_queries.ACTIVITY_VISIBLE
+VISIBLE_ROWS = {'clients': 'deleted_at IS NULL', 'cases': 'deleted_at IS NULL',
+                'activities': ACTIVITY_VISIBLE.format(a='activities')}
+
+# Событий журнала за один ответ; остальное клиент дочитывает по has_more
+CHANGES_BATCH_SIZE = int(os.environ.get('CHANGES_BATCH_SIZE', 1000))
+
+# Ограничение числа параметров в IN (...)
+ROWS_CHUNK_SIZE = 500
+
+changes_bp = Blueprint('changes', __name__)
+
+_db = None
+
+
+def encode_sync_cursor(generation: str, event_id: int) -> str:
+    """Непрозрачный курсор: поколение базы и последнее отданное событие журнала"""
+    raw = json.dumps([generation, event_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_sync_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Разбор курсора синхронизации
+
+    Raises:
+        ValueError: Курсор поврежден
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        generation, event_id = json.loads(raw)
+        return str(generation), int(event_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Некорректный курсор')
+
+
+def _generation(conn) -> str:
+    row = conn.execute("SELECT generation FROM table_versions WHERE table_name = ?", (SYNC_TABLES[0],)).fetchone()
+    return row[0] if row else ''
+
+
+def _empty_changes() -> Dict[str, Dict[str, List]]:
+    return {table: {'upserted': [], 'deleted': []} for table in SYNC_TABLES}
+
+
+def _fetch_rows(conn, table: str, ids: List[int]) -> Dict[int, Dict]:
+    rows = {}
+    for start in range(0, len(ids), ROWS_CHUNK_SIZE):
+        chunk = ids[start:start + ROWS_CHUNK_SIZE]
+        placeholders = ', '.join('?' for _ in chunk)
+        visible = f" AND {VISIBLE_ROWS[table]}" if table in VISIBLE_ROWS else ''
+        cursor = conn.cursor(tuples=True).execute(
+            f"SELECT * FROM {table} WHERE id IN ({placeholders}){visible}", chunk)
+        codec = codec_for(cursor)
+        for row in cursor.fetchall():
+            rows[row[0]] = codec.to_dict(row)
+    return rows
+
+
+def snapshot(conn) -> Dict:
+    """Полная выгрузка таблиц и курсор, с которого продолжаются дельты"""
+    generation = _generation(conn)
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+    changes = _empty_changes()
+    for table in SYNC_TABLES:
+        visible = f" WHERE {VISIBLE_ROWS[table]}" if table in VISIBLE_ROWS else ''
+        cursor = conn.cursor(tuples=True).execute(f"SELECT * FROM {table}{visible} ORDER BY id")
+        changes[table]['upserted'] = codec_for(cursor).dicts(cursor.fetchall())
+    return {'cursor': encode_sync_cursor(generation, last_id), 'reset': True, 'has_more': False,
+            'changes': changes}
+
+
+def delta(conn, since: str) -> Optional[Dict]:
+    """
+    Изменения после курсора или None, если нужна полная выгрузка
+
+    Полная выгрузка нужна, когда база восстановлена из копии (сменилось
+    поколение или в журнале есть reload) или события после курсора уже
+    удалены из журнала по сроку хранения.
+    """
+    try:
+        generation, after_id = decode_sync_cursor(since)
+    except ValueError:
+        return None
+    if generation != _generation(conn):
+        return None
+
+    # sqlite_sequence помнит последний id журнала, даже если старые события удалены
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_events'").fetchone()
+    last_assigned = row[0] if row else 0
+    oldest = conn.execute("SELECT MIN(id) FROM change_events").fetchone()[0]
+    if after_id > last_assigned:
+        return None
+    if after_id < (oldest - 1 if oldest is not None else last_assigned):
+        return None
+
+    events = conn.execute("""
+        SELECT id, table_name, row_id, op FROM change_events
+        WHERE id > ? ORDER BY id LIMIT ?
+    """, (after_id, CHANGES_BATCH_SIZE)).fetchall()
+
+    # Для каждой строки важна только последняя операция
+    latest: Dict[str, Dict[int, str]] = {table: {} for table in SYNC_TABLES}
+    for event_id, table, row_id, op in events:
+        if table == '*' and op == 'reload':
+            return None
+        if table in latest and row_id is not None:
+            latest[table][row_id] = op
+
+    changes = _empty_changes()
+    for table, ops in latest.items():
+        live_ids = [row_id for row_id, op in ops.items() if op != 'delete']
+        rows = _fetch_rows(conn, table, live_ids)
+        changes[table]['upserted'] = [rows[row_id] for row_id in live_ids if row_id in rows]
+        # Строка могла быть удалена уже после последнего события пачки
+        changes[table]['deleted'] = [row_id for row_id, op in ops.items()
+                                     if op == 'delete' or row_id not in rows]
+
+    last_id = events[-1][0] if events else after_id
+    return {'cursor': encode_sync_cursor(generation, last_id), 'reset': False,
+            'has_more': len(events) == CHANGES_BATCH_SIZE, 'changes': changes}
+
+
+@changes_bp.route('/api/changes', methods=['GET'])
+def get_changes():
+    """
+    Изменения clients, cases и activities после курсора
+
+    Без ?since (или при устаревшем курсоре) отдается полная выгрузка с reset: true.
+    Ответ: {cursor, reset, has_more, changes: {таблица: {upserted: [...], deleted: [id, ...]}}}
+    Без сессии - 401 (а не переход на /login): по нему браузер удаляет локальную копию.
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'error': 'Требуется авторизация'}), 401
+    try:
+        since = request.args.get('since')
+        with _db.get_connection() as conn:
+            # Выгрузка и курсор читаются одной транзакцией чтения
+            conn.execute("BEGIN")
+            result = delta(conn, since) if since else None
+            if result is None:
+                result = snapshot(conn)
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.error(f"❌ Ошибка дельта-синхронизации: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_delta_sync(app, database):
+    """
+    Подключает /api/changes к приложению
+
+    Журнал change_events и его триггеры создаются в WebDatabase.init_database.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    app.register_blueprint(changes_bp)
@@ -0,0 +1,190 @@
+"""
+Кэш сущностей Legal CRM
+Ограниченный кэш клиентов, дел, услуг и платежей по id в памяти воркера. Записи этого воркера
+сбрасывают кэш сразу, записи других воркеров - через счетчики table_versions
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from flask import g, has_request_context
+
+from row_codec import codec_for
+
+logger = logging.getLogger(__name__)
+
+# Максимум записей в кэше одной таблицы
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 2048))
+
+# Запросы чтения одной сущности по id (помеченные на удаление клиенты и дела не видны)
+ENTITY_QUERIES = {
+    'clients': "SELECT * FROM clients WHERE id = ? AND deleted_at IS NULL",
+    'cases': "SELECT * FROM cases WHERE id = ? AND deleted_at IS NULL",
+    'services': "SELECT * FROM services WHERE id = ?",
+    'payments': "SELECT * FROM payments WHERE id = ?",
+}
+
+
+class TableCache:
+    """LRU кэш одной таблицы; блокировку держит EntityCache"""
+
+    __slots__ = ('entries', 'version', 'hits', 'misses', 'evictions', 'invalidations')
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+class EntityCache:
+    """
+    Read-through кэш сущностей по id
+
+    Версии таблиц читаются из table_versions один раз за HTTP запрос (вне
+    запроса - при каждом обращении). Если версия изменилась, кэш таблицы
+    очищается целиком: так изменения других воркеров видны уже в следующем
+    запросе. Строка читается после версии, поэтому в кэше не может оказаться
+    данных старее той версии, под которой они сохранены.
+    """
+
+    def __init__(self, database=None, max_entries: int = ENTITY_CACHE_SIZE):
+        self.database = database
+        self.max_entries = max_entries
+        self._tables: Dict[str, TableCache] = {table: TableCache() for table in ENTITY_QUERIES}
+        self._lock = threading.Lock()
+
+    def _read_versions(self) -> Dict[str, tuple]:
+        rows = self.database.get_table_versions(tuple(ENTITY_QUERIES))
+        return {name: (generation, version) for name, generation, version, _ in rows}
+
+    def _versions(self) -> Dict[str, tuple]:
+        if not has_request_context():
+            return self._read_versions()
+        versions = g.get('entity_cache_versions')
+        if versions is None:
+            versions = g.entity_cache_versions = self._read_versions()
+        return versions
+
+    def get(self, table: str, entity_id: int) -> Optional[Dict]:
+        """
+        Сущность по id (копия словаря) или None, если ее нет
+
+        Args:
+            table: Таблица из ENTITY_QUERIES
+            entity_id: id записи
+        """
+        version = self._versions()[table]
+        cache = self._tables[table]
+
+        with self._lock:
+            if cache.version != version:
+                if cache.entries:
+                    cache.invalidations += 1
+                cache.entries.clear()
+                cache.version = version
+            entity = cache.entries.get(entity_id)
+            if entity is not None:
+                cache.entries.move_to_end(entity_id)
+                cache.hits += 1
+                return dict(entity)
+            cache.misses += 1
+
+        with self.database.get_connection() as conn:
+            cursor = conn.cursor(tuples=True).execute(ENTITY_QUERIES[table], (entity_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        # Метки времени сразу в ISO 8601: сущность из кэша отдается в JSON как есть
+        entity = codec_for(cursor).to_dict(row)
+
+        with self._lock:
+            # Версия могла смениться, пока строка читалась - тогда не кэшируем
+            if cache.version == version:
+                cache.entries[entity_id] = entity
+                cache.entries.move_to_end(entity_id)
+                if len(cache.entries) > self.max_entries:
+                    cache.entries.popitem(last=False)
+                    cache.evictions += 1
+        return dict(entity)
+
+    def invalidate(self, table: str, entity_id: Optional[int] = None):
+        """
+        Сброс после записи в этом воркере
+
+        Args:
+            table: Таблица
+            entity_id: id записи; None - вся таблица
+        """
+        cache = self._tables.get(table)
+        if cache is None:
+            return
+        with self._lock:
+            if entity_id is None:
+                cache.entries.clear()
+            else:
+                cache.entries.pop(entity_id, None)
+            cache.invalidations += 1
+        if has_request_context():
+            g.pop('entity_cache_versions', None)
+
+    def clear(self):
+        """Полный сброс (например, после восстановления базы)"""
+        with self._lock:
+            for cache in self._tables.values():
+                cache.entries.clear()
+                cache.version = None
+        if has_request_context():
+            g.pop('entity_cache_versions', None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Счетчики попаданий и промахов по таблицам"""
+        with self._lock:
+            return {
+                table: {
+                    'size': len(cache.entries),
+                    'hits': cache.hits,
+                    'misses': cache.misses,
+                    'evictions': cache.evictions,
+                    'invalidations': cache.invalidations,
+                }
+                for table, cache in self._tables.items()
+            }
+
+
+entity_cache = EntityCache()
+
+
+def _collect_metrics():
+    """Счетчики кэша для /metrics"""
+    stats = entity_cache.stats()
+    families = []
+    for counter, help_text in (('hits', 'Попадания в кэш сущностей'),
+                               ('misses', 'Промахи кэша сущностей'),
+                               ('evictions', 'Вытеснения из кэша сущностей'),
+                               ('invalidations', 'Сбросы кэша сущностей')):
+        samples = [(('table',), (table,), values[counter]) for table, values in sorted(stats.items())]
+        families.append((f'legal_crm_entity_cache_{counter}_total', 'counter', help_text, samples))
+    samples = [(('table',), (table,), values['size']) for table, values in sorted(stats.items())]
+    families.append(('legal_crm_entity_cache_entries', 'gauge', 'Записей в кэше сущностей', samples))
+    return families
+
+
+def init_entity_cache(app, database):
+    """
+    Подключает кэш сущностей к приложению
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    from request_metrics import add_collector
+
+    entity_cache.database = database
+    add_collector(_collect_metrics)
+    logger.info(f"🗃️  Кэш сущностей: до {entity_cache.max_entries} записей на таблицу")
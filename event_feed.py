@@ -0,0 +1,250 @@
+"""
+Лента изменений Legal CRM (Server-Sent Events)
+Триггеры записывают изменения строк в таблицу change_events, общую для всех
+воркеров gunicorn; /api/events отдает их браузеру потоком SSE
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from flask import Blueprint, Response, request, stream_with_context
+from flask_login import login_required
+
+logger = logging.getLogger(__name__)
+
+# Как часто фоновый поток воркера проверяет журнал, секунды
+EVENTS_POLL_SECONDS = float(os.environ.get('EVENTS_POLL_SECONDS', 1.0))
+
+# Комментарий-пинг, чтобы прокси не закрывали простаивающее соединение
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+
+# Длительность одного потока: браузер переподключается сам и передает Last-Event-ID
+EVENTS_STREAM_SECONDS = float(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+
+# Сколько дней хранить журнал изменений
+EVENTS_RETENTION_DAYS = int(os.environ.get('EVENTS_RETENTION_DAYS', 30))
+
+# Последние события в памяти воркера; отставшие потоки читают журнал напрямую
+EVENTS_BUFFER_SIZE = 1000
+EVENTS_BATCH_SIZE = 500
+EVENTS_PRUNE_INTERVAL = 3600
+EVENTS_RETRY_MS = 3000
+
+events_bp = Blueprint('events', __name__)
+
+_db = None
+
+
+def _row_to_event(row) -> Dict:
+    event_id, table, row_id, op, version = row
+    return {'id': event_id, 'table': table, 'row_id': row_id, 'op': op, 'version': version}
+
+
+class EventBroker:
+    """
+    Раздача журнала изменений потокам SSE одного воркера
+
+    Один фоновый поток на воркер следит за PRAGMA data_version своего
+    соединения и читает новые строки журнала только после чужих коммитов.
+    Потоки SSE ждут на Condition и берут события из буфера в памяти, так что
+    число запросов к базе не зависит от числа подключенных браузеров.
+    """
+
+    def __init__(self):
+        self.database = None
+        self.last_id = 0
+        self._buffer = deque(maxlen=EVENTS_BUFFER_SIZE)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Запускает поток опроса (заново после fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._buffer.clear()
+            self.last_id = self._max_id()
+            self._thread = threading.Thread(target=self._run, name='event-feed-poller', daemon=True)
+            self._thread.start()
+
+    def _max_id(self) -> int:
+        with self.database.get_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+
+    def _fetch_after(self, conn, after_id: int) -> List[Dict]:
+        rows = conn.execute("""
+            SELECT id, table_name, row_id, op, version FROM change_events
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (after_id, EVENTS_BATCH_SIZE)).fetchall()
+        return [_row_to_event(row) for row in rows]
+
+    def _run(self):
+        conn = sqlite3.connect(self.database.db_name, timeout=5, check_same_thread=False)
+        data_version = None
+        pruned_at = 0.0
+        try:
+            while True:
+                try:
+                    current = conn.execute("PRAGMA data_version").fetchone()[0]
+                    if current != data_version:
+                        data_version = current
+                        self._poll(conn)
+                    if time.monotonic() - pruned_at >= EVENTS_PRUNE_INTERVAL:
+                        pruned_at = time.monotonic()
+                        prune(conn)
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ Ошибка чтения журнала изменений: {e}")
+                    data_version = None
+                time.sleep(EVENTS_POLL_SECONDS)
+        finally:
+            conn.close()
+
+    def _poll(self, conn):
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+        if max_id < self.last_id:
+            # Журнал пришел из восстановленной копии: потоки получат reload
+            with self._cond:
+                self._buffer.clear()
+                self.last_id = max_id
+                self._cond.notify_all()
+            return
+
+        while max_id > self.last_id:
+            events = self._fetch_after(conn, self.last_id)
+            if not events:
+                break
+            with self._cond:
+                self._buffer.extend(events)
+                self.last_id = events[-1]['id']
+                self._cond.notify_all()
+
+    def wait(self, after_id: int, timeout: float) -> Tuple[List[Dict], int]:
+        """
+        События после after_id; ждет не дольше timeout
+
+        Returns:
+            tuple: (события, новый after_id). Если after_id больше последнего
+            id журнала (база восстановлена из копии), возвращается событие reload.
+        """
+        self._ensure_started()
+        with self._cond:
+            if self.last_id == after_id:
+                self._cond.wait(timeout)
+            last_id = self.last_id
+            if after_id > last_id:
+                return [{'id': last_id, 'table': '*', 'row_id': None, 'op': 'reload', 'version': None}], last_id
+            if after_id == last_id:
+                return [], after_id
+            if self._buffer and self._buffer[0]['id'] <= after_id + 1:
+                events = [event for event in self._buffer if event['id'] > after_id]
+                return events, events[-1]['id'] if events else after_id
+
+        # Поток отстал больше чем на размер буфера - дочитываем из базы
+        with self.database.get_connection() as conn:
+            events = self._fetch_after(conn, after_id)
+        return events, events[-1]['id'] if events else after_id
+
+
+broker = EventBroker()
+
+
+def publish(table: str, op: str, row_id: Optional[int] = None, version: Optional[int] = None):
+    """
+    Запись события, которое не порождается триггерами (синхронизация и т.п.)
+
+    Args:
+        table: Источник события ('sync', '*')
+        op: Операция ('upload', 'cleanup', 'reload', ...)
+    """
+    if _db is None:
+        return
+    try:
+        with _db.get_connection() as conn:
+            conn.execute("INSERT INTO change_events (table_name, row_id, op, version) VALUES (?, ?, ?, ?)",
+                         (table, row_id, op, version))
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Не удалось записать событие {table}/{op}: {e}")
+
+
+def prune(conn):
+    """Удаляет события старше EVENTS_RETENTION_DAYS"""
+    # id растут вместе с created_at: ищем первое свежее событие и удаляем все до него
+    cursor = conn.execute("""
+        DELETE FROM change_events WHERE id < (
+            SELECT id FROM change_events WHERE created_at >= datetime('now', ?) ORDER BY id LIMIT 1
+        )
+    """, (f'-{EVENTS_RETENTION_DAYS} days',))
+    conn.commit()
+    if cursor.rowcount:
+        logger.info(f"🧹 Журнал изменений: удалено {cursor.rowcount} старых событий")
+
+
+def _format(event: Dict) -> str:
+    if event['op'] == 'reload':
+        return f"id: {event['id']}\nevent: reload\ndata: {{}}\n\n"
+    data = json.dumps({'table': event['table'], 'id': event['row_id'], 'op': event['op'],
+                       'version': event['version']}, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: change\ndata: {data}\n\n"
+
+
+def _stream(after_id: int):
+    yield f"retry: {EVENTS_RETRY_MS}\n\n"
+    deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        events, after_id = broker.wait(after_id, min(EVENTS_HEARTBEAT_SECONDS, EVENTS_POLL_SECONDS * 5))
+        if events:
+            yield ''.join(_format(event) for event in events)
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= EVENTS_HEARTBEAT_SECONDS:
+            yield ": ping\n\n"
+            last_sent = time.monotonic()
+
+
+@events_bp.route('/api/events', methods=['GET'])
+@login_required
+def event_stream():
+    """
+    Поток изменений строк: event: change, data: {table, id, op, version}
+
+    При переподключении браузер передает Last-Event-ID и получает пропущенные события.
+    """
+    broker._ensure_started()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        after_id = int(last_event_id) if last_event_id else broker.last_id
+    except ValueError:
+        after_id = broker.last_id
+
+    response = Response(stream_with_context(_stream(after_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def init_event_feed(app, database):
+    """
+    Подключает ленту изменений к приложению
+
+    Таблица change_events и триггеры создаются в WebDatabase.init_database.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    broker.database = database
+    app.register_blueprint(events_bp)
@@ -0,0 +1,457 @@
+"""
+Запросы списков Legal CRM
+Описание сущностей для выборки полей (?fields=), встраивания связанных
+записей (?include=), справочников для выпадающих списков и ленты клиента
+"""
+
+import json
+import base64
+import binascii
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from row_codec import ISO_FORMAT, to_epoch
+
+
+class Relation(NamedTuple):
+    """Связанная сущность, встраиваемая через ?include="""
+    entity: str
+    # 'one' - объект (или null), 'many' - массив объектов
+    kind: str
+    # Условие связи: {r} - псевдоним связанной таблицы, {p} - основной
+    condition: str
+    order: Optional[str] = None
+
+
+class Filter(NamedTuple):
+    """Фильтр списка по параметру query string"""
+    expression: str
+    # 'eq' - равенство, 'like' - подстрока, 'from'/'to' - диапазон дат включительно
+    op: str
+    # Колонка хранит секунды UTC (row_codec.EPOCH_COLUMNS), а не дату строкой
+    epoch: bool = False
+
+
+class EntitySpec(NamedTuple):
+    """Сущность списка: таблица, доступные поля и связи"""
+    table: str
+    alias: str
+    # Поле ответа -> выражение SQL; собственные колонки таблицы идут первыми
+    fields: Dict[str, str]
+    columns: Tuple[str, ...]
+    joins: str = ''
+    order: str = ''
+    relations: Dict[str, Relation] = {}
+    # Метки времени (секунды UTC), которые отдаются строкой ISO 8601
+    timestamp_fields: Tuple[str, ...] = ()
+    # Параметр query string -> фильтр
+    filters: Dict[str, Filter] = {}
+    # Условие видимости строки ({a} - псевдоним таблицы): помеченные на удаление скрыты
+    where: str = ''
+    # Условие видимости строки архива (activity_archive): без копии в основной
+    # таблице и без удаленных после переноса клиента или дела
+    archive_where: str = ''
+
+
+def _own(alias: str, columns: Tuple[str, ...]) -> Dict[str, str]:
+    return {column: f'{alias}.{column}' for column in columns}
+
+
+CLIENT_COLUMNS = ('id', 'full_name', 'phone', 'email', 'address', 'notes', 'created_at', 'updated_at', 'version')
+CASE_COLUMNS = ('id', 'title', 'description', 'client_id', 'status', 'priority', 'due_date',
+                'created_at', 'updated_at', 'version')
+ACTIVITY_COLUMNS = ('id', 'case_id', 'client_id', 'activity_type', 'description', 'datetime')
+SERVICE_COLUMNS = ('id', 'client_id', 'case_id', 'name', 'description', 'category', 'price', 'duration_hours',
+                   'service_date', 'created_at', 'updated_at', 'version')
+PAYMENT_COLUMNS = ('id', 'client_id', 'case_id', 'service_id', 'amount', 'payment_type', 'payment_method',
+                   'payment_date', 'status', 'description', 'created_at', 'updated_at', 'version')
+
+# Закрытые статусы дел: нет в сроках календаря, действия таких дел уходят в архив
+CLOSED_STATUSES = ('completed', 'closed')
+
+# Счетчик table_versions, который растет, когда клиент или дело удаляется, восстанавливается
+# или вычищается: от этого зависит archive_where действий (кэш видимых строк архива)
+ARCHIVE_PARENTS_VERSION = 'archive_parents'
+
+# Активность видна, пока видны ее клиент и дело: помеченные на удаление скрываются
+# сразу, а вычищает их purge_worker. Одно правило для горячей таблицы и архива -
+# списков, /api/changes и статистики
+ACTIVITY_VISIBLE = ('({a}.client_id IS NULL OR EXISTS (SELECT 1 FROM main.clients'
+                    ' WHERE id = {a}.client_id AND deleted_at IS NULL))'
+                    ' AND ({a}.case_id IS NULL OR EXISTS (SELECT 1 FROM main.cases'
+                    ' WHERE id = {a}.case_id AND deleted_at IS NULL))')
+
+ENTITIES: Dict[str, EntitySpec] = {
+    'clients': EntitySpec(
+        table='clients', alias='cl',
+        fields=_own('cl', CLIENT_COLUMNS),
+        columns=CLIENT_COLUMNS,
+        order='cl.created_at DESC',
+        relations={
+            'cases': Relation('cases', 'many', '{r}.client_id = {p}.id', '{r}.created_at DESC'),
+            'activities': Relation('activities', 'many', '{r}.client_id = {p}.id', '{r}.datetime DESC'),
+            'services': Relation('services', 'many', '{r}.client_id = {p}.id', '{r}.created_at DESC'),
+            'payments': Relation('payments', 'many', '{r}.client_id = {p}.id', '{r}.payment_date DESC'),
+        },
+        timestamp_fields=('created_at', 'updated_at'),
+        filters={
+            'q': Filter("cl.full_name || ' ' || COALESCE(cl.phone, '') || ' ' || COALESCE(cl.email, '')", 'like'),
+            'from': Filter('cl.created_at', 'from', epoch=True),
+            'to': Filter('cl.created_at', 'to', epoch=True),
+        },
+        where='{a}.deleted_at IS NULL',
+    ),
+    'cases': EntitySpec(
+        table='cases', alias='c',
+        fields={**_own('c', CASE_COLUMNS), 'client_name': 'cl.full_name'},
+        columns=CASE_COLUMNS,
+        joins='LEFT JOIN clients cl ON c.client_id = cl.id',
+        order='c.created_at DESC',
+        relations={
+            'client': Relation('clients', 'one', '{r}.id = {p}.client_id'),
+            'activities': Relation('activities', 'many', '{r}.case_id = {p}.id', '{r}.datetime DESC'),
+        },
+        timestamp_fields=('created_at', 'updated_at'),
+        filters={
+            'client_id': Filter('c.client_id', 'eq'),
+            'status': Filter('c.status', 'eq'),
+            'priority': Filter('c.priority', 'eq'),
+            'from': Filter('c.created_at', 'from', epoch=True),
+            'to': Filter('c.created_at', 'to', epoch=True),
+        },
+        where='{a}.deleted_at IS NULL',
+    ),
+    'activities': EntitySpec(
+        table='activities', alias='a',
+        fields={**_own('a', ACTIVITY_COLUMNS), 'case_title': 'c.title', 'client_name': 'cl.full_name'},
+        columns=ACTIVITY_COLUMNS,
+        joins='LEFT JOIN cases c ON a.case_id = c.id LEFT JOIN clients cl ON a.client_id = cl.id',
+        order='a.datetime DESC',
+        relations={
+            'case': Relation('cases', 'one', '{r}.id = {p}.case_id'),
+            'client': Relation('clients', 'one', '{r}.id = {p}.client_id'),
+        },
+        timestamp_fields=('datetime',),
+        filters={
+            'client_id': Filter('a.client_id', 'eq'),
+            'case_id': Filter('a.case_id', 'eq'),
+            'activity_type': Filter('a.activity_type', 'eq'),
+            'from': Filter('a.datetime', 'from', epoch=True),
+            'to': Filter('a.datetime', 'to', epoch=True),
+        },
+        where=ACTIVITY_VISIBLE,
+        archive_where='NOT EXISTS (SELECT 1 FROM main.activities h WHERE h.id = {a}.id) AND ' + ACTIVITY_VISIBLE,
+    ),
+    'services': EntitySpec(
+        table='services', alias='s',
+        fields={**_own('s', SERVICE_COLUMNS), 'client_name': 'cl.full_name', 'case_title': 'c.title'},
+        columns=SERVICE_COLUMNS,
+        joins='LEFT JOIN clients cl ON s.client_id = cl.id LEFT JOIN cases c ON s.case_id = c.id',
+        order='s.created_at DESC',
+        relations={
+            'client': Relation('clients', 'one', '{r}.id = {p}.client_id'),
+            'case': Relation('cases', 'one', '{r}.id = {p}.case_id'),
+            'payments': Relation('payments', 'many', '{r}.service_id = {p}.id', '{r}.payment_date DESC'),
+        },
+        timestamp_fields=('created_at', 'updated_at'),
+        filters={
+            'client_id': Filter('s.client_id', 'eq'),
+            'case_id': Filter('s.case_id', 'eq'),
+            'category': Filter('s.category', 'eq'),
+            'from': Filter('s.service_date', 'from'),
+            'to': Filter('s.service_date', 'to'),
+        },
+    ),
+    'payments': EntitySpec(
+        table='payments', alias='p',
+        fields={**_own('p', PAYMENT_COLUMNS), 'client_name': 'cl.full_name', 'case_title': 'c.title',
+                'service_name': 's.name'},
+        columns=PAYMENT_COLUMNS,
+        joins=('LEFT JOIN clients cl ON p.client_id = cl.id LEFT JOIN cases c ON p.case_id = c.id '
+               'LEFT JOIN services s ON p.service_id = s.id'),
+        order='p.payment_date DESC, p.id DESC',
+        relations={
+            'client': Relation('clients', 'one', '{r}.id = {p}.client_id'),
+            'case': Relation('cases', 'one', '{r}.id = {p}.case_id'),
+            'service': Relation('services', 'one', '{r}.id = {p}.service_id'),
+        },
+        timestamp_fields=('created_at', 'updated_at'),
+        filters={
+            'client_id': Filter('p.client_id', 'eq'),
+            'case_id': Filter('p.case_id', 'eq'),
+            'payment_type': Filter('p.payment_type', 'eq'),
+            'status': Filter('p.status', 'eq'),
+            'from': Filter('p.payment_date', 'from'),
+            'to': Filter('p.payment_date', 'to'),
+        },
+    ),
+}
+
+# Справочники для выпадающих списков: только id и подпись
+LOOKUPS: Dict[str, str] = {
+    'clients': "SELECT id, full_name AS name FROM clients WHERE deleted_at IS NULL ORDER BY full_name COLLATE NOCASE",
+    'cases': "SELECT id, title AS name, client_id FROM cases WHERE deleted_at IS NULL ORDER BY title COLLATE NOCASE",
+    'services': "SELECT id, name, client_id, price FROM services ORDER BY name COLLATE NOCASE",
+}
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def _json_object(spec: EntitySpec, alias: str) -> str:
+    # Метки времени в JSON те же, что у row_codec.iso_timestamp
+    pairs = ', '.join(
+        f"'{column}', strftime('{ISO_FORMAT}', {alias}.{column}, 'unixepoch')" if column in spec.timestamp_fields
+        else f"'{column}', {alias}.{column}"
+        for column in spec.columns)
+    return f'json_object({pairs})'
+
+
+def _relation_sql(spec: EntitySpec, name: str) -> str:
+    """Подзапрос, возвращающий связанные записи одной строкой JSON"""
+    relation = spec.relations[name]
+    related = ENTITIES[relation.entity]
+    condition = relation.condition.format(r='r', p=spec.alias)
+    if related.where:
+        condition += ' AND ' + related.where.format(a='r')
+
+    if relation.kind == 'one':
+        return f'(SELECT {_json_object(related, "r")} FROM {related.table} r WHERE {condition}) AS "{name}"'
+
+    # json_group_array не гарантирует порядок - сортируем во вложенном подзапросе
+    order = f' ORDER BY {relation.order.format(r="r")}' if relation.order else ''
+    return (f'(SELECT json_group_array(json(item)) FROM ('
+            f'SELECT {_json_object(related, "r")} AS item FROM {related.table} r WHERE {condition}{order}'
+            f')) AS "{name}"')
+
+
+def _source_sql(spec: EntitySpec, archives: Sequence[str]) -> str:
+    """Таблица сущности или ее объединение с подключенными архивами"""
+    if not archives:
+        return spec.table
+    columns = ', '.join(spec.columns)
+    legs = [f'SELECT {columns} FROM main.{spec.table}']
+    legs += [f'SELECT {columns} FROM {schema}.{spec.table} x WHERE {spec.archive_where.format(a="x")}'
+             for schema in archives]
+    return f"({' UNION ALL '.join(legs)})"
+
+
+def parse_filters(entity: str, args: Mapping[str, str]) -> Tuple[List[str], List]:
+    """
+    Условия WHERE из параметров запроса (?client_id=3&from=2024-01-01)
+
+    Returns:
+        tuple: (условия, параметры)
+
+    Raises:
+        ValueError: Некорректная дата
+    """
+    conditions, params = [], []
+    for name, item in ENTITIES[entity].filters.items():
+        value = args.get(name)
+        if not value:
+            continue
+        if item.op in ('from', 'to'):
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'Параметр {name} должен быть датой в формате YYYY-MM-DD')
+            # Дата "по" включительно: все время до начала следующего дня
+            if item.op == 'to':
+                value += timedelta(days=1)
+            value = to_epoch(value) if item.epoch else value.isoformat()
+        if item.op == 'eq':
+            conditions.append(f'{item.expression} = ?')
+        elif item.op == 'like':
+            conditions.append(f'{item.expression} LIKE ?')
+            value = f'%{value}%'
+        elif item.op == 'from':
+            conditions.append(f'{item.expression} >= ?')
+        else:
+            conditions.append(f'{item.expression} < ?')
+        params.append(value)
+    return conditions, params
+
+
+def build_list_query(entity: str, fields: Optional[str] = None, include: Optional[str] = None,
+                     limit: Optional[int] = None, before_id: Optional[int] = None,
+                     filters: Optional[Mapping[str, str]] = None, archives: Sequence[str] = ()
+                     ) -> Tuple[str, List, Tuple[str, ...], Tuple[str, ...]]:
+    """
+    SQL запрос списка с выбранными полями и встроенными связями
+
+    С limit список отдается страницами по id (новые сверху): следующая
+    страница запрашивается с before_id = id последней строки.
+
+    Args:
+        entity: Имя сущности из ENTITIES
+        fields: Значение ?fields= (через запятую), None - все поля
+        include: Значение ?include= (через запятую)
+        limit: Размер страницы (None - весь список)
+        before_id: id, после которого начинается страница
+        filters: Параметры запроса для фильтров сущности (EntitySpec.filters)
+        archives: Подключенные схемы архивов, строки которых объединяются
+            с таблицей (activity_archive.attach_archives)
+
+    Returns:
+        tuple: (sql, params, timestamp_fields, json_fields) - метки времени
+        (секунды UTC) и поля, которые нужно разобрать из JSON
+
+    Raises:
+        ValueError: Неизвестное поле, связь или некорректный фильтр
+    """
+    spec = ENTITIES[entity]
+
+    selected = _split(fields) or list(spec.fields)
+    unknown = [name for name in selected if name not in spec.fields]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(spec.fields)}")
+
+    if limit is not None and 'id' not in selected:
+        # id нужен для курсора следующей страницы
+        selected.append('id')
+
+    included = _split(include)
+    unknown = [name for name in included if name not in spec.relations]
+    if unknown:
+        available = ', '.join(spec.relations) or 'нет'
+        raise ValueError(f"Неизвестные связи: {', '.join(unknown)}. Доступны: {available}")
+
+    expressions = [f'{spec.fields[name]} AS "{name}"' for name in selected]
+    expressions += [_relation_sql(spec, name) for name in included]
+
+    # JOIN нужен, только если выбраны поля из связанных таблиц
+    joins = spec.joins if any(not spec.fields[name].startswith(f'{spec.alias}.') for name in selected) else ''
+
+    sql = f"SELECT {', '.join(expressions)} FROM {_source_sql(spec, archives)} {spec.alias} {joins}"
+    conditions, params = parse_filters(entity, filters or {})
+    if spec.where:
+        conditions.insert(0, spec.where.format(a=spec.alias))
+    if limit is not None and before_id is not None:
+        conditions.append(f'{spec.alias}.id < ?')
+        params.append(before_id)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if limit is not None:
+        sql += f' ORDER BY {spec.alias}.id DESC LIMIT ?'
+        params.append(limit)
+    elif spec.order:
+        sql += f' ORDER BY {spec.order}'
+
+    timestamp_fields = tuple(name for name in selected if name in spec.timestamp_fields)
+    return sql, params, timestamp_fields, tuple(included)
+
+
+def parse_lookups(entities: Optional[str]) -> List[str]:
+    """
+    Справочники из ?entities= (по умолчанию все)
+
+    Raises:
+        ValueError: Неизвестный справочник
+    """
+    names = _split(entities) or list(LOOKUPS)
+    unknown = [name for name in names if name not in LOOKUPS]
+    if unknown:
+        raise ValueError(f"Неизвестные справочники: {', '.join(unknown)}. Доступны: {', '.join(LOOKUPS)}")
+    return names
+
+
+# ==================== ЛЕНТА КЛИЕНТА ====================
+
+# Источники ленты: дела по дате создания и активности по дате события.
+# Поля приведены к общему виду, чтобы объединить их UNION ALL. Последний
+# элемент - сколько раз в запросе передается client_id.
+# Активности - две ветки без пересечений: с client_id клиента (индекс
+# (client_id, datetime)) и по делам клиента без него - созданные только с делом
+# (индекс (case_id, datetime)). Активности удаленных дел не показываются.
+TIMELINE_SOURCES = (
+    ('activity', """
+        SELECT 'activity' AS kind, id, datetime AS ts, activity_type AS title, description,
+               NULL AS status, case_id
+        FROM activities
+        WHERE client_id = ?
+          AND (case_id IS NULL OR EXISTS (SELECT 1 FROM cases c
+                                          WHERE c.id = activities.case_id AND c.deleted_at IS NULL)) {keyset}
+        ORDER BY datetime DESC, id DESC
+        LIMIT ?
+    """, 'datetime', 1),
+    ('activity', """
+        SELECT 'activity' AS kind, id, datetime AS ts, activity_type AS title, description,
+               NULL AS status, case_id
+        FROM activities
+        WHERE case_id IN (SELECT c.id FROM cases c WHERE c.client_id = ? AND c.deleted_at IS NULL)
+          AND (client_id IS NULL OR client_id <> ?) {keyset}
+        ORDER BY datetime DESC, id DESC
+        LIMIT ?
+    """, 'datetime', 2),
+    ('case', """
+        SELECT 'case' AS kind, id, created_at AS ts, title, description, status, id AS case_id
+        FROM cases
+        WHERE client_id = ? AND deleted_at IS NULL {keyset}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, 'created_at', 1),
+)
+
+TIMELINE_DEFAULT_LIMIT = 50
+TIMELINE_MAX_LIMIT = 200
+
+
+def encode_cursor(ts: int, kind: str, event_id: int) -> str:
+    """Непрозрачный курсор ленты по последнему событию страницы"""
+    raw = json.dumps([ts, kind, event_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str, int]:
+    """
+    Разбор курсора ленты
+
+    Raises:
+        ValueError: Курсор поврежден
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ts, kind, event_id = json.loads(raw)
+        # ts - секунды UTC; курсоры со строковыми датами (до перехода на INTEGER) не принимаются
+        if not isinstance(ts, int):
+            raise TypeError(ts)
+        return ts, str(kind), int(event_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Некорректный курсор')
+
+
+def build_timeline_query(client_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[str, List]:
+    """
+    Запрос страницы ленты клиента с keyset пагинацией
+
+    События упорядочены по (ts DESC, kind ASC, id DESC). Каждый источник
+    отдает не больше limit строк после курсора, используя индекс своей
+    ветки, после чего ветки сливаются. Условие курсора для ветки
+    вычисляется заранее: kind в ветке постоянен, поэтому сравнение
+    кортежей сводится к сравнению ts (и id для той же ветки).
+
+    Returns:
+        tuple: (sql, params)
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    branches, params = [], []
+    for kind, sql, column, client_params in TIMELINE_SOURCES:
+        keyset, keyset_params = '', []
+        if after is not None:
+            after_ts, after_kind, after_id = after
+            if kind > after_kind:
+                keyset, keyset_params = f'AND {column} <= ?', [after_ts]
+            elif kind == after_kind:
+                keyset = f'AND ({column} < ? OR ({column} = ? AND id < ?))'
+                keyset_params = [after_ts, after_ts, after_id]
+            else:
+                keyset, keyset_params = f'AND {column} < ?', [after_ts]
+        branches.append(f'SELECT * FROM ({sql.format(keyset=keyset)})')
+        params += [*[client_id] * client_params, *keyset_params, limit]
+
+    query = ' UNION ALL '.join(branches) + ' ORDER BY ts DESC, kind ASC, id DESC LIMIT ?'
+    params.append(limit)
+    return query, params
@@ -0,0 +1,61 @@
+"""
+Нормализация контактных данных Legal CRM
+Приводит телефоны, email и ФИО к виду, в котором их можно сравнивать при поиске дублей
+"""
+
+import re
+from typing import Optional
+
+_NON_DIGITS = re.compile(r'\D')
+_LATIN_WORDS = re.compile(r'[a-z0-9]+')
+
+# Транслитерация кириллицы (ГОСТ 7.79-2000, схема Б, упрощенная как в загранпаспортах)
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya',
+})
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Телефон в виде цифр с кодом страны: '8 (916) 123-45-67' -> '79161234567'
+
+    Российские номера из 10 цифр и номера с 8 в начале приводятся к коду 7.
+    Пустое значение -> None.
+    """
+    digits = _NON_DIGITS.sub('', phone or '')
+    if not digits:
+        return None
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    """Email без пробелов в нижнем регистре; пустое значение -> None"""
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """ФИО для сравнения: без учета регистра (casefold), ё -> е, одиночные пробелы"""
+    return ' '.join((name or '').casefold().replace('ё', 'е').split())
+
+
+def transliterate(text: Optional[str]) -> str:
+    """Текст латиницей в нижнем регистре: 'Щукин Юрий' -> 'shchukin yuriy'"""
+    return (text or '').lower().translate(_TRANSLIT)
+
+
+def name_key(name: Optional[str]) -> str:
+    """
+    Ключ ФИО для поиска дублей: латиница, без знаков препинания, слова по алфавиту
+
+    'Петров-Водкин Кузьма' и 'Kuzma Petrov Vodkin' -> 'kuzma petrov vodkin'
+    """
+    return ' '.join(sorted(_LATIN_WORDS.findall(transliterate(normalize_name(name)))))
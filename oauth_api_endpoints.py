@@ -6,25 +6,103 @@ OAuth API endpoints для Яндекс.Диска с поддержкой 2FA
 import json
 import os
 import uuid
+import tempfile
 from datetime import datetime
-from flask import Blueprint, request, jsonify, session, redirect, url_for, render_template_string
-from werkzeug.security import check_password_hash
-from sqlalchemy import text
-from yandex_oauth_client import YandexOAuthClient
-from sync.sync_manager import SyncManager
+from flask import Blueprint, request, jsonify, session, render_template_string
+from flask_login import login_required, current_user
+from sync.yandex_oauth_client import YandexOAuthClient, YandexDiskOAuthWebDAV
+from sync.token_manager import OAuthTokenManager
+from event_feed import publish as publish_event
 
 
 # Создаем новый Blueprint для OAuth endpoints
 oauth_bp = Blueprint('oauth', __name__)
 
+# База данных приложения (WebDatabase), задается в init_oauth_api
+_db = None
+
 # Конфигурация OAuth
 OAUTH_CONFIG = {
     'client_id': os.getenv('YANDEX_CLIENT_ID', ''),  # Нужно будет настроить
+    'client_secret': os.getenv('YANDEX_CLIENT_SECRET', ''),
     'redirect_uri': os.getenv('YANDEX_REDIRECT_URI', 'http://localhost:5000/auth/callback'),
     'scopes': ['disk:read', 'disk:write']
 }
 
 
+def _create_oauth_client():
+    """OAuth клиент приложения или None, если OAuth не настроен"""
+    if not OAUTH_CONFIG['client_id']:
+        return None
+    return YandexOAuthClient(
+        client_id=OAUTH_CONFIG['client_id'],
+        client_secret=OAUTH_CONFIG['client_secret'] or None
+    )
+
+
+def _load_oauth_tokens(username):
+    """Загружает конфигурацию OAuth токенов пользователя из sync_config"""
+    with _db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT config_data 
+            FROM sync_config 
+            WHERE username = ? AND sync_type = 'yandex_oauth'
+        """, (username,))
+        result = cursor.fetchone()
+    
+    if not result or not result[0]:
+        return None
+    return json.loads(result[0])
+
+
+def _save_oauth_tokens(username, config):
+    """Атомарно сохраняет конфигурацию OAuth токенов одной транзакцией"""
+    with _db.get_connection() as conn:
+        conn.execute("""
+            INSERT INTO sync_config (username, sync_type, config_data, is_enabled, updated_at) 
+            VALUES (?, 'yandex_oauth', ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (username, sync_type) DO UPDATE SET 
+                config_data = excluded.config_data,
+                updated_at = excluded.updated_at
+        """, (username, json.dumps(config)))
+
+
+# Кэш OAuth токенов с фоновым обновлением (один на воркер)
+token_manager = OAuthTokenManager(_create_oauth_client, _load_oauth_tokens, _save_oauth_tokens)
+
+
+def init_oauth_api(app, database):
+    """
+    Подключает OAuth endpoints к приложению
+    
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    app.register_blueprint(oauth_bp)
+
+
+@oauth_bp.record_once
+def _start_token_manager(state):
+    """Запускает фоновое обновление токенов при регистрации blueprint"""
+    token_manager.start()
+
+
+def _update_sync_config(username, **fields):
+    """Обновляет поля OAuth конфигурации синхронизации пользователя"""
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    with _db.get_connection() as conn:
+        cursor = conn.execute(f"""
+            UPDATE sync_config 
+            SET {assignments}, updated_at = CURRENT_TIMESTAMP
+            WHERE username = ? AND sync_type = 'yandex_oauth'
+        """, (*fields.values(), username))
+        return cursor.rowcount
+
+
 @oauth_bp.route('/api/oauth/authorize', methods=['POST'])
 @login_required
 def oauth_authorize():
@@ -42,17 +120,11 @@ def oauth_authorize():
             return jsonify({'error': 'OAuth not configured. Please set YANDEX_CLIENT_ID environment variable.'}), 500
         
         # Создаем OAuth клиент
-        oauth_client = YandexOAuthClient(
-            client_id=OAUTH_CONFIG['client_id']
-        )
+        oauth_client = _create_oauth_client()
         
         # Генерируем уникальное состояние для защиты от CSRF
         state = str(uuid.uuid4())
         
-        # Сохраняем OAuth данные в сессии
-        session['oauth_state'] = state
-        session['oauth_username'] = username
-        
         # Получаем URL авторизации
         auth_url = oauth_client.get_authorization_url(
             redirect_uri=OAUTH_CONFIG['redirect_uri'],
@@ -60,6 +132,11 @@ def oauth_authorize():
             state=state
         )
         
+        # Сохраняем OAuth данные в сессии (PKCE verifier нужен для обмена кода)
+        session['oauth_state'] = state
+        session['oauth_username'] = username
+        session['oauth_code_verifier'] = oauth_client.code_verifier
+        
         return jsonify({
             'success': True,
             'auth_url': auth_url,
@@ -84,16 +161,16 @@ def oauth_exchange_token():
             return jsonify({'error': 'Confirmation code is required'}), 400
         
         # Проверяем состояние
-        if session.get('oauth_state') != session.get('oauth_current_state'):
+        state = data.get('state') or session.get('oauth_state_from_callback')
+        if not session.get('oauth_state') or session.get('oauth_state') != state:
             return jsonify({'error': 'Invalid state parameter'}), 400
         
         if not OAUTH_CONFIG['client_id']:
             return jsonify({'error': 'OAuth not configured'}), 500
         
         # Создаем OAuth клиент
-        oauth_client = YandexOAuthClient(
-            client_id=OAUTH_CONFIG['client_id']
-        )
+        oauth_client = _create_oauth_client()
+        oauth_client.code_verifier = session.get('oauth_code_verifier')
         
         # Обмениваем код на токен
         token_response = oauth_client.exchange_code_for_token(
@@ -101,48 +178,22 @@ def oauth_exchange_token():
             redirect_uri=OAUTH_CONFIG['redirect_uri']
         )
         
-        # Получаем данные пользователя
-        username = session.get('oauth_username')
-        
-        if not username:
-            return jsonify({'error': 'Username not found in session'}), 400
-        
-        # Сохраняем токены в базу данных
-        db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'legal_crm_web', 'database', 'legal_crm.db')
+        # Токены привязываем к пользователю CRM, логин Яндекса сохраняем для справки
+        username = current_user.username
         
-        with open(db_path, 'r') as f:
-            pass  # Это просто для проверки существования файла
-        
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Сохраняем или обновляем конфигурацию синхронизации
-        cursor.execute("""
-            INSERT OR REPLACE INTO sync_config 
-            (username, sync_type, config_data, last_sync, is_enabled) 
-            VALUES (?, 'yandex_oauth', ?, ?, 1)
-        """, (
+        # Сохраняем токены в кэш и базу данных
+        token_manager.invalidate(username)
+        token_manager.store(
             username,
-            json.dumps({
-                'access_token': token_response['access_token'],
-                'refresh_token': token_response.get('refresh_token', ''),
-                'token_type': token_response.get('token_type', 'bearer'),
-                'expires_in': token_response.get('expires_in', 0),
-                'scope': token_response.get('scope', ''),
-                'obtained_at': datetime.now().isoformat(),
-                'configured_path': '/legal_crm'  # Папка, созданная пользователем
-            }),
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+            token_response,
+            yandex_login=session.get('oauth_username', ''),
+            configured_path='/legal_crm'  # Папка, созданная пользователем
+        )
         
         # Очищаем сессию OAuth
-        session.pop('oauth_state', None)
-        session.pop('oauth_username', None)
+        for key in ('oauth_state', 'oauth_username', 'oauth_code_verifier',
+                    'oauth_code', 'oauth_state_from_callback'):
+            session.pop(key, None)
         
         return jsonify({
             'success': True,
@@ -165,60 +216,29 @@ def oauth_status():
     Проверяет статус OAuth авторизации
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        # Проверяем конфигурацию синхронизации в базе данных
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT config_data, last_sync, is_enabled 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            config_data = json.loads(result[0])
-            last_sync = result[1]
-            is_enabled = result[2]
+        username = current_user.username
+        
+        # Состояние токена берем из кэша, без разбора config_data
+        token_info = token_manager.token_info(username)
+        
+        if token_info:
+            with _db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT last_sync, is_enabled 
+                    FROM sync_config 
+                    WHERE username = ? AND sync_type = 'yandex_oauth'
+                """, (username,))
+                result = cursor.fetchone()
             
-            # Проверяем, не истек ли токен
-            access_token = config_data.get('access_token')
-            expires_in = config_data.get('expires_in', 0)
-            obtained_at = config_data.get('obtained_at', '')
-            
-            token_valid = False
-            if access_token and expires_in and obtained_at:
-                import time
-                from datetime import datetime
-                
-                try:
-                    obtained_time = datetime.fromisoformat(obtained_at.replace('Z', '+00:00'))
-                    current_time = datetime.now()
-                    elapsed_seconds = (current_time - obtained_time.replace(tzinfo=None)).total_seconds()
-                    
-                    # Токен валиден если не прошло больше 80% времени жизни
-                    token_valid = elapsed_seconds < (expires_in * 0.8)
-                except:
-                    token_valid = False
+            last_sync = result[0] if result else None
+            is_enabled = result[1] if result else False
             
             return jsonify({
                 'success': True,
                 'oauth_configured': True,
-                'oauth_authorized': bool(access_token and token_valid),
-                'token_info': {
-                    'has_access_token': bool(access_token),
-                    'token_valid': token_valid,
-                    'expires_in': expires_in
-                },
+                'oauth_authorized': token_info['token_valid'],
+                'token_info': token_info,
                 'sync_configured': bool(is_enabled),
                 'last_sync': last_sync
             })
@@ -242,38 +262,18 @@ def oauth_test_connection():
     Тестирует подключение к Яндекс.Диску через OAuth
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        # Получаем OAuth токен из базы данных
-        from database import get_db_connection
+        username = current_user.username
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT config_data 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
+        # Получаем OAuth токен из кэша
+        if not token_manager.get_config(username):
             return jsonify({'error': 'OAuth configuration not found'}), 400
         
-        config_data = json.loads(result[0])
-        access_token = config_data.get('access_token')
+        access_token = token_manager.get_access_token(username)
         
         if not access_token:
             return jsonify({'error': 'Access token not found'}), 400
         
         # Создаем WebDAV клиент с OAuth
-        from yandex_oauth_client import YandexDiskOAuthWebDAV
-        
         webdav_client = YandexDiskOAuthWebDAV(access_token)
         
         # Тестируем подключение
@@ -302,78 +302,28 @@ def oauth_refresh_token():
     Обновляет access token используя refresh token
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
+        username = current_user.username
         
-        # Получаем refresh token из базы данных
-        from database import get_db_connection
+        config_data = token_manager.get_config(username)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT config_data 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
+        if not config_data:
             return jsonify({'error': 'OAuth configuration not found'}), 400
         
-        config_data = json.loads(result[0])
-        refresh_token = config_data.get('refresh_token')
-        
-        if not refresh_token:
+        if not config_data.get('refresh_token'):
             return jsonify({'error': 'Refresh token not found'}), 400
         
         if not OAUTH_CONFIG['client_id']:
             return jsonify({'error': 'OAuth not configured'}), 500
         
-        # Создаем OAuth клиент
-        oauth_client = YandexOAuthClient(
-            client_id=OAUTH_CONFIG['client_id']
-        )
-        
-        # Обновляем токен
-        token_response = oauth_client.refresh_access_token(refresh_token)
-        
-        # Обновляем данные в базе
-        updated_config = {
-            'access_token': token_response['access_token'],
-            'refresh_token': token_response.get('refresh_token', refresh_token),
-            'token_type': token_response.get('token_type', 'bearer'),
-            'expires_in': token_response.get('expires_in', 0),
-            'scope': token_response.get('scope', ''),
-            'obtained_at': datetime.now().isoformat(),
-            'configured_path': config_data.get('configured_path', '/legal_crm')
-        }
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE sync_config 
-            SET config_data = ?
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (
-            json.dumps(updated_config),
-            username
-        ))
-        
-        conn.commit()
-        conn.close()
+        # Обновляем токен (одновременные запросы схлопываются в один)
+        updated_config = token_manager.refresh(username, force=True)
         
         return jsonify({
             'success': True,
             'message': 'Токен успешно обновлен!',
             'token_info': {
-                'expires_in': token_response.get('expires_in'),
-                'scope': token_response.get('scope')
+                'expires_in': updated_config.get('expires_in'),
+                'scope': updated_config.get('scope')
             }
         })
         
@@ -455,32 +405,24 @@ def oauth_callback():
         """, error=str(e))
 
 
-# Обновленные sync endpoints с поддержкой OAuth
-@oauth_bp.route('/api/sync/status', methods=['GET'])
+# Sync endpoints с OAuth авторизацией (используются static/js/oauth_frontend.js)
+@oauth_bp.route('/api/oauth/sync/status', methods=['GET'])
 @login_required
 def oauth_sync_status():
     """
     Возвращает статус синхронизации с поддержкой OAuth
     """
     try:
-        username = session.get('username')
+        username = current_user.username
         
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT sync_type, config_data, last_sync, is_enabled 
-            FROM sync_config 
-            WHERE username = ?
-        """, (username,))
-        
-        results = cursor.fetchall()
-        conn.close()
+        with _db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT sync_type, last_sync, is_enabled 
+                FROM sync_config 
+                WHERE username = ?
+            """, (username,))
+            results = cursor.fetchall()
         
         sync_status = {
             'configured': len(results) > 0,
@@ -490,20 +432,25 @@ def oauth_sync_status():
             'sync_types': []
         }
         
-        for sync_type, config_data, last_sync, is_enabled in results:
+        for sync_type, last_sync, is_enabled in results:
             sync_info = {
                 'type': sync_type,
                 'enabled': bool(is_enabled),
-                'last_sync': last_sync,
-                'config_data': json.loads(config_data) if config_data else {}
+                'last_sync': last_sync
             }
             
+            # Токены наружу не отдаем, только путь синхронизации
+            if sync_type == 'yandex_oauth':
+                config_data = token_manager.get_config(username) or {}
+                sync_info['configured_path'] = config_data.get('configured_path', '/legal_crm')
+            
             sync_status['sync_types'].append(sync_info)
             
             # Проверяем статус OAuth
             if sync_type == 'yandex_oauth' and is_enabled:
+                token_info = token_manager.token_info(username) or {}
                 sync_status['sync_enabled'] = True
-                sync_status['oauth_authorized'] = True
+                sync_status['oauth_authorized'] = bool(token_info.get('token_valid'))
                 sync_status['last_sync'] = last_sync
         
         return jsonify({
@@ -515,61 +462,28 @@ def oauth_sync_status():
         return jsonify({'error': f'Failed to get sync status: {str(e)}'}), 500
 
 
-@oauth_bp.route('/api/sync/test', methods=['POST'])
-@login_required
-def oauth_sync_test():
-    """
-    Тестирует синхронизацию с поддержкой OAuth
-    """
-    return oauth_test_connection()
-
-
-@oauth_bp.route('/api/sync/upload', methods=['POST'])
+@oauth_bp.route('/api/oauth/upload', methods=['POST'])
 @login_required
 def oauth_sync_upload():
     """
     Загружает базу данных на Яндекс.Диск через OAuth
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        # Получаем путь к базе данных
-        db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'legal_crm_web', 'database', 'legal_crm.db')
-        
-        if not os.path.exists(db_path):
-            return jsonify({'error': 'Database file not found'}), 404
-        
-        # Получаем OAuth токен
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        username = current_user.username
         
-        cursor.execute("""
-            SELECT config_data 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        # Получаем OAuth токен из кэша
+        config_data = token_manager.get_config(username)
         
-        if not result:
+        if not config_data:
             return jsonify({'error': 'OAuth configuration not found'}), 400
         
-        config_data = json.loads(result[0])
-        access_token = config_data.get('access_token')
+        access_token = token_manager.get_access_token(username)
         configured_path = config_data.get('configured_path', '/legal_crm')
         
         if not access_token:
             return jsonify({'error': 'Access token not found'}), 400
         
         # Создаем WebDAV клиент с OAuth
-        from yandex_oauth_client import YandexDiskOAuthWebDAV
-        
         webdav_client = YandexDiskOAuthWebDAV(access_token)
         
         # Тестируем подключение
@@ -580,29 +494,25 @@ def oauth_sync_upload():
             }), 400
         
         # Создаем удаленный путь с timestamp
-        from datetime import datetime
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         remote_path = f"{configured_path}/legal_crm_backup_{timestamp}.db"
         
-        # Загружаем файл
-        upload_success = webdav_client.upload_file(db_path, remote_path)
+        # Архивные файлы действий - рядом с копиями базы, в {configured_path}/archive/:
+        # до снимка базы, чтобы в нем уже были отмечены выгруженные ревизии
+        from sync.yandex_webdav import DatabaseSyncManager
+        webdav_client.create_directory(f"{configured_path}/archive")
+        DatabaseSyncManager(_db.db_name, webdav_client, f"{configured_path}/").upload_archives()
+        
+        # Делаем согласованную копию базы (онлайн-бэкап SQLite) и загружаем ее
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_path = os.path.join(temp_dir, 'legal_crm.db')
+            _db.backup_to(snapshot_path)
+            upload_success = webdav_client.upload_file(snapshot_path, remote_path)
         
         if upload_success:
             # Обновляем время последней синхронизации
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE sync_config 
-                SET last_sync = ?
-                WHERE username = ? AND sync_type = 'yandex_oauth'
-            """, (
-                datetime.now().isoformat(),
-                username
-            ))
-            
-            conn.commit()
-            conn.close()
+            _update_sync_config(username, last_sync=datetime.now().isoformat())
+            publish_event('sync', 'upload')
             
             return jsonify({
                 'success': True,
@@ -618,7 +528,7 @@ def oauth_sync_upload():
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
 
-@oauth_bp.route('/api/sync/download', methods=['POST'])
+@oauth_bp.route('/api/oauth/download', methods=['POST'])
 @login_required
 def oauth_sync_download():
     """
@@ -631,108 +541,71 @@ def oauth_sync_download():
         if not remote_path:
             return jsonify({'error': 'Remote path is required'}), 400
         
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        # Получаем OAuth токен
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT config_data 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
+        username = current_user.username
         
-        if not result:
+        # Получаем OAuth токен из кэша
+        if not token_manager.get_config(username):
             return jsonify({'error': 'OAuth configuration not found'}), 400
         
-        config_data = json.loads(result[0])
-        access_token = config_data.get('access_token')
+        access_token = token_manager.get_access_token(username)
         
         if not access_token:
             return jsonify({'error': 'Access token not found'}), 400
         
         # Создаем WebDAV клиент с OAuth
-        from yandex_oauth_client import YandexDiskOAuthWebDAV
-        
         webdav_client = YandexDiskOAuthWebDAV(access_token)
         
-        # Создаем временный путь для скачивания
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.db') as temp_file:
-            temp_path = temp_file.name
-        
-        # Скачиваем файл
-        download_success = webdav_client.download_file(remote_path, temp_path)
-        
-        if download_success:
-            # Заменяем основную базу данных
-            db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'legal_crm_web', 'database', 'legal_crm.db')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = os.path.join(temp_dir, 'legal_crm.db')
             
-            import shutil
-            shutil.move(temp_path, db_path)
+            # Скачиваем файл
+            download_success = webdav_client.download_file(remote_path, temp_path)
             
-            return jsonify({
-                'success': True,
-                'message': 'База данных успешно скачана с Яндекс.Диска!'
-            })
-        else:
-            # Удаляем временный файл в случае ошибки
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            if not download_success:
+                return jsonify({
+                    'error': 'Не удалось скачать файл с Яндекс.Диска'
+                }), 500
             
-            return jsonify({
-                'error': 'Не удалось скачать файл с Яндекс.Диска'
-            }), 500
+            # Заменяем содержимое базы через SQLite backup API:
+            # открытые соединения пула продолжают работать с актуальными данными
+            _db.restore_from(temp_path)
+        
+        # Архивы лет, которых нет локально, лежат в archive/ рядом с копией базы;
+        # затем воркер архива сверяет файлы с восстановленным манифестом
+        from sync.yandex_webdav import DatabaseSyncManager
+        from activity_archive import archiver
+        remote_dir = os.path.dirname(remote_path).rstrip('/') + '/'
+        DatabaseSyncManager(_db.db_name, webdav_client, remote_dir).download_archives()
+        archiver.wake()
+        
+        return jsonify({
+            'success': True,
+            'message': 'База данных успешно скачана с Яндекс.Диска!'
+        })
             
     except Exception as e:
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 
 # Обновленные endpoints для автоматической синхронизации
-@oauth_bp.route('/api/sync/auto/enable', methods=['POST'])
+@oauth_bp.route('/api/oauth/auto/enable', methods=['POST'])
 @login_required
 def oauth_sync_auto_enable():
     """
     Включает автоматическую синхронизацию
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
-        
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        username = current_user.username
         
-        cursor.execute("""
-            UPDATE sync_config 
-            SET is_enabled = 1
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        if cursor.rowcount == 0:
-            # Создаем запись если её нет
-            cursor.execute("""
+        with _db.get_connection() as conn:
+            conn.execute("""
                 INSERT INTO sync_config (username, sync_type, is_enabled) 
                 VALUES (?, 'yandex_oauth', 1)
+                ON CONFLICT (username, sync_type) DO UPDATE SET 
+                    is_enabled = 1,
+                    updated_at = CURRENT_TIMESTAMP
             """, (username,))
         
-        conn.commit()
-        conn.close()
-        
         return jsonify({
             'success': True,
             'message': 'Автоматическая синхронизация включена!'
@@ -742,31 +615,16 @@ def oauth_sync_auto_enable():
         return jsonify({'error': f'Failed to enable auto sync: {str(e)}'}), 500
 
 
-@oauth_bp.route('/api/sync/auto/disable', methods=['POST'])
+@oauth_bp.route('/api/oauth/auto/disable', methods=['POST'])
 @login_required
 def oauth_sync_auto_disable():
     """
     Выключает автоматическую синхронизацию
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
+        username = current_user.username
         
-        from database import get_db_connection
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE sync_config 
-            SET is_enabled = 0
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        conn.commit()
-        conn.close()
+        _update_sync_config(username, is_enabled=0)
         
         return jsonify({
             'success': True,
@@ -777,62 +635,51 @@ def oauth_sync_auto_disable():
         return jsonify({'error': f'Failed to disable auto sync: {str(e)}'}), 500
 
 
-@oauth_bp.route('/api/sync/backups', methods=['GET'])
+@oauth_bp.route('/api/oauth/backups', methods=['GET'])
 @login_required
 def oauth_sync_backups():
     """
     Получает список резервных копий на Яндекс.Диске
     """
     try:
-        username = session.get('username')
-        
-        if not username:
-            return jsonify({'error': 'User not found'}), 400
+        username = current_user.username
         
-        # Получаем OAuth токен
-        from database import get_db_connection
+        # Получаем OAuth токен из кэша
+        config_data = token_manager.get_config(username)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT config_data 
-            FROM sync_config 
-            WHERE username = ? AND sync_type = 'yandex_oauth'
-        """, (username,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if not result:
+        if not config_data:
             return jsonify({'error': 'OAuth configuration not found'}), 400
         
-        config_data = json.loads(result[0])
-        access_token = config_data.get('access_token')
+        access_token = token_manager.get_access_token(username)
         configured_path = config_data.get('configured_path', '/legal_crm')
         
         if not access_token:
             return jsonify({'error': 'Access token not found'}), 400
         
         # Создаем WebDAV клиент с OAuth
-        from yandex_oauth_client import YandexDiskOAuthWebDAV
-        
         webdav_client = YandexDiskOAuthWebDAV(access_token)
         
-        # Получаем список файлов в папке
-        files = webdav_client.list_directory(configured_path)
+        # Один PROPFIND с размерами и датами, разбираемый потоково
+        depth = 'infinity' if request.args.get('recursive') == '1' else '1'
         
         # Фильтруем только файлы резервных копий
         backup_files = []
-        for file_path in files:
-            if 'legal_crm_backup_' in file_path and file_path.endswith('.db'):
+        for entry in webdav_client.iter_directory(configured_path, depth=depth):
+            if entry.is_directory:
+                continue
+            if 'legal_crm_backup_' in entry.name and entry.name.endswith('.db'):
                 backup_files.append({
-                    'name': file_path.split('/')[-1],
-                    'path': file_path,
-                    'size': 'Неизвестно',  # Можно добавить получение размера файла
+                    'name': entry.name,
+                    'path': entry.href,
+                    'size': entry.size,
+                    'modified': entry.modified,
+                    'etag': entry.etag,
                     'type': 'database_backup'
                 })
         
+        # Новые резервные копии первыми
+        backup_files.sort(key=lambda backup: backup['modified'] or '', reverse=True)
+        
         return jsonify({
             'success': True,
             'backups': backup_files
@@ -842,13 +689,13 @@ def oauth_sync_backups():
         return jsonify({'error': f'Failed to get backups: {str(e)}'}), 500
 
 
-@oauth_bp.route('/api/sync/restore', methods=['POST'])
+@oauth_bp.route('/api/oauth/restore', methods=['POST'])
 @login_required
 def oauth_sync_restore():
     """
     Восстанавливает базу данных из резервной копии
     """
-    data = request.get_json()
+    data = request.get_json() or {}
     remote_path = data.get('remote_path')
     
     if not remote_path:
@@ -857,7 +704,7 @@ def oauth_sync_restore():
     return oauth_sync_download()
 
 
-@oauth_bp.route('/api/sync/cleanup', methods=['POST'])
+@oauth_bp.route('/api/oauth/cleanup', methods=['POST'])
 @login_required
 def oauth_sync_cleanup():
     """
@@ -0,0 +1,195 @@
+"""
+Фоновое удаление Legal CRM
+Клиент или дело с большой историей помечается удаленным (deleted_at), а
+связанные записи удаляются фоновым потоком небольшими пачками, чтобы запрос
+DELETE не держал блокировку записи SQLite секундами
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional
+
+from row_codec import EPOCH_NOW_SQL
+
+logger = logging.getLogger(__name__)
+
+# Связанных записей не больше этого - удаляем сразу каскадом в запросе
+PURGE_INLINE_LIMIT = int(os.environ.get('PURGE_INLINE_LIMIT', 1000))
+
+# Строк в одной транзакции фонового удаления
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))
+
+# Пауза между пачками: запросы успевают взять блокировку записи
+PURGE_PAUSE_SECONDS = float(os.environ.get('PURGE_PAUSE_SECONDS', 0.05))
+
+# Как часто поток проверяет пометки других воркеров, секунды
+PURGE_POLL_SECONDS = float(os.environ.get('PURGE_POLL_SECONDS', 30))
+
+# Дела клиента: через них к клиенту привязаны записи без client_id
+CLIENT_CASES = 'SELECT id FROM cases WHERE client_id = ?'
+
+# Зависимые записи в порядке удаления: (таблица, колонка связи, действие, владелец).
+# Владелец None - колонка ссылается на удаляемую строку, иначе - подзапрос id
+# промежуточных родителей (внуки). Листья идут первыми, поэтому последний DELETE
+# родителя почти ничего не затрагивает каскадом. 'delete' повторяет ON DELETE
+# CASCADE, 'detach' - SET NULL.
+PURGE_STEPS = {
+    'clients': (
+        ('activities', 'client_id', 'delete', None),
+        ('activities', 'case_id', 'delete', CLIENT_CASES),
+        ('payments', 'client_id', 'delete', None),
+        ('payments', 'case_id', 'detach', CLIENT_CASES),
+        ('services', 'client_id', 'delete', None),
+        ('services', 'case_id', 'detach', CLIENT_CASES),
+        ('cases', 'client_id', 'delete', None),
+    ),
+    'cases': (
+        ('activities', 'case_id', 'delete', None),
+        ('payments', 'case_id', 'detach', None),
+        ('services', 'case_id', 'detach', None),
+    ),
+}
+
+# Кэш сущностей: какие таблицы затрагивает удаление
+AFFECTED_TABLES = {
+    'clients': ('clients', 'cases', 'services', 'payments'),
+    'cases': ('cases', 'services', 'payments'),
+}
+
+
+def _step_condition(column: str, owner) -> str:
+    return f"{column} = ?" if owner is None else f"{column} IN ({owner})"
+
+
+def dependents_over(conn, table: str, row_id: int, limit: int) -> bool:
+    """Больше ли limit связанных записей, включая внуков (считает не дальше limit + 1)"""
+    total = 0
+    for child, column, _, owner in PURGE_STEPS[table]:
+        condition = _step_condition(column, owner)
+        total += conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {child} WHERE {condition} LIMIT ?)",
+                              (row_id, limit + 1 - total)).fetchone()[0]
+        if total > limit:
+            return True
+    return False
+
+
+def _purge_batch(conn, child: str, column: str, action: str, owner, row_id: int) -> int:
+    batch = f"SELECT id FROM {child} WHERE {_step_condition(column, owner)} LIMIT ?"
+    if action == 'delete':
+        cursor = conn.execute(f"DELETE FROM {child} WHERE id IN ({batch})", (row_id, PURGE_BATCH_SIZE))
+    else:
+        cursor = conn.execute(f"UPDATE {child} SET {column} = NULL WHERE id IN ({batch})", (row_id, PURGE_BATCH_SIZE))
+    return cursor.rowcount
+
+
+class PurgeWorker:
+    """
+    Фоновый поток воркера, дочищающий помеченные строки
+
+    Очередь - сами строки с deleted_at (частичные индексы
+    idx_clients_deleted/idx_cases_deleted), поэтому пометки переживают
+    перезапуск и видны всем воркерам. Каждая пачка - отдельная короткая
+    транзакция; повторное удаление той же пачки другим воркером безвредно.
+    """
+
+    def __init__(self):
+        self.database = None
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Запускает поток (заново после fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='purge-worker', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.purge_pending()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Ошибка фонового удаления: {e}")
+            self._wakeup.wait(PURGE_POLL_SECONDS)
+            self._wakeup.clear()
+
+    def purge_pending(self) -> int:
+        """Дочищает все помеченные строки; возвращает число удаленных родителей"""
+        with self.database.get_connection() as conn:
+            pending = conn.execute("""
+                SELECT 'cases', id FROM cases WHERE deleted_at IS NOT NULL
+                UNION ALL
+                SELECT 'clients', id FROM clients WHERE deleted_at IS NOT NULL
+            """).fetchall()
+        for table, row_id in pending:
+            self.purge(table, row_id)
+        return len(pending)
+
+    def purge(self, table: str, row_id: int):
+        """Удаляет связанные записи пачками, затем саму строку"""
+        started = time.monotonic()
+        removed = 0
+        for child, column, action, owner in PURGE_STEPS[table]:
+            while True:
+                with self.database.get_connection() as conn:
+                    count = _purge_batch(conn, child, column, action, owner, row_id)
+                removed += count
+                if count < PURGE_BATCH_SIZE:
+                    break
+                time.sleep(PURGE_PAUSE_SECONDS)
+        with self.database.get_connection() as conn:
+            conn.execute(f"DELETE FROM {table} WHERE id = ? AND deleted_at IS NOT NULL", (row_id,))
+        logger.info(f"🗑️ {table}/{row_id}: удалено {removed} связанных записей "
+                    f"за {time.monotonic() - started:.1f} с")
+
+
+purge_worker = PurgeWorker()
+
+
+def delete_entity(table: str, row_id: int) -> Optional[str]:
+    """
+    Удаление клиента или дела
+
+    Returns:
+        'deleted' - удалено сразу каскадом, 'scheduled' - помечено и
+        дочищается в фоне, None - записи нет
+    """
+    with purge_worker.database.get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        exists = conn.execute(f"SELECT 1 FROM {table} WHERE id = ? AND deleted_at IS NULL", (row_id,)).fetchone()
+        if exists is None:
+            return None
+        if not dependents_over(conn, table, row_id, PURGE_INLINE_LIMIT):
+            conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+            return 'deleted'
+        conn.execute(f"UPDATE {table} SET deleted_at = {EPOCH_NOW_SQL} WHERE id = ?", (row_id,))
+    purge_worker.wake()
+    return 'scheduled'
+
+
+def init_purge_worker(app, database):
+    """
+    Подключает фоновое удаление к приложению
+
+    Колонки deleted_at и частичные индексы создаются в WebDatabase.init_database.
+    Поток стартует сразу, чтобы дочистить пометки, оставшиеся с прошлого запуска.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    purge_worker.database = database
+    purge_worker.ensure_started()
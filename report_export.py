@@ -0,0 +1,286 @@
+"""
+Экспорт списков Legal CRM в CSV и XLSX
+Файл формируется потоком по страницам из базы, поэтому память воркера не
+зависит от размера выгрузки
+"""
+
+import io
+import os
+import re
+import csv
+import logging
+import zipfile
+from datetime import date
+from typing import Iterable, Iterator, List, Sequence
+from xml.sax.saxutils import escape
+
+from flask import Blueprint, Response, jsonify, request
+from flask_login import login_required
+
+from activity_archive import attach_archives
+from list_queries import ENTITIES, build_list_query
+from row_codec import codec_for
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном запросе к базе: каждая страница - отдельная короткая транзакция чтения
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 5000))
+
+# Строк, которые форматируются и отдаются клиенту за раз
+EXPORT_FETCH_SIZE = 500
+
+# Excel в русской локали ожидает ';' как разделитель
+EXPORT_CSV_DELIMITER = os.environ.get('EXPORT_CSV_DELIMITER', ';')
+
+# Заголовки колонок файла; поля без подписи выводятся как есть
+EXPORT_HEADERS = {
+    'id': 'ID',
+    'full_name': 'ФИО',
+    'phone': 'Телефон',
+    'email': 'Email',
+    'address': 'Адрес',
+    'notes': 'Заметки',
+    'title': 'Название',
+    'name': 'Название',
+    'description': 'Описание',
+    'client_id': 'ID клиента',
+    'client_name': 'Клиент',
+    'case_id': 'ID дела',
+    'case_title': 'Дело',
+    'service_id': 'ID услуги',
+    'service_name': 'Услуга',
+    'status': 'Статус',
+    'priority': 'Приоритет',
+    'due_date': 'Срок',
+    'activity_type': 'Тип',
+    'datetime': 'Дата и время',
+    'category': 'Категория',
+    'price': 'Стоимость',
+    'duration_hours': 'Часы',
+    'service_date': 'Дата оказания',
+    'amount': 'Сумма',
+    'payment_type': 'Тип платежа',
+    'payment_method': 'Способ оплаты',
+    'payment_date': 'Дата платежа',
+    'created_at': 'Создано',
+    'updated_at': 'Изменено',
+    'version': 'Версия',
+}
+
+# Служебные поля, которые не нужны в отчетах
+EXPORT_SKIP_FIELDS = ('version',)
+
+# Символы, недопустимые в XML 1.0
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+export_bp = Blueprint('export', __name__)
+
+_db = None
+
+
+def _rows(entity: str, fields: str, filters) -> Iterator[List[Sequence]]:
+    """
+    Строки выгрузки пачками по EXPORT_FETCH_SIZE
+
+    Страницы читаются по id (как ?limit=&before_id= в списках), и соединение
+    возвращается в пул после каждой страницы: долгий экспорт не держит
+    блокировку чтения SQLite и не мешает записи.
+    """
+    before_id = None
+    while True:
+        count = 0
+        with _db.get_connection() as conn:
+            archives = attach_archives(conn, entity, filters)
+            sql, params, timestamp_fields, _ = build_list_query(entity, fields, limit=EXPORT_PAGE_SIZE,
+                                                                before_id=before_id, filters=filters,
+                                                                archives=archives)
+            cursor = conn.cursor(tuples=True).execute(sql, params)
+            codec = codec_for(cursor, timestamp_fields)
+            id_index = codec.columns.index('id')
+            while True:
+                batch = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not batch:
+                    break
+                count += len(batch)
+                before_id = batch[-1][id_index]
+                yield codec.lists(batch)
+        if count < EXPORT_PAGE_SIZE:
+            return
+
+
+def _csv_value(value):
+    # Текст, начинающийся с =, +, - или @, Excel выполнил бы как формулу
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def stream_csv(header: List[str], batches: Iterable[List[Sequence]], width: int) -> Iterator[bytes]:
+    """CSV в UTF-8 с BOM (чтобы Excel распознал кодировку)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=EXPORT_CSV_DELIMITER)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for batch in batches:
+        writer.writerows([_csv_value(value) for value in row[:width]] for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Поток без перемотки для ZipFile: записанное забирается кусками"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values) -> str:
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+
+XLSX_STATIC_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/>'
+     '</Relationships>'),
+)
+
+
+def stream_xlsx(sheet_name: str, header: List[str], batches: Iterable[List[Sequence]],
+                width: int) -> Iterator[bytes]:
+    """
+    XLSX, который пишется по мере чтения строк
+
+    Лист собирается из inline-строк без общей таблицы строк, а ZipFile пишет
+    в поток без перемотки (размеры записей идут в data descriptor), так что
+    файл не нужно держать в памяти целиком.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS:
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'))
+        yield sink.take()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + _xlsx_row(header)).encode('utf-8'))
+            for batch in batches:
+                sheet.write(''.join(_xlsx_row(row[:width]) for row in batch).encode('utf-8'))
+                yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.take()
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', stream_csv),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', stream_xlsx),
+}
+
+
+@export_bp.route('/api/export/<entity>', methods=['GET'])
+@login_required
+def export_entity(entity):
+    """
+    Выгрузка списка файлом: /api/export/cases?format=xlsx&status=active&from=2024-01-01
+
+    ?format=csv|xlsx (по умолчанию csv), ?fields= - колонки, остальные
+    параметры - фильтры сущности (list_queries.ENTITIES[...].filters)
+    """
+    if entity not in ENTITIES:
+        return jsonify({'success': False, 'error': f'Неизвестная сущность: {entity}'}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'error': f'Неизвестный формат: {export_format}'})
+
+    spec = ENTITIES[entity]
+    fields = request.args.get('fields') or ','.join(
+        name for name in spec.fields if name not in EXPORT_SKIP_FIELDS)
+    filters = request.args.to_dict()
+    try:
+        # Проверяем поля, фильтры и архивный диапазон до начала потока: потом ошибку уже не вернуть
+        with _db.get_connection() as conn:
+            build_list_query(entity, fields, limit=1, filters=filters,
+                             archives=attach_archives(conn, entity, filters))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    header = [EXPORT_HEADERS.get(name, name) for name in names]
+    mimetype, writer = EXPORT_FORMATS[export_format]
+    if export_format == 'xlsx':
+        body = writer(entity, header, _rows(entity, fields, filters), len(names))
+    else:
+        body = writer(header, _rows(entity, fields, filters), len(names))
+
+    filename = f"{entity}_{date.today().isoformat()}.{export_format}"
+    logger.info(f"📤 Экспорт {entity} в {export_format}")
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # nginx не должен буферизовать файл целиком
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def init_report_export(app, database):
+    """
+    Подключает /api/export/<entity> к приложению
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    global _db
+    _db = database
+    app.register_blueprint(export_bp)
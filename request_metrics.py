@@ -0,0 +1,300 @@
+"""
+Метрики запросов Legal CRM
+Гистограммы времени ответа по маршрутам, SQL запросы на каждый HTTP запрос,
+тайминги обращений к Яндекс.Диску и endpoint /metrics в формате Prometheus
+"""
+
+import os
+import hmac
+import time
+import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+from flask import Blueprint, Response, request
+from flask_login import current_user
+
+from sql_profiler import ADMIN_USERS
+from sync.transport import add_observer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DISK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# Запросы медленнее порога пишутся в лог одной строкой key=value
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+# Заголовок Server-Timing с временем приложения и SQL (виден в DevTools браузера)
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'False').lower() == 'true'
+
+# /metrics отдается по заголовку Authorization: Bearer <токен> (для Prometheus)
+# или администратору из ADMIN_USERS с сессией; без них - 401
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Явное разрешение отдавать /metrics без авторизации (например, за закрытым прокси)
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'False').lower() == 'true'
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Вызывать под блокировкой владельца"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return list(self.counts), self.sum, self.count
+
+
+class RouteStats:
+    """Метрики одного маршрута: одна блокировка на все гистограммы запроса"""
+
+    __slots__ = ('latency', 'sql_count', 'sql_time', 'statuses', 'lock')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.sql_count = Histogram(SQL_COUNT_BUCKETS)
+        self.sql_time = Histogram(LATENCY_BUCKETS)
+        self.statuses: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+
+class MetricsRegistry:
+    """Метрики одного процесса (воркера gunicorn)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes: Dict[Tuple, RouteStats] = {}
+        self.disk_latency: Dict[Tuple, Histogram] = {}
+        self.sql_statements_total = 0
+        self.sql_seconds_total = 0.0
+
+    def observe_request(self, endpoint, method, status, seconds, sql_count, sql_seconds):
+        key = (endpoint, method)
+        stats = self.routes.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self.routes.setdefault(key, RouteStats())
+        with stats.lock:
+            stats.latency.observe(seconds)
+            stats.sql_count.observe(sql_count)
+            stats.sql_time.observe(sql_seconds)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def observe_disk(self, method, host, status, seconds):
+        key = (method, host, 'error' if status is None else str(status))
+        with self._lock:
+            histogram = self.disk_latency.get(key)
+            if histogram is None:
+                histogram = self.disk_latency[key] = Histogram(DISK_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_statement(self, seconds, executed):
+        # Общие счетчики SQL, в том числе вне HTTP запросов (фоновые потоки)
+        with self._lock:
+            if executed:
+                self.sql_statements_total += 1
+            self.sql_seconds_total += seconds
+
+    def snapshot(self):
+        """Согласованная копия всех метрик для вывода"""
+        routes = {}
+        for key, stats in list(self.routes.items()):
+            with stats.lock:
+                routes[key] = (stats.latency.snapshot(), stats.sql_count.snapshot(),
+                               stats.sql_time.snapshot(), dict(stats.statuses))
+        with self._lock:
+            disk = {key: histogram.snapshot() for key, histogram in self.disk_latency.items()}
+            totals = (self.sql_statements_total, self.sql_seconds_total)
+        return routes, disk, totals
+
+
+registry = MetricsRegistry()
+
+# Дополнительные источники метрик других модулей (кэши и т.п.)
+_collectors = []
+
+
+def add_collector(collector):
+    """
+    Регистрирует источник метрик для /metrics
+
+    Args:
+        collector: Функция без аргументов, возвращающая список семейств
+            (name, kind, help_text, [(label_names, label_values, value), ...])
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+# Счетчики SQL текущего HTTP запроса: [число запросов, секунды]
+_local = threading.local()
+
+
+def _on_statement(sql, seconds, fetch):
+    """Хук WebDatabase: учитывает каждый SQL запрос"""
+    stats = getattr(_local, 'sql', None)
+    if stats is not None:
+        if not fetch:
+            stats[0] += 1
+        stats[1] += seconds
+    registry.observe_statement(seconds, not fetch)
+
+
+def _before_request():
+    _local.started = time.perf_counter()
+    _local.sql = [0, 0.0]
+
+
+def _after_request(response):
+    started = getattr(_local, 'started', None)
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    sql_count, sql_seconds = _local.sql
+    _local.started = None
+    _local.sql = None
+
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method
+    status = response.status_code
+    registry.observe_request(endpoint, method, status, elapsed, sql_count, sql_seconds)
+
+    if SERVER_TIMING_HEADER:
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={sql_seconds * 1000:.1f};desc="{sql_count} SQL"'
+        )
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(
+            f"🐢 slow_request endpoint={endpoint} method={method} status={status} "
+            f"duration_ms={elapsed * 1000:.1f} sql_count={sql_count} sql_ms={sql_seconds * 1000:.1f}"
+        )
+    return response
+
+
+# ==================== ФОРМАТ PROMETHEUS ====================
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+def _render_histogram(lines, name, buckets, snapshot, names, values):
+    counts, total, count = snapshot
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        labels = _labels(names + ('le',), values + (_format_bound(bound),))
+        lines.append(f'{name}_bucket{labels} {cumulative}')
+    labels = _labels(names + ('le',), values + ('+Inf',))
+    lines.append(f'{name}_bucket{labels} {count}')
+    labels = _labels(names, values)
+    lines.append(f'{name}_sum{labels} {total!r}')
+    lines.append(f'{name}_count{labels} {count}')
+
+
+def _header(lines, name, kind, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def render_metrics() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    routes, disk, (sql_statements_total, sql_seconds_total) = registry.snapshot()
+    pid = str(os.getpid())
+    route_names = ('endpoint', 'method', 'pid')
+    lines = []
+
+    route_families = (
+        ('legal_crm_http_request_duration_seconds', 'Время обработки HTTP запроса', 0, LATENCY_BUCKETS),
+        ('legal_crm_http_request_sql_statements', 'Число SQL запросов на один HTTP запрос', 1, SQL_COUNT_BUCKETS),
+        ('legal_crm_http_request_sql_seconds', 'Время SQL запросов на один HTTP запрос', 2, LATENCY_BUCKETS),
+    )
+    for name, help_text, index, buckets in route_families:
+        _header(lines, name, 'histogram', help_text)
+        for key, snapshots in sorted(routes.items()):
+            _render_histogram(lines, name, buckets, snapshots[index], route_names, key + (pid,))
+
+    _header(lines, 'legal_crm_http_requests_total', 'counter', 'Число HTTP запросов')
+    for key, snapshots in sorted(routes.items()):
+        for status, value in sorted(snapshots[3].items()):
+            labels = _labels(('endpoint', 'method', 'status', 'pid'), key + (status, pid))
+            lines.append(f'legal_crm_http_requests_total{labels} {value}')
+
+    name = 'legal_crm_disk_request_duration_seconds'
+    _header(lines, name, 'histogram', 'Время запросов к Яндекс.Диску (каждая попытка)')
+    for key, snapshot in sorted(disk.items()):
+        _render_histogram(lines, name, DISK_BUCKETS, snapshot, ('method', 'host', 'status', 'pid'), key + (pid,))
+
+    labels = _labels(('pid',), (pid,))
+    _header(lines, 'legal_crm_sql_statements_total', 'counter', 'Число SQL запросов процесса')
+    lines.append(f'legal_crm_sql_statements_total{labels} {sql_statements_total}')
+    _header(lines, 'legal_crm_sql_seconds_total', 'counter', 'Время SQL запросов процесса')
+    lines.append(f'legal_crm_sql_seconds_total{labels} {sql_seconds_total!r}')
+
+    for collector in _collectors:
+        for name, kind, help_text, samples in collector():
+            _header(lines, name, kind, help_text)
+            for names, values, value in samples:
+                lines.append(f'{name}{_labels(names + ("pid",), values + (pid,))} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _metrics_allowed() -> bool:
+    """Тайминги маршрутов и SQL не отдаются анонимно, если это не разрешено явно"""
+    if METRICS_PUBLIC:
+        return True
+    authorization = request.headers.get('Authorization', '')
+    if METRICS_TOKEN and hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}'):
+        return True
+    return current_user.is_authenticated and current_user.username in ADMIN_USERS
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики процесса для Prometheus"""
+    if not _metrics_allowed():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app, database):
+    """
+    Подключает сбор метрик к приложению
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    if _on_statement not in database.statement_hooks:
+        database.statement_hooks.append(_on_statement)
+    add_observer(registry.observe_disk)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(metrics_bp)
@@ -0,0 +1,102 @@
+"""
+Сжатие ответов Legal CRM
+Ответы больше порога сжимаются gzip или brotli в зависимости от Accept-Encoding клиента
+"""
+
+import os
+import gzip
+import logging
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    # brotli необязателен: без него используется только gzip
+    brotli = None
+
+# Сжатие можно выключить, если его уже делает прокси перед приложением
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION', 'True').lower() == 'true'
+
+# Ответы меньше порога не сжимаются: выигрыш меньше накладных расходов
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+# Уровни сжатия: на списках в мегабайт gzip 5 почти вдвое быстрее 9 при размере на 10% больше
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 5))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'text/html',
+                          'text/css', 'text/plain', 'text/csv', 'text/calendar', 'image/svg+xml')
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings):
+    """
+    Кодировка по заголовку Accept-Encoding
+
+    Args:
+        accept_encodings: werkzeug.datastructures.MIMEAccept / Accept
+
+    Returns:
+        str: 'br', 'gzip' или None, если клиент не принимает сжатие
+    """
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding]
+        # При равном качестве побеждает первая кодировка из available_encodings()
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Сжимает тело ответа"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0: одинаковое тело дает одинаковый результат
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compress_response(response):
+    """after_request: сжатие ответа, если клиент это поддерживает"""
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Сильный ETag относится к конкретному представлению - после сжатия он становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """
+    Подключает сжатие ответов к приложению
+
+    Args:
+        app: Flask приложение
+    """
+    if not COMPRESSION_ENABLED:
+        return
+    app.after_request(_compress_response)
+    logger.info(f"🗜️  Сжатие ответов: {', '.join(available_encodings())} от {COMPRESSION_MIN_BYTES} байт")
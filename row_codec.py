@@ -0,0 +1,140 @@
+"""
+Кодек строк результатов Legal CRM
+Метки времени горячих таблиц хранятся целыми секундами UTC (INTEGER); здесь
+адаптеры значений и заранее собранные кодировщики строк-кортежей в JSON
+"""
+
+import json
+import time
+import calendar
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+# Колонки меток времени (секунды UTC) по таблицам
+EPOCH_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    'clients': ('created_at', 'updated_at'),
+    'cases': ('created_at', 'updated_at'),
+    'activities': ('datetime',),
+    'services': ('created_at', 'updated_at'),
+    'payments': ('created_at', 'updated_at'),
+}
+
+# Имена колонок-меток в результатах запросов (ts - лента клиента)
+TIMESTAMP_FIELDS = frozenset({'created_at', 'updated_at', 'deleted_at', 'datetime', 'ts'})
+
+# Текущее время для DEFAULT и UPDATE (unixepoch() есть только с SQLite 3.38)
+EPOCH_NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# time.strftime на каждое значение - самая дорогая часть кодирования строки;
+# дата берется из кэша по номеру дня, время - из готовых таблиц
+_DAY_SECONDS = 86400
+_day_prefixes: Dict[int, str] = {}
+_CLOCK_MINUTES = tuple(f'{hour:02d}:{minute:02d}:' for hour in range(24) for minute in range(60))
+_CLOCK_SECONDS = tuple(f'{second:02d}Z' for second in range(60))
+
+
+def iso_timestamp(value):
+    """
+    Метка времени для JSON: 1714557600 -> '2024-05-01T10:00:00Z'
+
+    None и строки (значения, еще не переведенные в секунды) отдаются как есть.
+    """
+    if value is None or value.__class__ is str:
+        return value
+    if value.__class__ is not int:
+        value = int(value)
+    prefix = _day_prefixes.get(value // _DAY_SECONDS)
+    if prefix is None:
+        day = value // _DAY_SECONDS
+        prefix = _day_prefixes[day] = time.strftime('%Y-%m-%dT', time.gmtime(day * _DAY_SECONDS))
+    return prefix + _CLOCK_MINUTES[value % _DAY_SECONDS // 60] + _CLOCK_SECONDS[value % 60]
+
+
+def to_epoch(value) -> Optional[int]:
+    """
+    Адаптер входящего значения в секунды UTC
+
+    Принимает число, datetime/date (без зоны - UTC) и строки
+    'YYYY-MM-DD', 'YYYY-MM-DD HH:MM:SS', ISO 8601 с 'Z' или смещением.
+
+    Raises:
+        ValueError: Строка не является датой
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f'Некорректная метка времени: {value!r}')
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if text.lstrip('-').isdigit():
+            return int(text)
+        if text.endswith(('Z', 'z')):
+            text = text[:-1] + '+00:00'
+        value = datetime.fromisoformat(text)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return calendar.timegm(value.timetuple())
+    if isinstance(value, date):
+        return calendar.timegm(value.timetuple())
+    raise ValueError(f'Некорректная метка времени: {value!r}')
+
+
+def _json_value(value):
+    return None if value is None else json.loads(value)
+
+
+class RowCodec:
+    """
+    Кодировщик строк одного набора колонок
+
+    Для каждого набора колонок один раз собирается функция вида
+    lambda r: {'id': r[0], 'created_at': _ts(r[6]), ...}, поэтому на строку
+    не тратится ни sqlite3.Row, ни dict(row), ни цикл по колонкам с проверками.
+    Строки должны быть кортежами (курсор с tuples=True).
+    """
+
+    __slots__ = ('columns', 'to_dict', 'to_list')
+
+    def __init__(self, columns: Sequence[str], timestamp_columns: Iterable[str] = TIMESTAMP_FIELDS,
+                 json_columns: Iterable[str] = ()):
+        self.columns = tuple(columns)
+        timestamp_columns, json_columns = frozenset(timestamp_columns), frozenset(json_columns)
+
+        values = []
+        for index, column in enumerate(self.columns):
+            if column in json_columns:
+                values.append(f'_json(r[{index}])')
+            elif column in timestamp_columns:
+                values.append(f'_ts(r[{index}])')
+            else:
+                values.append(f'r[{index}]')
+        namespace = {'_ts': iso_timestamp, '_json': _json_value}
+        pairs = ', '.join(f'{column!r}: {value}' for column, value in zip(self.columns, values))
+        self.to_dict: Callable[[tuple], Dict] = eval(f'lambda r: {{{pairs}}}', namespace)
+        if values == [f'r[{index}]' for index in range(len(values))]:
+            self.to_list: Callable[[tuple], list] = list
+        else:
+            self.to_list = eval(f"lambda r: [{', '.join(values)}]", namespace)
+
+    def dicts(self, rows) -> list:
+        return list(map(self.to_dict, rows))
+
+    def lists(self, rows) -> list:
+        return list(map(self.to_list, rows))
+
+
+@lru_cache(maxsize=256)
+def _codec(columns: Tuple[str, ...], timestamp_columns: frozenset, json_columns: frozenset) -> RowCodec:
+    return RowCodec(columns, timestamp_columns, json_columns)
+
+
+def codec_for(cursor, timestamp_columns: Iterable[str] = TIMESTAMP_FIELDS, json_columns: Iterable[str] = ()) -> RowCodec:
+    """Кодировщик для колонок выполненного курсора (собирается один раз на набор колонок)"""
+    columns = tuple(column[0] for column in cursor.description)
+    return _codec(columns, frozenset(timestamp_columns), frozenset(json_columns))
@@ -0,0 +1,301 @@
+"""
+Профилировщик SQL запросов Legal CRM
+Агрегирует время запросов по нормализованной форме, пишет медленные запросы
+в лог вместе с EXPLAIN QUERY PLAN и отдает топ запросов администратору
+"""
+
+import os
+import re
+import time
+import random
+import sqlite3
+import logging
+import threading
+from functools import wraps
+from typing import Dict, List, Optional
+
+from flask import Blueprint, jsonify, request
+from flask_login import current_user, login_required
+
+logger = logging.getLogger(__name__)
+
+# Профилировщик выключен по умолчанию
+SQL_PROFILER_ENABLED = os.environ.get('SQL_PROFILER', 'False').lower() == 'true'
+
+# Доля профилируемых запросов (0..1); в production достаточно 0.01 - 0.1
+SQL_PROFILER_SAMPLE_RATE = float(os.environ.get('SQL_PROFILER_SAMPLE_RATE', 1.0))
+
+# Порог медленного запроса в миллисекундах
+SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+
+# Сколько разных форм запросов хранить (остальные попадают в одну строку "other")
+SQL_PROFILER_MAX_SHAPES = int(os.environ.get('SQL_PROFILER_MAX_SHAPES', 500))
+
+# План запроса одной формы перечитывается не чаще, чем раз в указанное число секунд
+EXPLAIN_TTL_SECONDS = 600
+
+# Пользователи с доступом к административным endpoint'ам
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', 'admin').split(',') if name.strip()}
+
+OTHER_SHAPE = '<other>'
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.I)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+sql_profiler_bp = Blueprint('sql_profiler', __name__)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Форма запроса: литералы заменены на ?, списки IN свернуты, пробелы схлопнуты
+
+    "SELECT * FROM cases WHERE id IN (1, 2, 3) AND status = 'active'"
+    -> "SELECT * FROM cases WHERE id IN (...) AND status = ?"
+    """
+    shape = _COMMENT_RE.sub(' ', sql)
+    shape = _STRING_RE.sub('?', shape)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return _WHITESPACE_RE.sub(' ', shape).strip()
+
+
+def admin_required(view):
+    """Доступ только для пользователей из ADMIN_USERS"""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.username not in ADMIN_USERS:
+            return jsonify({'success': False, 'error': 'Недостаточно прав'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class QueryStats:
+    """Статистика одной формы запроса"""
+
+    __slots__ = ('shape', 'example', 'calls', 'total', 'max', 'slow', 'plan', 'plan_at')
+
+    def __init__(self, shape: str, example: str):
+        self.shape = shape
+        self.example = example
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.plan = None
+        self.plan_at = 0.0
+
+
+class SQLProfiler:
+    """
+    Профилировщик запросов WebDatabase
+
+    Подключается хуком к statement_hooks: ObservedCursor сообщает время
+    execute и fetch*, профилировщик с вероятностью sample_rate учитывает
+    событие. Время fetch добавляется к форме последнего execute, поэтому
+    общая стоимость SELECT включает чтение строк.
+    """
+
+    def __init__(self, sample_rate: float = SQL_PROFILER_SAMPLE_RATE,
+                 slow_ms: float = SQL_SLOW_QUERY_MS, max_shapes: int = SQL_PROFILER_MAX_SHAPES):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000
+        self.max_shapes = max_shapes
+        self.database = None
+        self.started_at = time.time()
+
+        self._stats: Dict[str, QueryStats] = {}
+        self._shapes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._random = random.random
+
+    @property
+    def enabled(self) -> bool:
+        return self.database is not None and self.hook in self.database.statement_hooks
+
+    def install(self, database):
+        """Подключает профилировщик к WebDatabase"""
+        self.database = database
+        if self.hook not in database.statement_hooks:
+            database.statement_hooks.append(self.hook)
+
+    def uninstall(self):
+        """Отключает профилировщик; собранная статистика сохраняется"""
+        if self.database is not None and self.hook in self.database.statement_hooks:
+            self.database.statement_hooks.remove(self.hook)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started_at = time.time()
+
+    def _shape(self, sql: str) -> str:
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = normalize_sql(sql)
+            # Запросы в приложении параметризованы, поэтому кэш почти всегда попадает
+            if len(self._shapes) < self.max_shapes * 4:
+                self._shapes[sql] = shape
+        return shape
+
+    def hook(self, sql: Optional[str], seconds: float, fetch: bool):
+        """Хук WebDatabase.statement_hooks"""
+        if sql is None or (self.sample_rate < 1.0 and self._random() >= self.sample_rate):
+            return
+
+        shape = self._shape(sql)
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                if len(self._stats) >= self.max_shapes:
+                    shape = OTHER_SHAPE
+                    stats = self._stats.get(shape)
+                if stats is None:
+                    stats = self._stats[shape] = QueryStats(shape, _WHITESPACE_RE.sub(' ', sql).strip())
+            if not fetch:
+                stats.calls += 1
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+            is_slow = seconds >= self.slow_seconds
+            if is_slow:
+                stats.slow += 1
+
+        if is_slow:
+            self._log_slow(stats, sql, seconds, fetch)
+
+    # ==================== МЕДЛЕННЫЕ ЗАПРОСЫ ====================
+
+    def _explain(self, sql: str) -> Optional[List[str]]:
+        """EXPLAIN QUERY PLAN на отдельном соединении (параметры подставляются как NULL)"""
+        if self.database is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        conn = sqlite3.connect(self.database.db_name, timeout=1)
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count('?')).fetchall()
+            return [row[-1] for row in rows]
+        except sqlite3.Error as e:
+            logger.debug(f"EXPLAIN не выполнен: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _log_slow(self, stats: QueryStats, sql: str, seconds: float, fetch: bool):
+        now = time.time()
+        if stats.shape != OTHER_SHAPE and now - stats.plan_at >= EXPLAIN_TTL_SECONDS:
+            stats.plan_at = now
+            stats.plan = self._explain(sql)
+
+        phase = 'fetch' if fetch else 'execute'
+        plan = '; '.join(stats.plan) if stats.plan else 'нет плана'
+        logger.warning(f"🐢 slow_query {phase} duration_ms={seconds * 1000:.1f} "
+                       f"shape=\"{stats.shape}\" plan=\"{plan}\"")
+
+    # ==================== ОТЧЕТ ====================
+
+    def top(self, limit: int = 20, order: str = 'total') -> List[Dict]:
+        """Топ форм запросов; оценки calls/total пересчитаны с учетом sample_rate"""
+        scale = 1 / self.sample_rate if self.sample_rate > 0 else 0
+        with self._lock:
+            rows = [
+                {
+                    'shape': stats.shape,
+                    'example': stats.example,
+                    'sampled_calls': stats.calls,
+                    'estimated_calls': round(stats.calls * scale),
+                    'estimated_total_ms': round(stats.total * scale * 1000, 3),
+                    'mean_ms': round(stats.total / stats.calls * 1000, 3) if stats.calls else None,
+                    'max_ms': round(stats.max * 1000, 3),
+                    'slow_count': stats.slow,
+                    'plan': stats.plan,
+                }
+                for stats in self._stats.values()
+            ]
+
+        keys = {
+            'total': lambda row: row['estimated_total_ms'],
+            'mean': lambda row: row['mean_ms'] or 0,
+            'max': lambda row: row['max_ms'],
+            'calls': lambda row: row['sampled_calls'],
+        }
+        rows.sort(key=keys.get(order, keys['total']), reverse=True)
+        return rows[:limit]
+
+
+profiler = SQLProfiler()
+
+
+@sql_profiler_bp.route('/api/admin/sql-profile', methods=['GET'])
+@admin_required
+def get_sql_profile():
+    """Топ SQL запросов этого воркера"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 500))
+        order = request.args.get('order', 'total')
+        return jsonify({
+            'success': True,
+            'enabled': profiler.enabled,
+            'sample_rate': profiler.sample_rate,
+            'slow_query_ms': profiler.slow_seconds * 1000,
+            'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(profiler.started_at)),
+            'pid': os.getpid(),
+            'queries': profiler.top(limit, order)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@sql_profiler_bp.route('/api/admin/sql-profile', methods=['POST'])
+@admin_required
+def configure_sql_profile():
+    """Включение/выключение профилировщика, частота выборки, порог, сброс статистики"""
+    try:
+        data = request.json or {}
+
+        if 'sample_rate' in data:
+            sample_rate = float(data['sample_rate'])
+            if not 0 < sample_rate <= 1:
+                return jsonify({'success': False, 'error': 'sample_rate должен быть в диапазоне (0, 1]'})
+            profiler.sample_rate = sample_rate
+        if 'slow_query_ms' in data:
+            profiler.slow_seconds = float(data['slow_query_ms']) / 1000
+        if data.get('reset'):
+            profiler.reset()
+        if 'enabled' in data:
+            if data['enabled']:
+                profiler.install(profiler.database)
+            else:
+                profiler.uninstall()
+
+        return jsonify({
+            'success': True,
+            'enabled': profiler.enabled,
+            'sample_rate': profiler.sample_rate,
+            'slow_query_ms': profiler.slow_seconds * 1000,
+            'pid': os.getpid()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+def init_sql_profiler(app, database):
+    """
+    Подключает профилировщик к приложению
+
+    Хук устанавливается только при SQL_PROFILER=true; endpoint доступен
+    всегда, чтобы администратор мог включить профилирование без рестарта.
+
+    Args:
+        app: Flask приложение
+        database: Экземпляр WebDatabase
+    """
+    profiler.database = database
+    if SQL_PROFILER_ENABLED:
+        profiler.install(database)
+        logger.info(f"🔍 SQL профилировщик включен (выборка {profiler.sample_rate:.0%}, "
+                    f"порог {profiler.slow_seconds * 1000:.0f} мс)")
+    app.register_blueprint(sql_profiler_bp)
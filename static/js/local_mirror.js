@@ -0,0 +1,188 @@
+/**
+ * Локальная копия таблиц clients, cases и activities в IndexedDB
+ * Первый запуск скачивает таблицы целиком, дальше /api/changes отдает только изменения
+ *
+ * В копии персональные данные клиентов: база своя у каждого пользователя и
+ * удаляется при выходе, на странице входа и при ответе 401 от /api/changes
+ */
+
+const MIRROR_DB_PREFIX = 'legal_crm_mirror';
+
+class LocalMirror {
+    constructor(tables, user) {
+        this.tables = tables;
+        // Без пользователя (страница отдана не index.html) копия живет только в памяти
+        this.dbName = user ? `${MIRROR_DB_PREFIX}_${user}` : null;
+        this.db = null;
+        // Без IndexedDB (приватный режим и т.п.) копия живет только в памяти страницы
+        this.memory = null;
+        this.cursor = null;
+        this.pending = null;
+        this.queued = null;
+    }
+
+    // ==================== ХРАНИЛИЩЕ ====================
+
+    open() {
+        if (this.db || this.memory) return Promise.resolve();
+        if (!window.indexedDB || !this.dbName) {
+            this.useMemory();
+            return Promise.resolve();
+        }
+        return new Promise((resolve) => {
+            const request = indexedDB.open(this.dbName, 1);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                this.tables.forEach((table) => db.createObjectStore(table, { keyPath: 'id' }));
+                db.createObjectStore('meta');
+            };
+            request.onsuccess = () => {
+                this.db = request.result;
+                this.readMeta('cursor').then((cursor) => {
+                    this.cursor = cursor || null;
+                    resolve();
+                });
+            };
+            request.onerror = () => {
+                console.warn('IndexedDB недоступна, локальная копия в памяти');
+                this.useMemory();
+                resolve();
+            };
+        });
+    }
+
+    // Удаляет копию текущего пользователя (выход, истекшая сессия)
+    clear() {
+        this.cursor = null;
+        this.memory = null;
+        if (this.db) {
+            this.db.close();
+            this.db = null;
+        }
+        return this.dbName && window.indexedDB ? LocalMirror.deleteDatabase(this.dbName) : Promise.resolve();
+    }
+
+    static deleteDatabase(name) {
+        return new Promise((resolve) => {
+            const request = indexedDB.deleteDatabase(name);
+            request.onsuccess = request.onerror = request.onblocked = () => resolve();
+        });
+    }
+
+    // Удаляет копии всех пользователей браузера, включая общую базу старых версий
+    static dropAll() {
+        if (!window.indexedDB) return Promise.resolve();
+        const listed = indexedDB.databases ? indexedDB.databases() : Promise.resolve([]);
+        return listed.catch(() => []).then((databases) => {
+            const names = new Set([MIRROR_DB_PREFIX]);
+            databases.forEach((db) => {
+                if (db.name && db.name.startsWith(MIRROR_DB_PREFIX)) names.add(db.name);
+            });
+            return Promise.all(Array.from(names).map((name) => LocalMirror.deleteDatabase(name)));
+        });
+    }
+
+    useMemory() {
+        this.memory = {};
+        this.tables.forEach((table) => { this.memory[table] = new Map(); });
+    }
+
+    readMeta(key) {
+        return new Promise((resolve) => {
+            const request = this.db.transaction('meta').objectStore('meta').get(key);
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+        });
+    }
+
+    // Применяет ответ /api/changes одной транзакцией вместе с новым курсором
+    apply(response) {
+        if (this.memory) {
+            this.tables.forEach((table) => {
+                const store = this.memory[table];
+                if (response.reset) store.clear();
+                const changes = response.changes[table];
+                changes.deleted.forEach((id) => store.delete(id));
+                changes.upserted.forEach((row) => store.set(row.id, row));
+            });
+            this.cursor = response.cursor;
+            return Promise.resolve();
+        }
+
+        return new Promise((resolve, reject) => {
+            const tx = this.db.transaction(this.tables.concat('meta'), 'readwrite');
+            this.tables.forEach((table) => {
+                const store = tx.objectStore(table);
+                if (response.reset) store.clear();
+                const changes = response.changes[table];
+                changes.deleted.forEach((id) => store.delete(id));
+                changes.upserted.forEach((row) => store.put(row));
+            });
+            tx.objectStore('meta').put(response.cursor, 'cursor');
+            tx.oncomplete = () => {
+                this.cursor = response.cursor;
+                resolve();
+            };
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    // ==================== СИНХРОНИЗАЦИЯ ====================
+
+    // Дочитывает изменения с сервера. Вызовы во время запроса объединяются
+    // в один повторный запрос после него, чтобы не пропустить свежие изменения
+    sync() {
+        if (this.pending) {
+            if (!this.queued) {
+                this.queued = this.pending.catch(() => {}).then(() => {
+                    this.queued = null;
+                    return this.sync();
+                });
+            }
+            return this.queued;
+        }
+        this.pending = this.open()
+            .then(() => this.pull())
+            .finally(() => { this.pending = null; });
+        return this.pending;
+    }
+
+    pull() {
+        const url = this.cursor ? `/api/changes?since=${encodeURIComponent(this.cursor)}` : '/api/changes';
+        return $.ajax({ url: url, method: 'GET' }).then((response) => {
+            if (!response.success) {
+                return Promise.reject(new Error(response.error));
+            }
+            return this.apply(response).then(() => {
+                if (response.has_more) return this.pull();
+            });
+        }, (xhr) => {
+            // Сессия закончилась: данные не должны оставаться в браузере
+            if (xhr.status === 401) {
+                return this.clear().then(() => Promise.reject(new Error('Требуется авторизация')));
+            }
+            return Promise.reject(new Error(xhr.statusText || 'Ошибка синхронизации'));
+        });
+    }
+
+    // Все строки таблицы, новые сверху
+    getAll(table) {
+        return this.open().then(() => {
+            if (this.memory) {
+                return Array.from(this.memory[table].values()).sort((a, b) => b.id - a.id);
+            }
+            return new Promise((resolve, reject) => {
+                const request = this.db.transaction(table).objectStore(table).getAll();
+                request.onsuccess = () => resolve(request.result.sort((a, b) => b.id - a.id));
+                request.onerror = () => reject(request.error);
+            });
+        });
+    }
+
+    // Таблица после синхронизации
+    load(table) {
+        return this.sync().then(() => this.getAll(table));
+    }
+}
+
+const localMirror = new LocalMirror(['clients', 'cases', 'activities'], window.MIRROR_USER);
@@ -93,7 +93,8 @@ class YandexOAuthSync {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    code: code
+                    code: code,
+                    state: state
                 })
             });
 
@@ -339,10 +340,11 @@ class YandexOAuthSync {
                     `);
                 } else {
                     data.backups.forEach(backup => {
+                        const sizeMB = backup.size ? (backup.size / 1024 / 1024).toFixed(2) + ' МБ' : 'Неизвестно';
                         tbody.append(`
                             <tr>
                                 <td>${backup.name}</td>
-                                <td>${backup.size}</td>
+                                <td>${sizeMB}</td>
                                 <td>
                                     <button class="btn btn-sm btn-success" onclick="yandexSync.restoreBackup('${backup.path}')">
                                         <i class="fas fa-download me-1"></i>Восстановить
@@ -0,0 +1,324 @@
+"""
+Менеджер OAuth токенов Яндекс.Диска
+Кэширует токены в памяти и обновляет их в фоне до истечения срока действия
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Токен обновляется после того, как прошло 80% его времени жизни
+REFRESH_AT_FRACTION = 0.8
+
+# Как часто фоновый поток проверяет токены, если ближайшее обновление не скоро
+CHECK_INTERVAL_SECONDS = 300
+
+# Пауза перед повтором после неудачного обновления
+RETRY_DELAY_SECONDS = 60
+
+
+def _parse_obtained_at(value) -> Optional[float]:
+    """Время получения токена из ISO строки в unix time"""
+    if not value:
+        return None
+    try:
+        obtained = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if obtained.tzinfo is not None:
+        return obtained.timestamp()
+    return time.mktime(obtained.timetuple()) + obtained.microsecond / 1e6
+
+
+class OAuthTokenManager:
+    """
+    Кэш OAuth токенов с фоновым обновлением
+
+    Токены хранятся в памяти по имени пользователя. Фоновый поток
+    обновляет их до истечения, поэтому запросы синхронизации получают
+    готовый токен без обращения к OAuth серверу. Одновременные запросы
+    на обновление одного токена схлопываются в один (single-flight).
+    """
+
+    def __init__(self, oauth_client_factory: Callable,
+                 load_tokens: Callable[[str], Optional[Dict]],
+                 save_tokens: Callable[[str, Dict], None]):
+        """
+        Args:
+            oauth_client_factory: Возвращает YandexOAuthClient или None, если OAuth не настроен
+            load_tokens: Загружает сохраненную конфигурацию токенов пользователя
+            save_tokens: Атомарно сохраняет конфигурацию токенов пользователя
+        """
+        self.oauth_client_factory = oauth_client_factory
+        self.load_tokens = load_tokens
+        self.save_tokens = save_tokens
+
+        self._tokens: Dict[str, Dict] = {}
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._retry_after: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    # ==================== КЭШ ====================
+
+    @staticmethod
+    def _with_deadlines(config: Dict) -> Dict:
+        """Добавляет к конфигурации моменты обновления и истечения токена"""
+        entry = dict(config)
+        obtained = _parse_obtained_at(entry.get('obtained_at'))
+        expires_in = entry.get('expires_in') or 0
+        if obtained and expires_in:
+            entry['_expires_at'] = obtained + expires_in
+            entry['_refresh_at'] = obtained + expires_in * REFRESH_AT_FRACTION
+        else:
+            entry['_expires_at'] = None
+            entry['_refresh_at'] = None
+        return entry
+
+    @staticmethod
+    def _public(entry: Dict) -> Dict:
+        """Конфигурация без служебных полей кэша"""
+        return {key: value for key, value in entry.items() if not key.startswith('_')}
+
+    def _get_entry(self, username: str) -> Optional[Dict]:
+        """Возвращает токены из кэша, при промахе загружает из хранилища"""
+        entry = self._tokens.get(username)
+        if entry is not None:
+            return entry
+
+        config = self.load_tokens(username)
+        if not config:
+            return None
+
+        entry = self._with_deadlines(config)
+        with self._lock:
+            entry = self._tokens.setdefault(username, entry)
+        self._wakeup.set()
+        return entry
+
+    def store(self, username: str, token_response: Dict, **extra) -> Dict:
+        """
+        Сохраняет новые токены после обмена кода или обновления
+
+        Args:
+            username: Имя пользователя
+            token_response: Ответ OAuth сервера
+            **extra: Дополнительные поля конфигурации (например, configured_path)
+
+        Returns:
+            Dict: Сохраненная конфигурация
+        """
+        previous = self._tokens.get(username) or {}
+        config = self._public(previous)
+        config.update(extra)
+        config.update({
+            'access_token': token_response['access_token'],
+            'refresh_token': token_response.get('refresh_token') or config.get('refresh_token', ''),
+            'token_type': token_response.get('token_type', 'bearer'),
+            'expires_in': token_response.get('expires_in', 0),
+            'scope': token_response.get('scope', ''),
+            'obtained_at': datetime.now().isoformat()
+        })
+
+        self.save_tokens(username, config)
+
+        with self._lock:
+            self._tokens[username] = self._with_deadlines(config)
+            self._retry_after.pop(username, None)
+        self._wakeup.set()
+        return config
+
+    def invalidate(self, username: str):
+        """Удаляет токены пользователя из кэша"""
+        with self._lock:
+            self._tokens.pop(username, None)
+            self._retry_after.pop(username, None)
+
+    def get_config(self, username: str) -> Optional[Dict]:
+        """Конфигурация токенов пользователя без обращения к OAuth серверу"""
+        entry = self._get_entry(username)
+        return self._public(entry) if entry else None
+
+    # ==================== ТОКЕНЫ ====================
+
+    def get_access_token(self, username: str) -> Optional[str]:
+        """
+        Возвращает действующий access token
+
+        Если токену пора обновиться, обновление планируется в фоне,
+        а вызывающий сразу получает текущий (еще действующий) токен.
+        Ждать приходится только если токен уже истек.
+
+        Args:
+            username: Имя пользователя
+
+        Returns:
+            Optional[str]: Access token или None
+        """
+        entry = self._get_entry(username)
+        if not entry or not entry.get('access_token'):
+            return None
+
+        expires_at = entry.get('_expires_at')
+        if expires_at is None:
+            # Срок жизни неизвестен - доверяем токену
+            return entry['access_token']
+
+        now = time.time()
+        if now < expires_at:
+            if now >= entry['_refresh_at']:
+                self._wakeup.set()
+            return entry['access_token']
+
+        # Токен истек (например, воркер долго спал) - обновляем и ждем
+        try:
+            entry = self.refresh(username)
+        except Exception as e:
+            logger.error(f"❌ Не удалось обновить истекший токен для {username}: {e}")
+            return None
+        return entry.get('access_token') if entry else None
+
+    def refresh(self, username: str, force: bool = False) -> Optional[Dict]:
+        """
+        Обновляет токен пользователя (single-flight)
+
+        Одновременные вызовы для одного пользователя ждут
+        результат первого вместо повторных запросов к OAuth серверу.
+
+        Args:
+            username: Имя пользователя
+            force: Обновить даже если токен еще свежий
+
+        Returns:
+            Optional[Dict]: Актуальная конфигурация токенов или None
+
+        Raises:
+            Exception: Ошибка OAuth сервера (только для вызова, выполнявшего обновление)
+        """
+        with self._lock:
+            event = self._in_flight.get(username)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._in_flight[username] = event
+
+        if not leader:
+            event.wait()
+            return self.get_config(username)
+
+        try:
+            return self._do_refresh(username, force)
+        finally:
+            with self._lock:
+                self._in_flight.pop(username, None)
+            event.set()
+
+    def _do_refresh(self, username: str, force: bool) -> Optional[Dict]:
+        """Выполняет обновление токена через YandexOAuthClient"""
+        cached = self._tokens.get(username)
+
+        # Другой воркер мог уже обновить токен - берем его из хранилища
+        stored = self.load_tokens(username)
+        if stored:
+            stored_entry = self._with_deadlines(stored)
+            if not cached or (stored_entry.get('obtained_at') or '') > (cached.get('obtained_at') or ''):
+                with self._lock:
+                    self._tokens[username] = stored_entry
+                cached = stored_entry
+
+        if not cached:
+            return None
+
+        refresh_at = cached.get('_refresh_at')
+        if not force and refresh_at is not None and time.time() < refresh_at:
+            return self._public(cached)
+
+        refresh_token = cached.get('refresh_token')
+        if not refresh_token:
+            return None
+
+        oauth_client = self.oauth_client_factory()
+        if oauth_client is None:
+            return None
+
+        token_response = oauth_client.refresh_access_token(refresh_token)
+        config = self.store(username, token_response)
+        logger.info(f"🔄 OAuth токен обновлен для пользователя {username}")
+        return config
+
+    def token_info(self, username: str) -> Optional[Dict]:
+        """Информация о токене для статуса авторизации"""
+        entry = self._get_entry(username)
+        if not entry:
+            return None
+
+        access_token = entry.get('access_token')
+        expires_at = entry.get('_expires_at')
+        now = time.time()
+        token_valid = bool(access_token) and (expires_at is None or now < expires_at)
+
+        return {
+            'has_access_token': bool(access_token),
+            'token_valid': token_valid,
+            'expires_in': entry.get('expires_in', 0),
+            'expires_at': datetime.fromtimestamp(expires_at).isoformat() if expires_at else None,
+            'refresh_at': datetime.fromtimestamp(entry['_refresh_at']).isoformat() if entry.get('_refresh_at') else None
+        }
+
+    # ==================== ФОНОВОЕ ОБНОВЛЕНИЕ ====================
+
+    def start(self):
+        """Запускает фоновый поток обновления токенов"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._refresh_worker, name='oauth-token-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновый поток"""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _next_wakeup(self) -> float:
+        """Через сколько секунд нужно проверить токены"""
+        now = time.time()
+        delay = CHECK_INTERVAL_SECONDS
+        for username, entry in list(self._tokens.items()):
+            refresh_at = entry.get('_refresh_at')
+            if refresh_at is None:
+                continue
+            refresh_at = max(refresh_at, self._retry_after.get(username, 0))
+            delay = min(delay, refresh_at - now)
+        return max(0.0, delay)
+
+    def _refresh_worker(self):
+        """Рабочий поток: обновляет токены, которым пора обновиться"""
+        while self._running:
+            self._wakeup.wait(self._next_wakeup())
+            self._wakeup.clear()
+            if not self._running:
+                break
+
+            now = time.time()
+            for username, entry in list(self._tokens.items()):
+                refresh_at = entry.get('_refresh_at')
+                if refresh_at is None or now < refresh_at or now < self._retry_after.get(username, 0):
+                    continue
+                try:
+                    self.refresh(username)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка фонового обновления токена для {username}: {e}")
+
+                # Обновить не удалось - не пытаемся снова до паузы
+                entry = self._tokens.get(username)
+                if entry and entry.get('_refresh_at') is not None and entry['_refresh_at'] <= time.time():
+                    self._retry_after[username] = time.time() + RETRY_DELAY_SECONDS
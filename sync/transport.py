@@ -0,0 +1,355 @@
+"""
+Транспортный слой для всех запросов к Яндекс.Диску
+Таймауты, повторы с экспоненциальной задержкой и circuit breaker
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Таймауты: (подключение, чтение) в секундах
+CONNECT_TIMEOUT = float(os.environ.get('YANDEX_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('YANDEX_READ_TIMEOUT', 60))
+
+# Повторы запросов
+MAX_RETRIES = int(os.environ.get('YANDEX_MAX_RETRIES', 4))
+BACKOFF_BASE = float(os.environ.get('YANDEX_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('YANDEX_BACKOFF_MAX', 30))
+# Если сервер просит ждать дольше, не держим воркер и отдаём ответ как есть
+RETRY_AFTER_MAX = float(os.environ.get('YANDEX_RETRY_AFTER_MAX', 60))
+# Общий бюджет времени одного вызова request() со всеми повторами и паузами:
+# по его исчерпании повторов больше нет (0 - без ограничения)
+REQUEST_DEADLINE = float(os.environ.get('YANDEX_REQUEST_DEADLINE', 120))
+
+# Circuit breaker
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('YANDEX_BREAKER_THRESHOLD', 5))
+BREAKER_RECOVERY_TIMEOUT = float(os.environ.get('YANDEX_BREAKER_RECOVERY', 30))
+
+# Пул соединений общей HTTP сессии
+POOL_MAXSIZE = int(os.environ.get('YANDEX_POOL_MAXSIZE', 10))
+
+# Методы, которые безопасно повторять: повтор не меняет результат
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'PROPFIND'})
+
+# Статусы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Для неидемпотентных методов повторяем только то, что сервер точно не обработал
+NON_IDEMPOTENT_RETRY_STATUSES = frozenset({429})
+
+
+class DiskUnavailableError(Exception):
+    """Яндекс.Диск недоступен: circuit breaker разомкнут"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для одного хоста Яндекс.Диска
+
+    closed    - запросы идут как обычно, считаем подряд идущие ошибки
+    open      - после BREAKER_FAILURE_THRESHOLD ошибок запросы сразу отклоняются
+    half_open - по истечении recovery_timeout пропускаем один пробный запрос
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout: float = BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_failure = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            # half_open: пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """Успешный ответ: замыкаем цепь"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"✅ Яндекс.Диск ({self.name}) снова доступен")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Ошибка транспорта или 5xx: размыкаем цепь после порога"""
+        with self._lock:
+            self.failures += 1
+            self.last_failure = datetime.now().isoformat()
+            self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"⚠️  Яндекс.Диск ({self.name}) недоступен, запросы приостановлены "
+                                   f"на {self.recovery_timeout:.0f} с")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        """Состояние для /api/sync/status"""
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, round(self.recovery_timeout - (time.monotonic() - self.opened_at), 1))
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'last_failure': self.last_failure,
+                'retry_in_seconds': retry_in
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# Наблюдатели observer(method, host, status, seconds) за каждой попыткой запроса
+_observers: List[Callable] = []
+
+
+def add_observer(observer: Callable):
+    """
+    Подписывает функцию на тайминги запросов к Яндекс.Диску
+
+    observer(method, host, status, seconds) вызывается после каждой попытки;
+    status равен None при ошибке сети. Для stream=True время включает только
+    получение заголовков ответа.
+    """
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def _notify(method: str, host: str, status: Optional[int], started: float):
+    elapsed = time.perf_counter() - started
+    for observer in _observers:
+        try:
+            observer(method, host, status, elapsed)
+        except Exception as e:
+            logger.debug(f"Ошибка наблюдателя транспорта: {e}")
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Общий для процесса circuit breaker хоста"""
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(host, CircuitBreaker(host))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    """Состояние всех circuit breaker'ов процесса"""
+    return {host: breaker.snapshot() for host, breaker in list(_breakers.items())}
+
+
+def get_shared_session() -> requests.Session:
+    """
+    Общая HTTP сессия с пулом keep-alive соединений
+
+    Клиенты Яндекс.Диска создаются на каждый запрос, поэтому сессию
+    держим на уровне процесса, а авторизацию передаем заголовками запроса.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class DiskTransport:
+    """HTTP транспорт Яндекс.Диска с таймаутами, повторами и circuit breaker"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 max_retries: int = MAX_RETRIES,
+                 deadline: float = REQUEST_DEADLINE):
+        """
+        Args:
+            headers: Заголовки, добавляемые к каждому запросу (например, авторизация)
+            connect_timeout: Таймаут подключения в секундах
+            read_timeout: Таймаут чтения в секундах
+            max_retries: Максимальное число повторов
+            deadline: Бюджет времени вызова со всеми повторами в секундах (0 - без ограничения)
+        """
+        self.session = get_shared_session()
+        self.headers = dict(headers or {})
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                data=None, stream: bool = False, idempotent: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """
+        Выполняет запрос с повторами
+
+        Args:
+            method: HTTP метод
+            url: Полный URL
+            headers: Дополнительные заголовки запроса
+            data: Тело запроса; файловые объекты перематываются перед повтором
+            stream: Не читать тело ответа сразу
+            idempotent: Переопределяет идемпотентность метода
+
+        Повтор не начинается, если вместе с паузой перед ним выйдет за бюджет
+        deadline; таймаут чтения последней попытки не больше остатка бюджета.
+
+        Returns:
+            requests.Response: Последний полученный ответ
+
+        Raises:
+            DiskUnavailableError: Если circuit breaker разомкнут
+            requests.RequestException: Если исчерпаны повторы или бюджет времени при ошибке сети
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+
+        host = urlparse(url).netloc
+        breaker = get_breaker(host)
+        body_start = data.tell() if hasattr(data, 'seek') else None
+        attempt = 0
+        deadline_at = time.monotonic() + self.deadline if self.deadline > 0 else None
+
+        while True:
+            if not breaker.allow_request():
+                raise DiskUnavailableError(
+                    f"Яндекс.Диск временно недоступен ({breaker.name}), повторите позже"
+                )
+
+            if body_start is not None:
+                data.seek(body_start)
+
+            timeout = self.timeout
+            if deadline_at is not None:
+                timeout = (timeout[0], max(0.001, min(timeout[1], deadline_at - time.monotonic())))
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url,
+                    headers=request_headers,
+                    data=data,
+                    stream=stream,
+                    timeout=timeout,
+                    **kwargs
+                )
+            except requests.RequestException as e:
+                _notify(method, host, None, started)
+                breaker.record_failure()
+                if attempt >= self.max_retries or not self._can_retry_error(e, idempotent):
+                    raise
+                delay = self._backoff(attempt)
+                if self._past_deadline(deadline_at, delay):
+                    logger.warning(f"⚠️  {method} {url}: {e.__class__.__name__}, бюджет {self.deadline:g} с исчерпан")
+                    raise
+                logger.warning(f"⚠️  {method} {url}: {e.__class__.__name__}, повтор через {delay:.1f} с "
+                               f"({attempt + 1}/{self.max_retries})")
+            else:
+                status = response.status_code
+                _notify(method, host, status, started)
+                if status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                if not idempotent and status not in NON_IDEMPOTENT_RETRY_STATUSES:
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None and retry_after > RETRY_AFTER_MAX:
+                    return response
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                if self._past_deadline(deadline_at, delay):
+                    logger.warning(f"⚠️  {method} {url}: HTTP {status}, бюджет {self.deadline:g} с исчерпан")
+                    return response
+                response.close()
+                logger.warning(f"⚠️  {method} {url}: HTTP {status}, повтор через {delay:.1f} с "
+                               f"({attempt + 1}/{self.max_retries})")
+
+            attempt += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def _past_deadline(deadline_at: Optional[float], delay: float) -> bool:
+        """Повтор после паузы delay начался бы уже за бюджетом времени"""
+        return deadline_at is not None and time.monotonic() + delay >= deadline_at
+
+    @staticmethod
+    def _can_retry_error(error: Exception, idempotent: bool) -> bool:
+        """Неидемпотентный запрос повторяем, только если он не ушел на сервер"""
+        if idempotent:
+            return isinstance(error, (requests.ConnectionError, requests.Timeout))
+        return isinstance(error, requests.ConnectTimeout)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
@@ -3,14 +3,91 @@ OAuth2 клиент для работы с Яндекс.Диском с подд
 Обеспечивает авторизацию через OAuth2 и обмен кода подтверждения на токены
 """
 
-import requests
+import os
 import json
 import uuid
 import base64
 import hashlib
 import secrets
 import urllib.parse
-from typing import Dict, Optional, Tuple
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sync.transport import DiskTransport
+
+# Адрес WebDAV Диска; переопределяется для локального фейкового сервера (benchmarks/fake_yandex_disk.py)
+DEFAULT_WEBDAV_URL = "https://webdav.yandex.ru"
+
+
+# Свойства, которые запрашиваем в PROPFIND: все нужное приходит одним запросом
+PROPFIND_BODY = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<d:propfind xmlns:d="DAV:"><d:prop>'
+    '<d:resourcetype/><d:getcontentlength/><d:getlastmodified/>'
+    '<d:getetag/><d:getcontenttype/>'
+    '</d:prop></d:propfind>'
+)
+
+DAV_RESPONSE = '{DAV:}response'
+
+
+class DiskEntry(NamedTuple):
+    """Элемент листинга директории Яндекс.Диска"""
+    href: str
+    name: str
+    is_directory: bool
+    size: Optional[int]
+    modified: Optional[str]
+    etag: Optional[str]
+    content_type: Optional[str]
+
+
+def _parse_dav_response(elem) -> Optional[DiskEntry]:
+    """Разбирает элемент <d:response> multistatus ответа"""
+    href = elem.findtext('{DAV:}href')
+    if not href:
+        return None
+    href = urllib.parse.unquote(href)
+
+    prop = None
+    for propstat in elem.iterfind('{DAV:}propstat'):
+        status = propstat.findtext('{DAV:}status') or ''
+        if ' 200 ' in status or status.endswith(' 200'):
+            prop = propstat.find('{DAV:}prop')
+            break
+    if prop is None:
+        prop = elem.find('{DAV:}propstat/{DAV:}prop')
+
+    is_directory = False
+    size = None
+    modified = None
+    etag = None
+    content_type = None
+
+    if prop is not None:
+        resourcetype = prop.find('{DAV:}resourcetype')
+        is_directory = resourcetype is not None and resourcetype.find('{DAV:}collection') is not None
+
+        length = prop.findtext('{DAV:}getcontentlength')
+        if length:
+            try:
+                size = int(length)
+            except ValueError:
+                size = None
+
+        last_modified = prop.findtext('{DAV:}getlastmodified')
+        if last_modified:
+            try:
+                modified = parsedate_to_datetime(last_modified).isoformat()
+            except (TypeError, ValueError):
+                modified = last_modified
+
+        etag = (prop.findtext('{DAV:}getetag') or '').strip('"') or None
+        content_type = prop.findtext('{DAV:}getcontenttype') or None
+
+    name = href.rstrip('/').rsplit('/', 1)[-1]
+    return DiskEntry(href, name, is_directory, size, modified, etag, content_type)
 
 
 class YandexOAuthClient:
@@ -33,6 +110,9 @@ class YandexOAuthClient:
         self.code_verifier = None
         self.code_challenge = None
         
+        # Запросы к OAuth серверу идут через общий транспорт с таймаутами
+        self.transport = DiskTransport()
+        
         # Scopes для доступа к Яндекс.Диску
         self.scopes = [
             "disk:read",
@@ -169,7 +249,7 @@ class YandexOAuthClient:
             data["client_id"] = self.client_id
         
         # Выполняем запрос
-        response = requests.post(self.token_url, data=data, headers=headers)
+        response = self.transport.request('POST', self.token_url, data=data, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -207,7 +287,7 @@ class YandexOAuthClient:
         else:
             data["client_id"] = self.client_id
         
-        response = requests.post(self.token_url, data=data, headers=headers)
+        response = self.transport.request('POST', self.token_url, data=data, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -229,12 +309,12 @@ class YandexDiskOAuthWebDAV:
             access_token (str): OAuth access token
         """
         self.access_token = access_token
-        self.base_url = "https://webdav.yandex.ru"
-        self.session = requests.Session()
+        self.base_url = os.environ.get('YANDEX_WEBDAV_URL', DEFAULT_WEBDAV_URL)
         
-        # Настраиваем авторизацию через Bearer token
-        self.session.headers.update({
-            "Authorization": f"Bearer {access_token}"
+        # Общий с YandexDiskWebDAV транспорт: пул соединений, таймауты, повторы
+        self.transport = DiskTransport({
+            "Authorization": f"OAuth {access_token}",
+            "User-Agent": "LegalCRM/1.0"
         })
     
     def test_connection(self) -> bool:
@@ -245,8 +325,8 @@ class YandexDiskOAuthWebDAV:
             bool: True при успехе, False при ошибке
         """
         try:
-            response = self.session.request('PROPFIND', self.base_url, 
-                                          headers={'Depth': '0'})
+            response = self.transport.request('PROPFIND', self.base_url,
+                                              headers={'Depth': '0'})
             return response.status_code in [200, 207]  # 207 Multi-Status
         except Exception:
             return False
@@ -263,15 +343,13 @@ class YandexDiskOAuthWebDAV:
             bool: True при успехе, False при ошибке
         """
         try:
-            import os
             if not os.path.exists(local_path):
                 return False
             
-            with open(local_path, 'rb') as f:
-                file_data = f.read()
-            
+            # Загружаем потоком, не читая файл целиком в память
             url = f"{self.base_url}{remote_path}"
-            response = self.session.put(url, data=file_data)
+            with open(local_path, 'rb') as f:
+                response = self.transport.request('PUT', url, data=f)
             
             return response.status_code in [200, 201, 204]
         except Exception as e:
@@ -290,49 +368,96 @@ class YandexDiskOAuthWebDAV:
             bool: True при успехе, False при ошибке
         """
         try:
-            import os
             url = f"{self.base_url}{remote_path}"
-            response = self.session.get(url)
+            response = self.transport.request('GET', url, stream=True)
             
-            if response.status_code == 200:
+            with response:
+                if response.status_code != 200:
+                    return False
+                
                 # Создаем директорию если не существует
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                local_dir = os.path.dirname(local_path)
+                if local_dir:
+                    os.makedirs(local_dir, exist_ok=True)
                 
                 with open(local_path, 'wb') as f:
-                    f.write(response.content)
-                return True
-            return False
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            return True
         except Exception as e:
             print(f"Ошибка скачивания файла: {e}")
             return False
     
-    def list_directory(self, remote_path: str = "/") -> list:
+    def iter_directory(self, remote_path: str = "/", depth: str = "1",
+                       include_self: bool = False) -> Iterator[DiskEntry]:
         """
-        Возвращает список файлов в директории
+        Потоково перечисляет содержимое директории
+        
+        Ответ PROPFIND разбирается инкрементально (iterparse) по мере
+        чтения из сети, поэтому память не растет с числом элементов.
         
         Args:
             remote_path (str): Удаленный путь на Яндекс.Диске
+            depth (str): '1' - только директория, 'infinity' - рекурсивный обход
+            include_self (bool): Возвращать ли саму директорию
             
-        Returns:
-            list: Список файлов и директорий
+        Yields:
+            DiskEntry: Элементы директории с размером, датой, etag и типом
+            
+        Raises:
+            IOError: Если сервер вернул ошибку
         """
-        try:
-            url = f"{self.base_url}{remote_path}"
-            response = self.session.request('PROPFIND', url, 
-                                          headers={'Depth': '1'})
+        if depth not in ('0', '1', 'infinity'):
+            raise ValueError(f"Недопустимое значение Depth: {depth}")
+        
+        url = f"{self.base_url}{remote_path}"
+        response = self.transport.request(
+            'PROPFIND', url,
+            headers={'Depth': depth, 'Content-Type': 'application/xml; charset=utf-8'},
+            data=PROPFIND_BODY.encode('utf-8'),
+            stream=True
+        )
+        
+        with response:
+            if response.status_code not in [200, 207]:
+                raise IOError(f"PROPFIND {remote_path}: HTTP {response.status_code}")
             
-            if response.status_code in [200, 207]:
-                # Парсим XML ответ
-                files = []
-                root = ET.fromstring(response.content)
+            response.raw.decode_content = True
+            self_href = urllib.parse.unquote(remote_path).rstrip('/') or '/'
+            root = None
+            
+            for event, elem in ET.iterparse(response.raw, events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                if elem.tag != DAV_RESPONSE:
+                    continue
                 
-                for response_elem in root.findall('.//{DAV:}response'):
-                    href = response_elem.find('.//{DAV:}href')
-                    if href is not None and href.text:
-                        files.append(href.text)
+                entry = _parse_dav_response(elem)
+                # Освобождаем разобранные элементы, чтобы дерево не росло
+                elem.clear()
+                root.clear()
                 
-                return files
-            return []
+                if entry is None:
+                    continue
+                if not include_self and (entry.href.rstrip('/') or '/') == self_href:
+                    continue
+                yield entry
+    
+    def list_directory(self, remote_path: str = "/", depth: str = "1") -> List[DiskEntry]:
+        """
+        Возвращает список файлов в директории
+        
+        Args:
+            remote_path (str): Удаленный путь на Яндекс.Диске
+            depth (str): '1' или 'infinity' для рекурсивного обхода
+            
+        Returns:
+            List[DiskEntry]: Список файлов и директорий
+        """
+        try:
+            return list(self.iter_directory(remote_path, depth))
         except Exception as e:
             print(f"Ошибка получения списка файлов: {e}")
             return []
@@ -349,7 +474,7 @@ class YandexDiskOAuthWebDAV:
         """
         try:
             url = f"{self.base_url}{remote_path}"
-            response = self.session.request('MKCOL', url)
+            response = self.transport.request('MKCOL', url)
             
             return response.status_code in [200, 201]
         except Exception as e:
@@ -368,7 +493,7 @@ class YandexDiskOAuthWebDAV:
         """
         try:
             url = f"{self.base_url}{remote_path}"
-            response = self.session.request('DELETE', url)
+            response = self.transport.request('DELETE', url)
             
             return response.status_code in [200, 204]
         except Exception as e:
@@ -25,6 +25,16 @@ except ImportError:
     os.system("pip install requests")
     import requests
 
+from sync.transport import DiskTransport
+from archive_files import archive_filename, archive_path
+from row_codec import EPOCH_COLUMNS, to_epoch
+
+# Адрес REST API Диска; переопределяется для локального фейкового сервера (benchmarks/fake_yandex_disk.py)
+DEFAULT_API_URL = "https://cloud-api.yandex.net/v1/disk"
+
+# Размер страницы при листинге папки
+LIST_PAGE_LIMIT = 100
+
 class YandexDiskWebDAV:
     """Простой класс для работы с Яндекс.Диском через HTTP API"""
     
@@ -36,25 +46,26 @@ class YandexDiskWebDAV:
             username: Логин Яндекс (например, user@yandex.ru)
             password: Пароль для внешних приложений (App Password)
         """
-        self.base_url = "https://cloud-api.yandex.net/v1/disk"
+        self.base_url = os.environ.get('YANDEX_DISK_API_URL', DEFAULT_API_URL)
         self.username = username
         self.password = password
         
-        # Создаем HTTP сессию с Basic Auth
-        self.session = requests.Session()
+        # HTTP транспорт с Basic Auth, таймаутами и повторами
         auth = base64.b64encode(f"{username}:{password}".encode()).decode()
-        self.session.headers.update({
+        self.transport = DiskTransport({
             'Authorization': f'Basic {auth}',
             'User-Agent': 'LegalCRM/1.0',
             'Accept': 'application/json'
         })
+        # Ссылки на скачивание ведут на отдельный хост и не требуют авторизации
+        self.href_transport = DiskTransport({'User-Agent': 'LegalCRM/1.0'})
         
         logger.info(f"🔐 Инициализирован YandexDisk клиент для пользователя {username}")
     
     def test_connection(self) -> bool:
         """Тестирование подключения к Яндекс.Диску"""
         try:
-            response = self.session.get(f"{self.base_url}/resources")
+            response = self.transport.request('GET', f"{self.base_url}/resources")
             if response.status_code == 200:
                 logger.info("✅ Подключение к Яндекс.Диску успешно")
                 return True
@@ -70,13 +81,19 @@ class YandexDiskWebDAV:
         try:
             # Проверяем существование директории
             encoded_path = urllib.parse.quote(path, safe='')
-            response = self.session.get(f"{self.base_url}/resources?path={encoded_path}")
+            response = self.transport.request('GET', f"{self.base_url}/resources?path={encoded_path}")
             
             if response.status_code == 200:
                 return True  # Директория уже существует
             
+            # API создает только последний уровень пути (иначе 409) - сначала родителя
+            parent = os.path.dirname(path.rstrip('/'))
+            if parent and parent != '/':
+                self._ensure_directory(parent)
+            
             # Создаем директорию
-            response = self.session.put(
+            response = self.transport.request(
+                'PUT',
                 f"{self.base_url}/resources?path={encoded_path}",
                 data='{}',
                 headers={'Content-Type': 'application/json'}
@@ -112,26 +129,33 @@ class YandexDiskWebDAV:
             if remote_dir:
                 self._ensure_directory(remote_dir)
             
-            # Читаем файл
-            with open(local_path, 'rb') as f:
-                file_data = f.read()
-            
-            # Загружаем файл
+            # Получаем ссылку для загрузки
             encoded_path = urllib.parse.quote(remote_path, safe='')
-            response = self.session.put(
-                f"{self.base_url}/resources/upload?path={encoded_path}",
-                data=file_data,
-                headers={'Content-Type': 'application/json'}
+            response = self.transport.request(
+                'GET',
+                f"{self.base_url}/resources/upload?path={encoded_path}&overwrite=true"
             )
             
-            if response.status_code in [200, 201, 202]:
+            if response.status_code != 200:
+                logger.error(f"❌ Не удалось получить ссылку для загрузки {remote_path}: {response.status_code} - {response.text}")
+                logger.error(f"❌ URL: {self.base_url}/resources/upload?path={encoded_path}")
+                return False
+            
+            upload_link = response.json()
+            upload_url = upload_link.get('href')
+            if not upload_url:
+                logger.error(f"❌ Не удалось получить ссылку для загрузки {remote_path}")
+                return False
+            
+            # Загружаем файл по ссылке потоком, не читая его целиком в память
+            with open(local_path, 'rb') as f:
+                upload_response = self.href_transport.request(upload_link.get('method', 'PUT'), upload_url, data=f)
+            
+            if upload_response.status_code in [200, 201, 202]:
                 logger.info(f"✅ Файл загружен: {remote_path}")
                 return True
             else:
-                logger.error(f"❌ Ошибка загрузки файла {remote_path}: {response.status_code} - {response.text}")
-                logger.error(f"❌ URL: {self.base_url}/resources/upload?path={encoded_path}")
-                logger.error(f"❌ Headers: {self.session.headers}")
-                logger.error(f"❌ Response headers: {dict(response.headers)}")
+                logger.error(f"❌ Ошибка загрузки файла {remote_path}: {upload_response.status_code} - {upload_response.text}")
                 return False
                 
         except Exception as e:
@@ -157,7 +181,7 @@ class YandexDiskWebDAV:
             
             # Получаем ссылку для скачивания
             encoded_path = urllib.parse.quote(remote_path, safe='')
-            response = self.session.get(f"{self.base_url}/resources/download?path={encoded_path}")
+            response = self.transport.request('GET', f"{self.base_url}/resources/download?path={encoded_path}")
             
             if response.status_code != 200:
                 logger.error(f"❌ Не удалось получить ссылку для скачивания {remote_path}: {response.status_code}")
@@ -171,16 +195,17 @@ class YandexDiskWebDAV:
                 logger.error(f"❌ Не удалось получить ссылку для скачивания {remote_path}")
                 return False
             
-            # Скачиваем файл
-            file_response = requests.get(download_url)
-            if file_response.status_code == 200:
+            # Скачиваем файл потоком
+            file_response = self.href_transport.request('GET', download_url, stream=True)
+            with file_response:
+                if file_response.status_code != 200:
+                    logger.error(f"❌ Ошибка скачивания файла {remote_path}: {file_response.status_code}")
+                    return False
                 with open(local_path, 'wb') as f:
-                    f.write(file_response.content)
-                logger.info(f"✅ Файл скачан: {remote_path}")
-                return True
-            else:
-                logger.error(f"❌ Ошибка скачивания файла {remote_path}: {file_response.status_code}")
-                return False
+                    for chunk in file_response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            logger.info(f"✅ Файл скачан: {remote_path}")
+            return True
                 
         except Exception as e:
             logger.error(f"❌ Ошибка скачивания файла {remote_path}: {e}")
@@ -198,7 +223,7 @@ class YandexDiskWebDAV:
         """
         try:
             encoded_path = urllib.parse.quote(remote_path, safe='')
-            response = self.session.delete(f"{self.base_url}/resources?path={encoded_path}")
+            response = self.transport.request('DELETE', f"{self.base_url}/resources?path={encoded_path}")
             
             if response.status_code in [200, 204]:
                 logger.info(f"✅ Файл удален: {remote_path}")
@@ -223,17 +248,23 @@ class YandexDiskWebDAV:
         """
         try:
             encoded_path = urllib.parse.quote(remote_path, safe='')
-            response = self.session.get(f"{self.base_url}/resources?path={encoded_path}")
-            
-            if response.status_code != 200:
-                logger.error(f"❌ Ошибка получения списка файлов {remote_path}: {response.status_code}")
-                return []
-            
-            data = response.json()
             files = []
-            
-            if '_embedded' in data and 'items' in data['_embedded']:
-                for item in data['_embedded']['items']:
+            offset = 0
+            
+            # API отдает содержимое папки страницами (по умолчанию только 20 элементов)
+            while True:
+                response = self.transport.request(
+                    'GET',
+                    f"{self.base_url}/resources?path={encoded_path}&limit={LIST_PAGE_LIMIT}&offset={offset}"
+                )
+                
+                if response.status_code != 200:
+                    logger.error(f"❌ Ошибка получения списка файлов {remote_path}: {response.status_code}")
+                    return []
+                
+                embedded = response.json().get('_embedded') or {}
+                items = embedded.get('items') or []
+                for item in items:
                     if item.get('type') == 'file':
                         files.append({
                             'name': item.get('name', ''),
@@ -241,6 +272,10 @@ class YandexDiskWebDAV:
                             'modified': item.get('modified', ''),
                             'path': item.get('path', '')
                         })
+                
+                offset += len(items)
+                if not items or offset >= embedded.get('total', 0):
+                    break
             
             return files
             
@@ -260,7 +295,7 @@ class YandexDiskWebDAV:
         """
         try:
             encoded_path = urllib.parse.quote(remote_path, safe='')
-            response = self.session.get(f"{self.base_url}/resources?path={encoded_path}")
+            response = self.transport.request('GET', f"{self.base_url}/resources?path={encoded_path}")
             return response.status_code == 200
         except Exception:
             return False
@@ -300,9 +335,10 @@ class DatabaseSyncManager:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # Получаем список всех таблиц
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+            # Получаем список всех таблиц и их схему (типы колонок, DEFAULT, ключи)
+            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table'")
+            schema = {row[0]: row[1] for row in cursor.fetchall()}
+            tables = list(schema)
             
             data = {
                 'export_info': {
@@ -311,6 +347,7 @@ class DatabaseSyncManager:
                     'tables_count': len(tables),
                     'tables': tables
                 },
+                'schema': {name: sql for name, sql in schema.items() if not name.startswith('sqlite_')},
                 'tables': {}
             }
             
@@ -349,6 +386,8 @@ class DatabaseSyncManager:
         Returns:
             bool: True если импорт успешен
         """
+        backup_path = None
+        conn = None
         try:
             # Создаем резервную копию текущей базы
             backup_path = self._create_local_backup()
@@ -359,54 +398,97 @@ class DatabaseSyncManager:
             # Отключаем проверки внешних ключей для быстрого импорта
             cursor.execute("PRAGMA foreign_keys = OFF")
             
-            # Удаляем все существующие таблицы (кроме системных)
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-            existing_tables = [row[0] for row in cursor.fetchall()]
+            # Удаляем все существующие таблицы (кроме системных), запомнив их схему:
+            # в старых выгрузках схемы нет, и таблицы создаются как в текущей базе
+            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+            local_schema = {row[0]: row[1] for row in cursor.fetchall()}
             
-            for table in existing_tables:
+            for table in local_schema:
                 cursor.execute(f"DROP TABLE IF EXISTS {table}")
             
             # Импортируем каждую таблицу из JSON
-            if 'tables' in data:
-                for table_name, table_data in data['tables'].items():
-                    if table_data:  # Если таблица не пуста
-                        self._create_table_from_data(cursor, table_name, table_data)
+            schema = {**local_schema, **data.get('schema', {})}
+            tables = data.get('tables', {})
+            for table_name, table_data in tables.items():
+                if table_name.startswith('sqlite_'):
+                    continue
+                if table_data or table_name in schema:
+                    self._create_table_from_data(cursor, table_name, table_data, schema.get(table_name))
+            
+            # Счетчики AUTOINCREMENT: id удаленных до выгрузки строк не выдаются повторно
+            for row in tables.get('sqlite_sequence', []):
+                cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (row['seq'], row['name']))
+                if not cursor.rowcount:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (row['name'], row['seq']))
+            
+            # Данные вставлены без проверки внешних ключей: init_database заново удалит сирот
+            cursor.execute("PRAGMA user_version = 0")
             
             # Включаем проверки внешних ключей обратно
             cursor.execute("PRAGMA foreign_keys = ON")
             
             conn.commit()
             conn.close()
+            conn = None
             
             logger.info(f"✅ База данных импортирована из JSON: {len(data.get('tables', {}))} таблиц")
             return True
             
         except Exception as e:
             logger.error(f"❌ Ошибка импорта базы данных: {e}")
+            # Незакрытое соединение держит блокировку записи и откатило бы восстановление
+            if conn is not None:
+                conn.close()
             # Восстанавливаем из резервной копии
             if backup_path and os.path.exists(backup_path):
                 shutil.copy2(backup_path, self.db_path)
                 logger.info("🔄 База данных восстановлена из резервной копии")
             return False
     
-    def _create_table_from_data(self, cursor, table_name: str, table_data: List[Dict]):
-        """Создание таблицы и заполнение данными из JSON"""
+    def _create_table_from_data(self, cursor, table_name: str, table_data: List[Dict],
+                                create_sql: Optional[str] = None):
+        """
+        Создание таблицы и заполнение данными из JSON
+        
+        Таблица создается по схеме из выгрузки (или текущей базы), значения
+        вставляются с типами JSON: числа остаются числами, null - NULL.
+        Метки времени горячих таблиц из старых выгрузок (текст
+        'YYYY-MM-DD HH:MM:SS') переводятся в секунды UTC.
+        """
+        if create_sql:
+            cursor.execute(create_sql)
+        else:
+            # Схемы нет - тип колонки по первому непустому значению
+            columns = list(table_data[0].keys())
+            types = {bool: 'INTEGER', int: 'INTEGER', float: 'REAL', str: 'TEXT'}
+            definitions = []
+            for col in columns:
+                sample = next((row[col] for row in table_data if row.get(col) is not None), None)
+                definitions.append(f"{col} {types.get(type(sample), '')}".rstrip())
+            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(definitions)})")
         if not table_data:
             return
         
-        # Получаем колонки из первого элемента
-        columns = list(table_data[0].keys())
-        
-        # Создаем таблицу
-        create_sql = f"CREATE TABLE {table_name} ({', '.join([f'{col} TEXT' for col in columns])})"
-        cursor.execute(create_sql)
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        declared = {row[1]: row[2].upper() for row in cursor.fetchall()}
+        columns = [col for col in table_data[0].keys() if col in declared]
+        skipped = [col for col in table_data[0].keys() if col not in declared]
+        if skipped:
+            logger.warning(f"⚠️ {table_name}: колонок нет в схеме, пропущены: {', '.join(skipped)}")
+        epoch_indexes = [index for index, col in enumerate(columns)
+                         if col in EPOCH_COLUMNS.get(table_name, ()) and declared[col] == 'INTEGER']
         
         # Вставляем данные
+        placeholders = ', '.join(['?' for _ in columns])
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        rows = []
         for row_data in table_data:
-            values = [str(row_data.get(col, '')) for col in columns]
-            placeholders = ', '.join(['?' for _ in columns])
-            insert_sql = f"INSERT INTO {table_name} VALUES ({placeholders})"
-            cursor.execute(insert_sql, values)
+            values = [row_data.get(col) for col in columns]
+            for index in epoch_indexes:
+                if isinstance(values[index], str):
+                    values[index] = to_epoch(values[index])
+            rows.append(values)
+        cursor.executemany(insert_sql, rows)
     
     def _create_local_backup(self) -> Optional[str]:
         """Создание локальной резервной копии"""
@@ -425,14 +507,109 @@ class DatabaseSyncManager:
             logger.error(f"❌ Ошибка создания локальной резервной копии: {e}")
             return None
     
+    def upload_archives(self) -> bool:
+        """
+        Загрузка архивных файлов действий, измененных после прошлой выгрузки
+        
+        Файл прошлых лет после переноса в него строк больше не меняется,
+        поэтому выгружается один раз; загружается согласованная копия
+        (онлайн-бэкап SQLite), а выгруженная ревизия запоминается в
+        activity_archives.
+        
+        Returns:
+            bool: True если все измененные файлы загружены
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            pending = conn.execute("""
+                SELECT year, revision FROM activity_archives
+                WHERE synced_revision IS NULL OR synced_revision < revision
+                ORDER BY year
+            """).fetchall()
+        except sqlite3.OperationalError:
+            # База еще без архива
+            pending = []
+        finally:
+            conn.close()
+        
+        success = True
+        for year, revision in pending:
+            local_path = archive_path(self.db_path, year)
+            if not os.path.exists(local_path):
+                logger.warning(f"⚠️  Нет архивного файла {local_path}")
+                continue
+            snapshot_path = os.path.join(self.backup_dir, archive_filename(year))
+            source, target = sqlite3.connect(local_path), sqlite3.connect(snapshot_path)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            
+            uploaded = self.yandex_disk.upload_file(snapshot_path, f"{self.remote_path}archive/{archive_filename(year)}")
+            os.remove(snapshot_path)
+            if not uploaded:
+                success = False
+                continue
+            
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute("""
+                        UPDATE activity_archives
+                        SET synced_revision = ?, synced_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE year = ?
+                    """, (revision, year))
+            finally:
+                conn.close()
+            logger.info(f"🗄️ Архив {year} загружен на Яндекс.Диск (ревизия {revision})")
+        return success
+    
+    def download_archives(self) -> int:
+        """
+        Скачивание архивных файлов, которых нет локально (после импорта базы)
+        
+        Returns:
+            int: Число скачанных файлов
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            years = [row[0] for row in conn.execute("SELECT year FROM activity_archives ORDER BY year").fetchall()]
+        except sqlite3.OperationalError:
+            years = []
+        finally:
+            conn.close()
+        
+        downloaded = 0
+        for year in years:
+            local_path = archive_path(self.db_path, year)
+            if os.path.exists(local_path):
+                continue
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            # Через временный файл: недокачанный архив не должен подключиться к спискам
+            temp_path = f"{local_path}.download"
+            if self.yandex_disk.download_file(f"{self.remote_path}archive/{archive_filename(year)}", temp_path):
+                os.replace(temp_path, local_path)
+                downloaded += 1
+            else:
+                logger.warning(f"⚠️  Архив {year} не скачан: действия этого года недоступны до следующей попытки")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return downloaded
+    
     def upload_to_cloud(self) -> bool:
         """
         Загрузка базы данных на Яндекс.Диск в единый файл
         
+        Архивные файлы действий загружаются отдельно и до выгрузки базы,
+        чтобы в ней уже были отмечены выгруженные ревизии.
+        
         Returns:
             bool: True если загрузка успешна
         """
         try:
+            archives_uploaded = self.upload_archives()
+            
             # Экспортируем базу данных в JSON
             data = self.export_database_to_json()
             
@@ -452,6 +629,9 @@ class DatabaseSyncManager:
             if os.path.exists(temp_json_path):
                 os.remove(temp_json_path)
             
+            if success and not archives_uploaded:
+                logger.error("❌ База данных загружена, но часть архивных файлов - нет")
+                return False
             if success:
                 logger.info(f"✅ База данных загружена на Яндекс.Диск: {remote_file_path}")
                 return True
@@ -504,6 +684,7 @@ class DatabaseSyncManager:
                 os.remove(temp_json_path)
             
             if import_success:
+                self.download_archives()
                 logger.info(f"✅ База данных загружена из облака: {remote_file_path}")
                 return {
                     'success': True,
@@ -592,6 +773,7 @@ class DatabaseSyncManager:
                 os.remove(temp_json_path)
             
             if import_success:
+                self.download_archives()
                 logger.info(f"✅ Восстановление из резервной копии завершено: {backup_filename}")
                 return {
                     'success': True,